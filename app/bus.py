@@ -0,0 +1,126 @@
+import asyncio
+import socket
+import struct
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from app.logs import logger
+
+FRAME_HEADER = struct.Struct('>IB')
+
+BusHandler = Callable[[bytes], None]
+
+
+def encode_frame(topic: str, data: bytes) -> bytes:
+    topic_bytes = topic.encode()
+    return FRAME_HEADER.pack(len(data), len(topic_bytes)) + topic_bytes + data
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[bytes, bytes]:
+    """Returns the raw header and body (topic followed by data) of the next frame."""
+    header = await reader.readexactly(FRAME_HEADER.size)
+    data_length, topic_length = FRAME_HEADER.unpack(header)
+    return header, await reader.readexactly(topic_length + data_length)
+
+
+async def drain_if_full(writer: asyncio.StreamWriter, max_buffered_bytes: int):
+    """Waits for the peer to read the buffered frames once more than max_buffered_bytes are waiting."""
+    if writer.transport.get_write_buffer_size() <= max_buffered_bytes:
+        return
+    try:
+        await writer.drain()
+    except ConnectionError:
+        pass
+
+
+class BusBroker:
+    """
+    Runs in the master process and relays every frame received from a worker to all other workers,
+    in the order it was received. Frames are not decoded beyond their header.
+    Once more than max_buffered_bytes are waiting to be written to a worker, frames of the sender are
+    not read until that worker drains them, so a stalled worker can't make the broker buffer without limit.
+    """
+
+    def __init__(self, sock: socket.socket, max_buffered_bytes: int = 1024 * 1024):
+        self._sock = sock
+        self._max_buffered_bytes = max_buffered_bytes
+        self._writers: Set[asyncio.StreamWriter] = set()
+
+    @property
+    def workers_count(self) -> int:
+        return len(self._writers)
+
+    async def run(self):
+        server = await asyncio.start_unix_server(self._on_worker, sock=self._sock)
+        async with server:
+            await server.serve_forever()
+
+    async def _on_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        try:
+            while True:
+                header, body = await read_frame(reader)
+                other_writers = [other_writer for other_writer in self._writers if other_writer is not writer]
+                for other_writer in other_writers:
+                    other_writer.write(header)
+                    other_writer.write(body)
+                for other_writer in other_writers:
+                    await drain_if_full(other_writer, self._max_buffered_bytes)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+class WorkerBus:
+    """
+    Connection of a worker to the BusBroker. Events published by a worker are delivered to the
+    handlers subscribed to their topic in every other worker. Until connected (e.g. when running
+    as a single process) publish does nothing. Like in the broker, publish waits for the broker to
+    read once more than max_buffered_bytes are waiting to be written to it.
+    """
+
+    def __init__(self, max_buffered_bytes: int = 1024 * 1024):
+        self._max_buffered_bytes = max_buffered_bytes
+        self._handlers: Dict[str, List[BusHandler]] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    def subscribe(self, topic: str, handler: BusHandler):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    async def publish(self, topic: str, data: bytes):
+        writer = self._writer
+        if writer is not None:
+            writer.write(encode_frame(topic, data))
+            await drain_if_full(writer, self._max_buffered_bytes)
+
+    async def connect(self, path: str):
+        reader, self._writer = await asyncio.open_unix_connection(path)
+        self._reader_task = asyncio.create_task(self._read(reader))
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _read(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                header, body = await read_frame(reader)
+                topic_length = header[-1]
+                topic, data = body[:topic_length].decode(), body[topic_length:]
+                for handler in self._handlers.get(topic, ()):
+                    try:
+                        handler(data)
+                    except Exception:
+                        logger.error(f'bus handler of {topic} failed', exc_info=True)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.warning('worker bus connection closed')
+            self._writer = None
@@ -0,0 +1,48 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+
+class LRUCache:
+    """
+    Bounded mapping which evicts the least recently used entry when full and,
+    if ttl_s is set, treats entries older than ttl_s seconds as missing.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_s: Optional[float] = None):
+        self._max_size = max_size
+        self._ttl_s = ttl_s
+        self._items: OrderedDict[Hashable, Tuple[Any, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            self._items.pop(key)
+            self.misses += 1
+            return default
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        expires_at = time.monotonic() + self._ttl_s if self._ttl_s is not None else float('inf')
+        self._items[key] = (value, expires_at)
+        self._items.move_to_end(key)
+        if len(self._items) > self._max_size:
+            self._items.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._items.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self):
+        self._items.clear()
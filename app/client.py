@@ -1,8 +1,7 @@
 import asyncio
 import enum
-import json
 from asyncio import Event
-from typing import Optional
+from typing import List, Optional, Tuple, Type, TypeVar
 
 import aioconsole
 from reactivestreams.publisher import DefaultPublisher
@@ -15,21 +14,29 @@ from rsocket.payload import Payload
 from rsocket.rsocket_client import RSocketClient
 from rsocket.transports.tcp import TransportTCP
 
+from app.codecs import Codec, JSON_CODEC, get_codec
 from app.schemas import LoginRequest, AuthResponse, User, RegisterRequest, RegisterResponse, LogoutRequest, \
-    LogoutResponse, FindUsersRequest, FindUsersResponse, CheckSessionResponse, GetUserByIdRequest, \
-    GetUserByIdResponse, Message, SendMessageRequest, SendMessageResponse, OnlineMetric, TotalOnlineMetric, \
-    MetricRequest
-from app.utils import schema_to_bytes, payload_to_schema
+    LogoutResponse, FindUsersRequest, FindUsersResponse, GetUserByIdRequest, \
+    GetUserByIdResponse, Message, SendMessageRequest, SendMessageResponse, TotalOnlineMetric, \
+    MetricRequest, IncomingMessagesRequest, GetDialogMessagesRequest, GetDialogMessagesResponse, \
+    GetDialogsRequest, GetDialogsResponse, RoomMessage, Receipt, ReceiptRequest, BaseRequest, BaseResponse, \
+    BatchItem, BatchRequest
+from app.utils import schema_to_bytes, payload_to_schema, max_id
+
+DATA_ENCODING = JSON_CODEC.mime_type
+
+T = TypeVar('T', bound=BaseResponse)
 
 
 class StatisticsHandler(DefaultPublisher, DefaultSubscriber, DefaultSubscription):
 
-    def __init__(self):
+    def __init__(self, codec: Codec = JSON_CODEC):
         super().__init__()
         self.done = Event()
+        self._codec = codec
 
     def on_next(self, value: Payload, is_complete=False):
-        total_online = payload_to_schema(value, TotalOnlineMetric)
+        total_online = payload_to_schema(value, TotalOnlineMetric, self._codec)
         print('total online:', total_online)
 
         if is_complete:
@@ -39,44 +46,92 @@ class StatisticsHandler(DefaultPublisher, DefaultSubscriber, DefaultSubscription
         self.subscription.cancel()
 
     def start_statistics_requesting(self,):
-        self._subscriber.on_next(schema_to_bytes(MetricRequest()))
+        self._subscriber.on_next(schema_to_bytes(MetricRequest(), self._codec))
 
 
 class ChatClient:
-    def __init__(self, rsocket: RSocketClient):
+    def __init__(self, rsocket: RSocketClient, codec: Codec = JSON_CODEC, auto_batch: bool = False):
+        """
+        With auto_batch, requests issued within the same event loop iteration are sent together as one
+        batch request; their responses still resolve each call separately.
+        """
         self._rsocket = rsocket
+        self._codec = codec
+        self._auto_batch = auto_batch
+        self._pending: List[Tuple[str, BaseRequest, Type[BaseResponse], asyncio.Future]] = []
+        self._pending_sender: Optional[asyncio.Task] = None
 
         self._message_subscriber: Optional = None
+        self._last_message_id: Optional[int] = None
 
         self._session: str = None
         self._user: User = None
         self._current_user_dialog: User = None
-        self._online = False
-        self._online_sending_task = None
         self._statistics_subscriber: StatisticsHandler = None
 
+    async def _request_response(self, route_name: str, request: BaseRequest, response_class: Type[T]) -> T:
+        if not self._auto_batch:
+            return await self._send_request(route_name, request, response_class)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((route_name, request, response_class, future))
+        if len(self._pending) == 1:
+            self._pending_sender = asyncio.create_task(self._send_pending())
+        return await future
+
+    async def _send_request(self, route_name: str, request: BaseRequest, response_class: Type[T]) -> T:
+        request_payload = Payload(schema_to_bytes(request, self._codec), composite(route(route_name)))
+        response_payload = await self._rsocket.request_response(request_payload)
+        return payload_to_schema(response_payload, response_class, self._codec)
+
+    async def _send_pending(self):
+        pending, self._pending = self._pending, []
+        try:
+            if len(pending) == 1:
+                route_name, request, response_class, future = pending[0]
+                results = [await self._send_request(route_name, request, response_class)]
+            else:
+                results = await self._send_batch(pending)
+        except Exception as e:
+            for *_, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (*_, future), result in zip(pending, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _send_batch(self, pending: list) -> List[BaseResponse]:
+        request = BatchRequest(requests=[BatchItem(route=route_name, data=request.model_dump(mode='json'))
+                                         for route_name, request, _, _ in pending])
+        request_payload = Payload(schema_to_bytes(request, self._codec), composite(route('batch')))
+        response_payload = await self._rsocket.request_response(request_payload)
+        response = self._codec.loads(response_payload.data)
+        if not response['success']:
+            return [response_class(success=False, error=response['error']) for _, _, response_class, _ in pending]
+        return [response_class.model_validate(result)
+                for (_, _, response_class, _), result in zip(pending, response['results'])]
+
     async def login(self, username: str):
         if self._session:
             print('cannot login from already logged in account; please, logout and try again')
             return
         request = LoginRequest(username=username)
-        request_payload = Payload(schema_to_bytes(request), composite(route('login')))
+        request_payload = Payload(schema_to_bytes(request, self._codec), composite(route('login')))
         response_payload = await self._rsocket.request_response(request_payload)
-        response: AuthResponse = payload_to_schema(response_payload, AuthResponse)
+        response: AuthResponse = payload_to_schema(response_payload, AuthResponse, self._codec)
         if response.success:
             print(f'successfully logged in as {response.user.username}')
             self._session = response.session
             self._user = response.user
-            self._online_sending_task = asyncio.create_task(self.send_online())
             self.listen_for_statistics(MetricRequest())
         else:
             print('cannot login:', response.error)
 
     async def register(self, username: str):
         request = RegisterRequest(username=username)
-        request_payload = Payload(schema_to_bytes(request), composite(route('register')))
+        request_payload = Payload(schema_to_bytes(request, self._codec), composite(route('register')))
         response_payload = await self._rsocket.request_response(request_payload)
-        response: RegisterResponse = payload_to_schema(response_payload, RegisterResponse)
+        response: RegisterResponse = payload_to_schema(response_payload, RegisterResponse, self._codec)
         if response.success:
             print(f'successfully registered as {response.user.username}; please, auth with your credentials')
         else:
@@ -86,11 +141,10 @@ class ChatClient:
         if not self._session:
             print('cannot logout: operation can be performed if you logged in')
             return
-        request = LogoutRequest(session=self._session)
-        request_payload = Payload(schema_to_bytes(request), composite(route('logout')))
+        request = LogoutRequest()
+        request_payload = Payload(schema_to_bytes(request, self._codec), composite(route('logout')))
         response_payload = await self._rsocket.request_response(request_payload)
-        response: LogoutResponse = payload_to_schema(response_payload, LogoutResponse)
-        self.stop_sending_online()
+        response: LogoutResponse = payload_to_schema(response_payload, LogoutResponse, self._codec)
         print(f'successfully logged out')
         self._statistics_subscriber.cancel()
         self._session = None
@@ -98,35 +152,39 @@ class ChatClient:
         self._current_user_dialog = None
 
     async def find_users(self, username_part: str):
-        request = FindUsersRequest(username_part=username_part, session=self._session)
-        request_payload = Payload(schema_to_bytes(request), composite(route('find_users')))
-        response_payload = await self._rsocket.request_response(request_payload)
-        response: FindUsersResponse = payload_to_schema(response_payload, FindUsersResponse)
+        request = FindUsersRequest(username_part=username_part)
+        response: FindUsersResponse = await self._request_response('find_users', request, FindUsersResponse)
         if response.success:
             print(f'found {len(response.users)} users: ')
             for user in response.users:
                 print(f'-- {user}')
         else:
-            response: CheckSessionResponse = payload_to_schema(response_payload, CheckSessionResponse)
             print(f'cannot find users: {response.error}; you must logged in for perform this operation')
 
     async def get_user_by_id(self, user_id: int) -> Optional[User]:
         if not self._session:
             print('error: operation can be performed if you logged in')
             return
-        request = GetUserByIdRequest(user_id=user_id, session=self._session)
-        request_payload = Payload(schema_to_bytes(request), composite(route('get_user_by_id')))
-        response_payload = await self._rsocket.request_response(request_payload)
-        response: GetUserByIdResponse = payload_to_schema(response_payload, GetUserByIdResponse)
+        request = GetUserByIdRequest(user_id=user_id)
+        response: GetUserByIdResponse = await self._request_response('get_user_by_id', request, GetUserByIdResponse)
         if response.success:
             print(f'got user: {response.user}')
             return response.user
         else:
-            response: CheckSessionResponse = payload_to_schema(response_payload, CheckSessionResponse)
             print(f'cannot find users: {response.error}; you must logged in for perform this operation')
 
     async def get_dialogs(self):
-        pass
+        if not self._session:
+            print('cannot get dialogs: operation can be performed if you logged in')
+            return
+        request = GetDialogsRequest()
+        response: GetDialogsResponse = await self._request_response('get_dialogs', request, GetDialogsResponse)
+        if response.success:
+            print(f'found {len(response.dialogs)} dialogs: ')
+            for dialog in response.dialogs:
+                print(f'-- {dialog.with_user} (unread: {dialog.unread_count})')
+        else:
+            print(f'cannot get dialogs: {response.error}; you must logged in for perform this operation')
 
     async def set_dialog(self, with_user_id: int) -> Optional[User]:
         if not self._session:
@@ -143,6 +201,7 @@ class ChatClient:
             return
         print(f'set current dialog with user {user}')
         self._current_user_dialog = user
+        await self.get_dialog_messages()
         self.listen_for_messages()
         return user
 
@@ -157,42 +216,60 @@ class ChatClient:
             self._current_user_dialog = None
             self.stop_listening_for_messages()
 
-    async def get_dialog_messages(self):
-        pass
+    async def get_dialog_messages(self, before_id: Optional[int] = None,
+                                  limit: int = 20) -> Optional[GetDialogMessagesResponse]:
+        if not self._session or not self._current_user_dialog:
+            print('cannot get dialog messages: operation can be performed if you logged in and set dialog')
+            return
+        request = GetDialogMessagesRequest(with_user_id=self._current_user_dialog.id,
+                                           before_id=before_id,
+                                           limit=limit)
+        response: GetDialogMessagesResponse = await self._request_response('get_dialog_messages', request,
+                                                                           GetDialogMessagesResponse)
+        if response.success:
+            for message in response.messages:
+                print(f'message from {response.users.get(message.from_user_id)}: {message.message_text}')
+            if response.messages and before_id is None:
+                self.send_receipt(self._current_user_dialog.id, read_message_id=response.messages[-1].id)
+            return response
+        else:
+            print(f'error: {response.error}; you must logged in for perform this operation')
 
     async def send_message(self, message_text: str):
-        request = SendMessageRequest(from_user_id=self._user.id,
-                                     to_user_id=self._current_user_dialog.id,
-                                     message_text=message_text,
-                                     session=self._session)
-        request_payload = Payload(schema_to_bytes(request), composite(route('send_message')))
-        response_payload = await self._rsocket.request_response(request_payload)
-        response: SendMessageResponse = payload_to_schema(response_payload, SendMessageResponse)
+        request = SendMessageRequest(to_user_id=self._current_user_dialog.id,
+                                     message_text=message_text)
+        response: SendMessageResponse = await self._request_response('send_message', request, SendMessageResponse)
         if response.success:
             pass
         else:
-            response: CheckSessionResponse = payload_to_schema(response_payload, CheckSessionResponse)
             print(f'error: {response.error}; you must logged in for perform this operation')
 
-    async def send_online(self):
-        self._online = True
-        # logger.debug('start sending online')
-        while self._online:
-            await asyncio.sleep(5)
-            payload = Payload(schema_to_bytes(OnlineMetric(session=self._session)),
-                              metadata=composite(route('online')))
-            await self._rsocket.fire_and_forget(payload)
-            # logger.debug('send online')
-
-    def stop_sending_online(self):
-        self._online = False
-        # logger.debug('stop sending online')
+    def send_receipt(self, with_user_id: int, delivered_message_id: Optional[int] = None,
+                     read_message_id: Optional[int] = None):
+        request = ReceiptRequest(with_user_id=with_user_id,
+                                 delivered_message_id=delivered_message_id,
+                                 read_message_id=read_message_id)
+        self._rsocket.fire_and_forget(Payload(schema_to_bytes(request, self._codec), composite(route('receipts'))))
 
     def listen_for_messages(self):
         def print_message(data: bytes):
-            message = Message.model_validate(json.loads(data))
+            message_dict = self._codec.loads(data)
+            if 'peer_id' in message_dict:
+                receipt = Receipt.model_validate(message_dict)
+                if receipt.user_id == self._current_user_dialog.id:
+                    print(f'-- delivered up to {receipt.delivered_message_id}, read up to {receipt.read_message_id}')
+                return
+            if 'room_id' in message_dict:
+                message = RoomMessage.model_validate(message_dict)
+                print(f'message in room {message.room_id} from {message.from_user_id}: {message.message_text}')
+                return
+            message = Message.model_validate(message_dict)
+            self._last_message_id = max_id(self._last_message_id, message.id)
             if message.from_user.id == self._current_user_dialog.id:
                 print(f'message from {message.from_user}: {message.message_text}')
+                self.send_receipt(message.from_user.id, read_message_id=message.id)
+            else:
+                self.send_receipt(message.from_user.id, delivered_message_id=message.id)
 
         class MessageListener(DefaultSubscriber, DefaultSubscription):
             def __init__(self):
@@ -208,18 +285,19 @@ class ChatClient:
                 self.subscription.cancel()
 
         self._message_subscriber = MessageListener()
+        request = IncomingMessagesRequest(since_message_id=self._last_message_id)
         self._rsocket.request_stream(
-            Payload(metadata=composite(route('messages.incoming')))
+            Payload(schema_to_bytes(request, self._codec), composite(route('messages.incoming')))
         ).subscribe(self._message_subscriber)
 
     def stop_listening_for_messages(self):
         self._message_subscriber.cancel()
 
     def listen_for_statistics(self, request: MetricRequest) -> StatisticsHandler:
-        self._statistics_subscriber = StatisticsHandler()
+        self._statistics_subscriber = StatisticsHandler(self._codec)
 
         response = self._rsocket.request_channel(Payload(
-            data=schema_to_bytes(request),
+            data=schema_to_bytes(request, self._codec),
             metadata=composite(route('statistics')
                                )), publisher=self._statistics_subscriber)
 
@@ -235,13 +313,16 @@ class CommandsEnum(enum.Enum):
     FIND_USERS = ('4', 'find_users')
     SET_DIALOG = ('5', 'set_dialog')
     QUIT_DIALOG = ('6', 'quit_dialog')
+    GET_DIALOGS = ('7', 'get_dialogs')
 
 
 async def main():
+    codec = get_codec(DATA_ENCODING)
     connection = await asyncio.open_connection('localhost', 1875)
     async with RSocketClient(single_transport_provider(TransportTCP(*connection)),
+                             data_encoding=codec.mime_type,
                              metadata_encoding=WellKnownMimeTypes.MESSAGE_RSOCKET_COMPOSITE_METADATA) as client:
-        user = ChatClient(client)
+        user = ChatClient(client, codec)
         cmd = ''
         print('commands:')
         for command in CommandsEnum:
@@ -261,6 +342,8 @@ async def main():
             elif cmd in CommandsEnum.FIND_USERS.value:
                 username_part = await aioconsole.ainput('username_part: ')
                 await user.find_users(username_part)
+            elif cmd in CommandsEnum.GET_DIALOGS.value:
+                await user.get_dialogs()
             elif cmd in CommandsEnum.SET_DIALOG.value:
                 with_user_id = await aioconsole.ainput('with_user_id: ')
                 try:
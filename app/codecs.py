@@ -0,0 +1,108 @@
+import abc
+import json
+from typing import Any, Dict, Optional, Type, Union
+
+from pydantic import BaseModel
+from rsocket.frame_helpers import ensure_bytes
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Codec(abc.ABC):
+    """
+    Encoding of payload data, selected per connection by the data MIME type of its SETUP frame.
+    Binary codecs encode the JSON-compatible form of a schema, so every codec round-trips the
+    same values.
+    """
+
+    mime_type: str
+
+    @abc.abstractmethod
+    def dumps(self, value: Any) -> bytes:
+        ...
+
+    @abc.abstractmethod
+    def loads(self, data: bytes) -> Any:
+        ...
+
+    def encode(self, schema: BaseModel) -> bytes:
+        return self.dumps(schema.model_dump(mode='json'))
+
+    def decode(self, data: bytes, schema_class: Type[BaseModel]) -> BaseModel:
+        return schema_class.model_validate(self.loads(data))
+
+
+class JsonCodec(Codec):
+    mime_type = 'application/json'
+
+    def dumps(self, value: Any) -> bytes:
+        return ensure_bytes(json.dumps(value, separators=(',', ':')))
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+    def encode(self, schema: BaseModel) -> bytes:
+        return ensure_bytes(schema.model_dump_json())
+
+    def decode(self, data: bytes, schema_class: Type[BaseModel]) -> BaseModel:
+        return schema_class.model_validate_json(data)
+
+
+class MsgPackCodec(Codec):
+    """
+    Payloads about 15% smaller than JSON, for clients on slow links. It saves no CPU: pydantic parses
+    and validates JSON in one pass, while MessagePack data is unpacked into Python objects first, so
+    decoding takes up to 1.5 times as long as JSON (see benchmarks/payload_codecs.py).
+    """
+
+    mime_type = 'application/x-msgpack'
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data)
+
+
+JSON_CODEC = JsonCodec()
+CODECS: Dict[str, Codec] = {}
+
+
+def register_codec(codec: Codec):
+    CODECS[codec.mime_type] = codec
+
+
+def get_codec(mime_type: Union[str, bytes, bytearray, None]) -> Optional[Codec]:
+    """Codec of the MIME type, JSON if none is given, or None if the type is not supported."""
+    if not mime_type:
+        return JSON_CODEC
+    if isinstance(mime_type, (bytes, bytearray)):
+        mime_type = mime_type.decode()
+    return CODECS.get(mime_type)
+
+
+register_codec(JSON_CODEC)
+if msgpack is not None:
+    register_codec(MsgPackCodec())
+
+
+class EncodedSchema:
+    """
+    Schema shared by many receivers together with its encodings, each produced on first use,
+    so a message fanned out to connections with different codecs is encoded once per codec.
+    """
+
+    __slots__ = ('schema', '_encodings')
+
+    def __init__(self, schema: BaseModel, codec: Optional[Codec] = None, data: Optional[bytes] = None):
+        self.schema = schema
+        self._encodings: Dict[str, bytes] = {} if codec is None else {codec.mime_type: data}
+
+    def encode(self, codec: Codec) -> bytes:
+        data = self._encodings.get(codec.mime_type)
+        if data is None:
+            data = self._encodings[codec.mime_type] = codec.encode(self.schema)
+        return data
@@ -1,10 +1,54 @@
-from typing import Callable, List
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Awaitable, Callable, Dict, List, Set, Tuple, Optional, Union
 
-from sqlalchemy.orm import Session
+from sqlalchemy import text, func, update, delete
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session, aliased, Query
 
-from app.models import User, Message
+from app.cache import LRUCache
+from app.models import User, Message, Dialog, Room, RoomMember, RoomMessage, UserSession
 import app.schemas as schemas
-from app.utils import message_model_as_schema, user_model_as_schema
+from app.utils import message_model_as_schema, user_model_as_schema, escape_like, room_model_as_schema, \
+    room_message_model_as_schema, message_rows_as_schemas, lean_message_rows_as_schemas
+
+SEARCH_TRIGRAM_LENGTH = 3
+
+
+def keyset_page(query: Query, id_column, before_id: int = None, after_id: int = None, limit: int = None) -> list:
+    """
+    Keyset pagination on id_column: up to limit rows with before_id > id > after_id,
+    the newest ones unless only after_id is set, always ordered by id.
+    """
+    if before_id is not None:
+        query = query.filter(id_column < before_id)
+    if after_id is not None:
+        query = query.filter(id_column > after_id)
+    newest_first = after_id is None or before_id is not None
+    rows = query.order_by(id_column.desc() if newest_first else id_column).limit(limit).all()
+    if newest_first:
+        rows.reverse()
+    return rows
+
+
+def message_rows_query(session: Session) -> Query:
+    """
+    Column-only message rows with the usernames of both users, in the layout of message_rows_as_schemas:
+    no ORM instances are built, so no identity map or relationship loading is involved.
+    """
+    from_user = aliased(User)
+    to_user = aliased(User)
+    return session.query(Message.id, Message.message_text, Message.from_user_id, Message.to_user_id,
+                         Message.load_timestamp, from_user.username, to_user.username).\
+        join(from_user, Message.from_user_id == from_user.id).\
+        join(to_user, Message.to_user_id == to_user.id)
+
+
+def lean_message_rows_query(session: Session) -> Query:
+    """Column-only message rows without users, in the layout of lean_message_rows_as_schemas."""
+    return session.query(Message.id, Message.message_text, Message.from_user_id, Message.to_user_id,
+                         Message.load_timestamp)
 
 
 class UserAccountCRUD:
@@ -36,9 +80,43 @@ class UserAccountCRUD:
                 raise Exception("user does not  exists")
             return user_model_as_schema(user)
 
+    def get_by_ids(self, users_ids: List[int]) -> List[schemas.User]:
+        with self._session() as session:
+            users = session.query(User).where(User.id.in_(users_ids)).all()
+            return [user_model_as_schema(user) for user in users]
+
     def find_by_username_part(self, username_part: str, limit: int = None) -> List[schemas.User]:
+        """
+        Users whose names start with username_part come first, then other names containing it.
+        Parts of 3+ characters are looked up in the trigram index; shorter ones use the lower(username) index
+        for the prefix matches and fall back to a scan bounded by limit.
+        """
         with self._session() as session:
-            users = session.query(User).filter(User.username.ilike(f'%{username_part}%')).limit(limit)
+            if len(username_part) >= SEARCH_TRIGRAM_LENGTH:
+                rows = session.execute(text(
+                    'SELECT user_account.id, user_account.username FROM user_account_fts '
+                    'JOIN user_account ON user_account.id = user_account_fts.rowid '
+                    'WHERE user_account_fts MATCH :query '
+                    "ORDER BY user_account.username NOT LIKE :prefix ESCAPE '\\', "
+                    'length(user_account.username), user_account.id '
+                    'LIMIT :limit'),
+                    {'query': '"' + username_part.replace('"', '""') + '"',
+                     'prefix': escape_like(username_part) + '%',
+                     'limit': -1 if limit is None else limit}).all()
+                return [schemas.User(id=user_id, username=username) for user_id, username in rows]
+            if not username_part:
+                users = session.query(User).order_by(User.id).limit(limit).all()
+                return [user_model_as_schema(user) for user in users]
+            part = username_part.lower()
+            users = session.query(User).\
+                filter(func.lower(User.username) >= part,
+                       func.lower(User.username) < part[:-1] + chr(ord(part[-1]) + 1)).\
+                order_by(func.lower(User.username)).limit(limit).all()
+            if limit is None or len(users) < limit:
+                found_ids = [user.id for user in users]
+                users += session.query(User).\
+                    filter(User.username.ilike(f'%{username_part}%'), User.id.not_in(found_ids)).\
+                    limit(None if limit is None else limit - len(users)).all()
             return [user_model_as_schema(user) for user in users]
 
 
@@ -48,11 +126,30 @@ class MessageCRUD:
         self._session = session
 
     def create(self, message_text: str, from_user_id: int, to_user_id: int) -> schemas.Message:
+        [message] = self.create_many([(message_text, from_user_id, to_user_id)])
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    def create_many(self, messages: List[Tuple[str, int, int]]) -> List[Union[schemas.Message, Exception]]:
+        """
+        Messages created from the rows in one transaction, in the order of the rows. Rows whose sender or
+        recipient does not exist are not inserted, an exception is returned in their place instead.
+        """
         with self._session() as session:
-            message = Message(message_text=message_text, from_user_id=from_user_id, to_user_id=to_user_id)
-            session.add(message)
-            session.commit()
-            return message_model_as_schema(message)
+            users_ids = {user_id for _, from_user_id, to_user_id in messages for user_id in (from_user_id, to_user_id)}
+            users = self._get_users(session, users_ids)
+            created = [Message(message_text=message_text, from_user_id=from_user_id, to_user_id=to_user_id)
+                       if from_user_id in users and to_user_id in users else Exception("user does not  exists")
+                       for message_text, from_user_id, to_user_id in messages]
+            models = [model for model in created if isinstance(model, Message)]
+            if models:
+                session.add_all(models)
+                session.flush()
+                self._update_dialogs(session, models)
+                session.commit()
+            return [message_model_as_schema(model, users) if isinstance(model, Message) else model
+                    for model in created]
 
     def get_by_id(self, message_id: int) -> schemas.Message:
         with self._session() as session:
@@ -61,19 +158,486 @@ class MessageCRUD:
                 raise Exception('message does not exists')
             return message_model_as_schema(message)
 
-    def get_user_dialog(self, user_id: str, with_user_id: int) -> List[schemas.Message]:
+    def get_user_dialog(self, user_id: int, with_user_id: int, before_id: int = None, after_id: int = None,
+                        limit: int = None, with_users: bool = True) -> List[schemas.LeanMessage]:
+        """Messages with their users, or lean ones read from the message table alone unless with_users."""
+        with self._session() as session:
+            query = message_rows_query(session) if with_users else lean_message_rows_query(session)
+            query = query.filter((Message.from_user_id == user_id) & (Message.to_user_id == with_user_id) |
+                                 (Message.to_user_id == user_id) & (Message.from_user_id == with_user_id))
+            rows = keyset_page(query, Message.id, before_id, after_id, limit)
+            return message_rows_as_schemas(rows) if with_users else lean_message_rows_as_schemas(rows)
+
+    def get_incoming(self, user_id: int, after_id: int, limit: int = None) -> List[schemas.Message]:
+        with self._session() as session:
+            rows = message_rows_query(session).\
+                filter((Message.to_user_id == user_id) & (Message.id > after_id)).\
+                order_by(Message.id).limit(limit).all()
+            return message_rows_as_schemas(rows)
+
+    def search(self, user_id: int, query: str, with_user_id: int = None, by_relevance: bool = False,
+               before_id: int = None, offset: int = 0, limit: int = None,
+               with_users: bool = True) -> List[schemas.LeanMessage]:
+        """
+        Full-text search over messages of user_id's dialogs (only the dialog with with_user_id, if set),
+        the most relevant or the newest first. Recency results are paginated with before_id, relevance
+        results with offset.
+        """
+        terms = query.split()
+        if not terms:
+            return []
+        conditions = ['message_fts MATCH :query',
+                      '(message.from_user_id = :user_id OR message.to_user_id = :user_id)']
+        parameters = {'query': ' '.join('"' + term.replace('"', '""') + '"' for term in terms),
+                      'user_id': user_id, 'with_user_id': with_user_id, 'before_id': before_id,
+                      'offset': offset, 'limit': -1 if limit is None else limit}
+        if with_user_id is not None:
+            conditions.append('(message.from_user_id = :with_user_id OR message.to_user_id = :with_user_id)')
+        if before_id is not None:
+            conditions.append('message.id < :before_id')
+        order_by = 'message_fts.rank' if by_relevance else 'message_fts.rowid DESC'
         with self._session() as session:
-            messages = session.query(Message).\
-                filter((Message.from_user_id == user_id) & (Message.to_user_id == with_user_id) |
-                       (Message.to_user_id == user_id) & (Message.from_user_id == with_user_id)).all()
-            return [message_model_as_schema(message) for message in messages]
+            messages_ids = session.execute(text(
+                'SELECT message.id FROM message_fts JOIN message ON message.id = message_fts.rowid '
+                f'WHERE {" AND ".join(conditions)} ORDER BY {order_by} LIMIT :limit OFFSET :offset'),
+                parameters).scalars().all()
+            rows_query = message_rows_query(session) if with_users else lean_message_rows_query(session)
+            rows = {row[0]: row for row in rows_query.filter(Message.id.in_(messages_ids)).all()}
+            ordered_rows = [rows[message_id] for message_id in messages_ids]
+            return message_rows_as_schemas(ordered_rows) if with_users else lean_message_rows_as_schemas(ordered_rows)
 
-    def get_user_dialogs_users_ids(self, user_id: str) -> List[int]:
+    def get_user_dialogs_users_ids(self, user_id: int) -> List[int]:
         with self._session() as session:
-            users_ids_incoming: List[tuple] = session.query(Message.from_user_id).distinct(Message.from_user_id).\
-                filter(Message.to_user_id == user_id).all()
-            users_ids_outgoing: List[tuple] = session.query(Message.to_user_id).distinct(Message.to_user_id).\
-                filter(Message.from_user_id == user_id).all()
-            users_ids = set(users_ids_incoming)
-            users_ids.update(users_ids_outgoing)
+            users_ids: List[tuple] = session.query(Dialog.peer_id).filter(Dialog.user_id == user_id).all()
             return [user_id[0] for user_id in users_ids]
+
+    def get_user_dialogs(self, user_id: int) -> List[schemas.Dialog]:
+        owner = aliased(User)
+        peer = aliased(User)
+        peer_dialog = aliased(Dialog)
+        with self._session() as session:
+            rows = session.query(Dialog, owner, peer,
+                                 peer_dialog.delivered_message_id, peer_dialog.read_message_id).\
+                join(owner, Dialog.user_id == owner.id).\
+                join(peer, Dialog.peer_id == peer.id).\
+                outerjoin(peer_dialog,
+                          (peer_dialog.user_id == Dialog.peer_id) & (peer_dialog.peer_id == Dialog.user_id)).\
+                filter(Dialog.user_id == user_id).\
+                order_by(Dialog.last_message_id.desc()).all()
+            return [schemas.Dialog(user=user_model_as_schema(user),
+                                   with_user=user_model_as_schema(with_user),
+                                   last_message_id=dialog.last_message_id,
+                                   last_timestamp=dialog.last_timestamp,
+                                   unread_count=dialog.unread_count,
+                                   peer_delivered_message_id=peer_delivered_message_id,
+                                   peer_read_message_id=peer_read_message_id)
+                    for dialog, user, with_user, peer_delivered_message_id, peer_read_message_id in rows]
+
+    def get_unread_counts(self) -> List[Tuple[int, int, int]]:
+        with self._session() as session:
+            rows = session.query(Dialog.user_id, Dialog.peer_id, Dialog.unread_count).\
+                filter(Dialog.unread_count > 0).all()
+            return [tuple(row) for row in rows]
+
+    def update_unread_counts(self, counts: List[Tuple[int, int, int]]):
+        with self._session() as session:
+            session.execute(update(Dialog), [{'user_id': user_id, 'peer_id': peer_id, 'unread_count': unread_count}
+                                             for user_id, peer_id, unread_count in counts])
+            session.commit()
+
+    def get_receipts(self, user_id: int, peer_id: int) -> Tuple[Optional[int], Optional[int]]:
+        """Delivered and read watermarks of the (user_id, peer_id) dialog."""
+        with self._session() as session:
+            row = session.query(Dialog.delivered_message_id, Dialog.read_message_id).\
+                filter((Dialog.user_id == user_id) & (Dialog.peer_id == peer_id)).first()
+            return (None, None) if row is None else tuple(row)
+
+    def update_receipts(self, receipts: List[Tuple[int, int, Optional[int], Optional[int]]]):
+        """
+        Sets the delivered and read watermarks of (user_id, peer_id) dialogs; they never move backwards.
+        """
+        with self._session() as session:
+            session.execute(text(
+                'UPDATE dialog SET '
+                'delivered_message_id = NULLIF(MAX(COALESCE(delivered_message_id, 0), '
+                'COALESCE(:delivered_message_id, 0)), 0), '
+                'read_message_id = NULLIF(MAX(COALESCE(read_message_id, 0), COALESCE(:read_message_id, 0)), 0) '
+                'WHERE user_id = :user_id AND peer_id = :peer_id'),
+                [{'user_id': user_id, 'peer_id': peer_id, 'delivered_message_id': delivered_message_id,
+                  'read_message_id': read_message_id}
+                 for user_id, peer_id, delivered_message_id, read_message_id in receipts])
+            session.commit()
+
+    @staticmethod
+    def _get_users(session: Session, users_ids: Set[int]) -> Dict[int, schemas.User]:
+        return {user.id: user_model_as_schema(user) for user in session.query(User).filter(User.id.in_(users_ids))}
+
+    @staticmethod
+    def _update_dialogs(session: Session, messages: List[Message]):
+        """
+        Unread counts are not touched here: they are tracked by NewMessagesStorage and written
+        back with update_unread_counts.
+        """
+        dialogs = {}
+        for message in messages:
+            for user_id, peer_id in ((message.from_user_id, message.to_user_id),
+                                     (message.to_user_id, message.from_user_id)):
+                dialogs[(user_id, peer_id)] = {'user_id': user_id, 'peer_id': peer_id,
+                                               'last_message_id': message.id,
+                                               'last_timestamp': message.load_timestamp}
+        statement = insert(Dialog)
+        statement = statement.on_conflict_do_update(
+            index_elements=[Dialog.user_id, Dialog.peer_id],
+            set_={'last_message_id': statement.excluded.last_message_id,
+                  'last_timestamp': statement.excluded.last_timestamp})
+        session.execute(statement, list(dialogs.values()))
+
+
+class RoomCRUD:
+
+    def __init__(self, session: Callable[[], Session]):
+        self._session = session
+
+    def create(self, name: str, owner_id: int, members_ids: List[int]) -> schemas.Room:
+        with self._session() as session:
+            room = Room(name=name, owner_id=owner_id)
+            session.add(room)
+            session.flush()
+            members_ids = {owner_id, *members_ids}
+            session.add_all([RoomMember(room_id=room.id, user_id=user_id) for user_id in members_ids])
+            session.commit()
+            return room_model_as_schema(room)
+
+    def get_by_id(self, room_id: int) -> schemas.Room:
+        with self._session() as session:
+            room = session.get(Room, room_id)
+            if not room:
+                raise Exception('room does not exists')
+            return room_model_as_schema(room)
+
+    def add_members(self, room_id: int, users_ids: List[int]):
+        with self._session() as session:
+            statement = insert(RoomMember).on_conflict_do_nothing(index_elements=[RoomMember.room_id,
+                                                                                  RoomMember.user_id])
+            session.execute(statement, [{'room_id': room_id, 'user_id': user_id} for user_id in set(users_ids)])
+            session.commit()
+
+    def get_members_ids(self, room_id: int) -> List[int]:
+        with self._session() as session:
+            rows = session.query(RoomMember.user_id).filter(RoomMember.room_id == room_id).all()
+            return [user_id for user_id, in rows]
+
+    def get_user_rooms(self, user_id: int) -> List[schemas.Room]:
+        with self._session() as session:
+            rooms = session.query(Room).join(RoomMember, RoomMember.room_id == Room.id).\
+                filter(RoomMember.user_id == user_id).order_by(Room.id).all()
+            return [room_model_as_schema(room) for room in rooms]
+
+    def create_messages(self, messages: List[Tuple[int, int, str]]) -> List[schemas.RoomMessage]:
+        with self._session() as session:
+            models = [RoomMessage(room_id=room_id, from_user_id=from_user_id, message_text=message_text)
+                      for room_id, from_user_id, message_text in messages]
+            session.add_all(models)
+            session.commit()
+            return [room_message_model_as_schema(model) for model in models]
+
+    def get_room_messages(self, room_id: int, before_id: int = None, after_id: int = None,
+                          limit: int = None) -> List[schemas.RoomMessage]:
+        with self._session() as session:
+            query = session.query(RoomMessage).filter(RoomMessage.room_id == room_id)
+            messages = keyset_page(query, RoomMessage.id, before_id, after_id, limit)
+            return [room_message_model_as_schema(message) for message in messages]
+
+
+class SessionCRUD:
+
+    def __init__(self, session: Callable[[], Session]):
+        self._session = session
+
+    def get_active(self, now: float) -> List[Tuple[str, schemas.User, float]]:
+        with self._session() as session:
+            rows = session.query(UserSession.token, UserSession.expires_at, User).\
+                join(User, UserSession.user_id == User.id).\
+                filter(UserSession.expires_at > now).all()
+            return [(token, user_model_as_schema(user), expires_at) for token, expires_at, user in rows]
+
+    def delete_expired(self, now: float):
+        with self._session() as session:
+            session.execute(delete(UserSession).where(UserSession.expires_at <= now))
+            session.commit()
+
+    def save(self, saved: List[Tuple[str, int, float]], removed: List[str]):
+        """Upserts (token, user_id, expires_at) rows and deletes removed tokens."""
+        with self._session() as session:
+            if saved:
+                statement = insert(UserSession)
+                statement = statement.on_conflict_do_update(index_elements=[UserSession.token],
+                                                            set_={'user_id': statement.excluded.user_id,
+                                                                  'expires_at': statement.excluded.expires_at})
+                session.execute(statement, [{'token': token, 'user_id': user_id, 'expires_at': expires_at}
+                                            for token, user_id, expires_at in saved])
+            if removed:
+                session.execute(delete(UserSession).where(UserSession.token.in_(removed)))
+            session.commit()
+
+
+class AsyncCRUD:
+    """
+    Runs blocking CRUD calls in a dedicated bounded thread pool, so SQLite round trips don't stall the event loop.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor):
+        self._executor = executor
+
+    async def _run(self, func: Callable, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+
+class AsyncUserAccountCRUD(AsyncCRUD):
+
+    def __init__(self, user_account_crud: UserAccountCRUD, executor: ThreadPoolExecutor):
+        super().__init__(executor)
+        self._crud = user_account_crud
+
+    async def create(self, username: str) -> schemas.User:
+        return await self._run(self._crud.create, username)
+
+    async def get_by_username(self, username: str) -> schemas.User:
+        return await self._run(self._crud.get_by_username, username)
+
+    async def get_by_id(self, user_id: int) -> schemas.User:
+        return await self._run(self._crud.get_by_id, user_id)
+
+    async def get_by_ids(self, users_ids: List[int]) -> List[schemas.User]:
+        return await self._run(self._crud.get_by_ids, users_ids)
+
+    async def find_by_username_part(self, username_part: str, limit: int = None) -> List[schemas.User]:
+        return await self._run(self._crud.find_by_username_part, username_part, limit)
+
+
+class CachedUserAccountCRUD(AsyncUserAccountCRUD):
+    """
+    Serves user lookups from an LRU/TTL cache, written through on create and filled on misses.
+    Lookups by username go through a separate username to id cache, whose hits and misses are
+    reported on their own.
+    """
+
+    def __init__(self, user_account_crud: UserAccountCRUD, executor: ThreadPoolExecutor,
+                 cache_size: int = 10000, ttl_s: Optional[float] = None):
+        super().__init__(user_account_crud, executor)
+        self._users = LRUCache(cache_size, ttl_s)
+        self._usernames = LRUCache(cache_size, ttl_s)
+
+    @property
+    def hits(self) -> int:
+        return self._users.hits
+
+    @property
+    def misses(self) -> int:
+        return self._users.misses
+
+    @property
+    def size(self) -> int:
+        return len(self._users)
+
+    @property
+    def usernames_hits(self) -> int:
+        return self._usernames.hits
+
+    @property
+    def usernames_misses(self) -> int:
+        return self._usernames.misses
+
+    @property
+    def usernames_size(self) -> int:
+        return len(self._usernames)
+
+    def _put(self, user: schemas.User):
+        self._users.put(user.id, user)
+        self._usernames.put(user.username, user.id)
+
+    async def create(self, username: str) -> schemas.User:
+        user = await super().create(username)
+        self._put(user)
+        return user
+
+    async def get_by_username(self, username: str) -> schemas.User:
+        user_id = self._usernames.get(username)
+        if user_id is not None:
+            user = self._users.get(user_id)
+            if user is not None and user.username == username:
+                return user
+        user = await super().get_by_username(username)
+        self._put(user)
+        return user
+
+    async def get_by_id(self, user_id: int) -> schemas.User:
+        user = self._users.get(user_id)
+        if user is None:
+            user = await super().get_by_id(user_id)
+            self._put(user)
+        return user
+
+    async def get_by_ids(self, users_ids: List[int]) -> List[schemas.User]:
+        users = {user_id: self._users.get(user_id) for user_id in users_ids}
+        missing_ids = [user_id for user_id, user in users.items() if user is None]
+        if missing_ids:
+            for user in await super().get_by_ids(missing_ids):
+                self._put(user)
+                users[user.id] = user
+        return [users[user_id] for user_id in users_ids if users[user_id] is not None]
+
+
+class GroupCommitWriter:
+    """
+    Queues rows from concurrent writers and passes them to create_many in batches, one transaction
+    every flush_interval_s seconds or as soon as batch_size rows are pending. Each writer gets back
+    the object created from its own row, or the exception returned in its place by create_many.
+    """
+
+    def __init__(self, create_many: Callable[[list], Awaitable[list]], flush_interval_s: float = 0.005,
+                 batch_size: int = 100):
+        self._create_many = create_many
+        self._flush_interval_s = flush_interval_s
+        self._batch_size = batch_size
+        self._pending: List[Tuple[tuple, asyncio.Future]] = []
+        self._batch_ready: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def write(self, row: tuple):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((row, future))
+        if self._flusher is None:
+            self._batch_ready = asyncio.Event()
+            self._flusher = asyncio.create_task(self._flush())
+        if len(self._pending) >= self._batch_size:
+            self._batch_ready.set()
+        return await future
+
+    async def _flush(self):
+        try:
+            await asyncio.wait_for(self._batch_ready.wait(), self._flush_interval_s)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            while self._pending:
+                batch = self._pending[:self._batch_size]
+                del self._pending[:self._batch_size]
+                try:
+                    created = await self._create_many([row for row, _ in batch])
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for (_, future), item in zip(batch, created):
+                        if future.done():
+                            continue
+                        if isinstance(item, Exception):
+                            future.set_exception(item)
+                        else:
+                            future.set_result(item)
+        finally:
+            self._flusher = None
+
+
+class AsyncMessageCRUD(AsyncCRUD):
+    """
+    Concurrent create calls are group-committed by a GroupCommitWriter.
+    """
+
+    def __init__(self, message_crud: MessageCRUD, executor: ThreadPoolExecutor,
+                 flush_interval_s: float = 0.005, batch_size: int = 100):
+        super().__init__(executor)
+        self._crud = message_crud
+        self._writer = GroupCommitWriter(partial(self._run, self._crud.create_many), flush_interval_s, batch_size)
+
+    async def create(self, message_text: str, from_user_id: int, to_user_id: int) -> schemas.Message:
+        return await self._writer.write((message_text, from_user_id, to_user_id))
+
+    async def get_by_id(self, message_id: int) -> schemas.Message:
+        return await self._run(self._crud.get_by_id, message_id)
+
+    async def get_user_dialog(self, user_id: int, with_user_id: int, before_id: int = None, after_id: int = None,
+                              limit: int = None, with_users: bool = True) -> List[schemas.LeanMessage]:
+        return await self._run(self._crud.get_user_dialog, user_id, with_user_id, before_id, after_id, limit,
+                               with_users)
+
+    async def get_incoming(self, user_id: int, after_id: int, limit: int = None) -> List[schemas.Message]:
+        return await self._run(self._crud.get_incoming, user_id, after_id, limit)
+
+    async def search(self, user_id: int, query: str, with_user_id: int = None, by_relevance: bool = False,
+                     before_id: int = None, offset: int = 0, limit: int = None,
+                     with_users: bool = True) -> List[schemas.LeanMessage]:
+        return await self._run(self._crud.search, user_id, query, with_user_id, by_relevance, before_id, offset,
+                               limit, with_users)
+
+    async def get_user_dialogs_users_ids(self, user_id: int) -> List[int]:
+        return await self._run(self._crud.get_user_dialogs_users_ids, user_id)
+
+    async def get_user_dialogs(self, user_id: int) -> List[schemas.Dialog]:
+        return await self._run(self._crud.get_user_dialogs, user_id)
+
+    async def get_unread_counts(self) -> List[Tuple[int, int, int]]:
+        return await self._run(self._crud.get_unread_counts)
+
+    async def update_unread_counts(self, counts: List[Tuple[int, int, int]]):
+        return await self._run(self._crud.update_unread_counts, counts)
+
+    async def get_receipts(self, user_id: int, peer_id: int) -> Tuple[Optional[int], Optional[int]]:
+        return await self._run(self._crud.get_receipts, user_id, peer_id)
+
+    async def update_receipts(self, receipts: List[Tuple[int, int, Optional[int], Optional[int]]]):
+        return await self._run(self._crud.update_receipts, receipts)
+
+
+class AsyncRoomCRUD(AsyncCRUD):
+    """
+    Room messages are group-committed by a GroupCommitWriter like direct messages.
+    """
+
+    def __init__(self, room_crud: RoomCRUD, executor: ThreadPoolExecutor,
+                 flush_interval_s: float = 0.005, batch_size: int = 100):
+        super().__init__(executor)
+        self._crud = room_crud
+        self._writer = GroupCommitWriter(partial(self._run, self._crud.create_messages), flush_interval_s,
+                                         batch_size)
+
+    async def create(self, name: str, owner_id: int, members_ids: List[int]) -> schemas.Room:
+        return await self._run(self._crud.create, name, owner_id, members_ids)
+
+    async def get_by_id(self, room_id: int) -> schemas.Room:
+        return await self._run(self._crud.get_by_id, room_id)
+
+    async def add_members(self, room_id: int, users_ids: List[int]):
+        return await self._run(self._crud.add_members, room_id, users_ids)
+
+    async def get_members_ids(self, room_id: int) -> List[int]:
+        return await self._run(self._crud.get_members_ids, room_id)
+
+    async def get_user_rooms(self, user_id: int) -> List[schemas.Room]:
+        return await self._run(self._crud.get_user_rooms, user_id)
+
+    async def create_message(self, room_id: int, from_user_id: int, message_text: str) -> schemas.RoomMessage:
+        return await self._writer.write((room_id, from_user_id, message_text))
+
+    async def get_room_messages(self, room_id: int, before_id: int = None, after_id: int = None,
+                                limit: int = None) -> List[schemas.RoomMessage]:
+        return await self._run(self._crud.get_room_messages, room_id, before_id, after_id, limit)
+
+
+class AsyncSessionCRUD(AsyncCRUD):
+
+    def __init__(self, session_crud: SessionCRUD, executor: ThreadPoolExecutor):
+        super().__init__(executor)
+        self._crud = session_crud
+
+    async def get_active(self, now: float) -> List[Tuple[str, schemas.User, float]]:
+        return await self._run(self._crud.get_active, now)
+
+    async def delete_expired(self, now: float):
+        return await self._run(self._crud.delete_expired, now)
+
+    async def save(self, saved: List[Tuple[str, int, float]], removed: List[str]):
+        return await self._run(self._crud.save, saved, removed)
@@ -1,6 +1,6 @@
 from typing import Callable
 
-from sqlalchemy import Engine
+from sqlalchemy import Engine, event, text
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
 
@@ -11,18 +11,119 @@ engine: Engine = None
 session: Callable[[], Session] = None
 
 
-def create_session(db_name: str):
+def create_session(db_name: str,
+                   journal_mode: str = 'WAL',
+                   synchronous: str = 'NORMAL',
+                   mmap_size: int = 256 * 1024 * 1024,
+                   cache_size: int = -64 * 1024):
+    """
+    cache_size follows the SQLite PRAGMA convention: positive values are pages, negative values are KiB.
+    """
     global engine, session
     if not engine:
         logger.warning(f'initializing db {db_name}')
         engine = create_engine(f"sqlite:///{db_name}")
+
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f'PRAGMA journal_mode={journal_mode}')
+            cursor.execute(f'PRAGMA synchronous={synchronous}')
+            cursor.execute(f'PRAGMA mmap_size={int(mmap_size)}')
+            cursor.execute(f'PRAGMA cache_size={int(cache_size)}')
+            cursor.close()
+
         Base.metadata.create_all(engine)
+        migrate_database(engine)
         session = sessionmaker(engine, expire_on_commit=False)
     else:
         logger.warning(f'db {db_name} already exists')
     return session
 
 
+def migrate_database(engine: Engine):
+    """
+    create_all() creates indexes and columns only together with their tables, so those added to
+    existing tables (e.g. an old chat.db) are created here. Added columns must be nullable.
+    """
+    add_missing_columns(engine)
+    with engine.connect() as connection:
+        existing_indexes = set(connection.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            try:
+                index.create(engine)
+            except Exception:
+                logger.error(f'cannot create index {index.name}', exc_info=True)
+    backfill_dialogs(engine)
+    create_search_index(engine, 'user_account_fts', 'user_account', 'username', 'trigram')
+    create_search_index(engine, 'message_fts', 'message', 'message_text', 'unicode61 remove_diacritics 2')
+
+
+def add_missing_columns(engine: Engine):
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing_columns = {row[1] for row in connection.execute(text(f'PRAGMA table_info({table.name})'))}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                logger.warning(f'adding column {table.name}.{column.name}')
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+
+def backfill_dialogs(engine: Engine):
+    """
+    Fills the dialog summary table from message history for databases created before it existed.
+    """
+    with engine.begin() as connection:
+        if connection.execute(text('SELECT 1 FROM dialog LIMIT 1')).first():
+            return
+        if not connection.execute(text('SELECT 1 FROM message LIMIT 1')).first():
+            return
+        logger.warning('backfilling dialog table from message history')
+        connection.execute(text(
+            'INSERT INTO dialog (user_id, peer_id, last_message_id, last_timestamp, unread_count) '
+            'SELECT user_id, peer_id, MAX(id), MAX(load_timestamp), 0 FROM ('
+            'SELECT from_user_id AS user_id, to_user_id AS peer_id, id, load_timestamp FROM message '
+            'UNION ALL '
+            'SELECT to_user_id AS user_id, from_user_id AS peer_id, id, load_timestamp FROM message'
+            ') GROUP BY user_id, peer_id'))
+
+
+def create_search_index(engine: Engine, fts_table: str, table: str, column: str, tokenize: str):
+    """
+    External-content FTS5 index over table.column, kept in sync by triggers, so it is updated
+    incrementally on every write; built from existing rows when created.
+    """
+    with engine.begin() as connection:
+        exists = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': fts_table}).first()
+        if exists:
+            return
+        logger.warning(f'creating search index {fts_table}')
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE {fts_table} USING fts5("
+            f"{column}, content='{table}', content_rowid='id', tokenize='{tokenize}')"))
+        connection.execute(text(
+            f"CREATE TRIGGER {fts_table}_insert AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts_table}(rowid, {column}) VALUES (new.id, new.{column}); END"))
+        connection.execute(text(
+            f"CREATE TRIGGER {fts_table}_delete AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts_table}({fts_table}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END"))
+        connection.execute(text(
+            f"CREATE TRIGGER {fts_table}_update AFTER UPDATE OF {column} ON {table} BEGIN "
+            f"INSERT INTO {fts_table}({fts_table}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+            f"INSERT INTO {fts_table}(rowid, {column}) VALUES (new.id, new.{column}); END"))
+        connection.execute(text(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')"))
+
+
 def drop_database():
     global engine
+    with engine.begin() as connection:
+        connection.execute(text('DROP TABLE IF EXISTS user_account_fts'))
+        connection.execute(text('DROP TABLE IF EXISTS message_fts'))
     Base.metadata.drop_all(engine)
@@ -1,6 +1,7 @@
 import asyncio
-import datetime
-from typing import Awaitable, Type, Dict
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, MutableSet, Type, Set, Optional, Tuple
 
 from pydantic import BaseModel
 from reactivestreams.publisher import DefaultPublisher
@@ -12,162 +13,619 @@ from rsocket.payload import Payload
 from rsocket.routing.request_router import RequestRouter
 from rsocket.routing.routing_request_handler import RoutingRequestHandler
 
-from app import schemas
-from app.cruds import MessageCRUD, UserAccountCRUD
+from app.bus import WorkerBus
+from app.codecs import Codec, EncodedSchema, JSON_CODEC, get_codec
+from app.cruds import MessageCRUD, UserAccountCRUD, AsyncMessageCRUD, CachedUserAccountCRUD, RoomCRUD, \
+    AsyncRoomCRUD, SessionCRUD, AsyncSessionCRUD
 from app.database import create_session
 from app.logs import logger
-from app.schemas import LoginRequest, RegisterRequest, LogoutRequest, FindUsersRequest, GetUserByIdRequest, \
-    SendMessageRequest, User, Message, OnlineMetric, MetricRequest, TotalOnlineMetric
-from app.services import AuthService, ChatService, AuthMiddleWare
-from app.utils import payload_to_schema, schema_to_bytes
+from app.presence import PresenceTracker
+from app.sessions import PersistentSessionStore
+from app.statistics import StatisticsBroadcaster
+from app.schemas import LoginRequest, RegisterRequest, FindUsersRequest, GetUserByIdRequest, \
+    SendMessageRequest, User, Message, MetricRequest, IncomingMessagesRequest, \
+    BuffersMetricsRequest, BuffersMetricsResponse, GetDialogMessagesRequest, \
+    GetDialogsRequest, CacheMetricsRequest, CacheMetricsResponse, CacheMetric, SearchMessagesRequest, \
+    CreateRoomRequest, AddRoomMembersRequest, GetRoomsRequest, SendRoomMessageRequest, GetRoomMessagesRequest, \
+    GetUnreadRequest, ReceiptRequest, RoomMessage, Receipt, SessionEvent, PresenceEvent, RoomMembersEvent, \
+    MarkReadEvent, BaseRequest, BaseResponse, BatchItem, BatchRequest, BatchResponse, CheckSessionResponse, \
+    SetupRequest
+from app.services import AuthService, ChatService, AuthMiddleWare, MessageHub, RoomService, RoomMembershipIndex, \
+    NewMessagesStorage, ReceiptsStorage
+from app.streams import BufferedPublisher, OverflowStrategy, get_buffers_metrics
+from app.utils import payload_to_schema, schema_to_bytes, get_uid
+
+DB_EXECUTOR_WORKERS = 4
+MESSAGES_FLUSH_INTERVAL_S = 0.005
+MESSAGES_BATCH_SIZE = 100
+USERS_CACHE_SIZE = 100000
+USERS_CACHE_TTL_S = 600
+UNREAD_PENDING_MESSAGES = 50
+UNREAD_FLUSH_INTERVAL_S = 5
+RECEIPTS_FLUSH_INTERVAL_S = 1
+RECEIPTS_CACHE_SIZE = 100000
+BATCH_MAX_REQUESTS = 100
+BATCH_CONCURRENCY = 8
+
+AuthorizedHandler = Callable[[BaseRequest, User], Awaitable[BaseResponse]]
+NOT_AUTHENTICATED = EncodedSchema(CheckSessionResponse(success=False, error='not authenticated'))
 
 session = create_session('chat.db')
-user_account_crud = UserAccountCRUD(session)
-message_crud = MessageCRUD(session)
-logged_in_users: Dict[str, schemas.User] = {}
-online_sessions: Dict[str, float] = {}
-auth_service = AuthService(user_account_crud, logged_in_users)
-chat_service = ChatService(user_account_crud, message_crud)
-auth_middleware = AuthMiddleWare(logged_in_users)
-
-incoming_messages: asyncio.Queue = asyncio.Queue()
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix='db')
+user_account_crud = CachedUserAccountCRUD(UserAccountCRUD(session), db_executor, USERS_CACHE_SIZE, USERS_CACHE_TTL_S)
+message_crud = AsyncMessageCRUD(MessageCRUD(session), db_executor, MESSAGES_FLUSH_INTERVAL_S, MESSAGES_BATCH_SIZE)
+room_crud = AsyncRoomCRUD(RoomCRUD(session), db_executor, MESSAGES_FLUSH_INTERVAL_S, MESSAGES_BATCH_SIZE)
+SESSION_TTL_S = 7 * 24 * 3600
+SESSION_SHARDS = 16
+SESSIONS_FLUSH_INTERVAL_S = 1
+session_store = PersistentSessionStore(AsyncSessionCRUD(SessionCRUD(session), db_executor), SESSION_TTL_S,
+                                       SESSION_SHARDS, SESSIONS_FLUSH_INTERVAL_S)
+auth_service = AuthService(user_account_crud, session_store)
+new_messages_storage = NewMessagesStorage(message_crud, UNREAD_PENDING_MESSAGES, UNREAD_FLUSH_INTERVAL_S)
+receipts_storage = ReceiptsStorage(message_crud, RECEIPTS_FLUSH_INTERVAL_S, RECEIPTS_CACHE_SIZE)
+chat_service = ChatService(user_account_crud, message_crud, new_messages_storage=new_messages_storage,
+                           receipts_storage=receipts_storage)
+room_membership_index = RoomMembershipIndex(room_crud)
+room_service = RoomService(room_crud, room_membership_index)
+auth_middleware = AuthMiddleWare(session_store)
+
+MESSAGES_HISTORY_SIZE = 100
+MESSAGES_HISTORY_USERS = 100000
+message_hub = MessageHub(MESSAGES_HISTORY_SIZE, MESSAGES_HISTORY_USERS)
 SESSION_INACTIVE_PERIOD_S = 10
+SESSION_EXPIRY_RESOLUTION_S = 0.5
+MESSAGES_HIGH_WATER_MARK = 100
+MESSAGES_OVERFLOW_STRATEGY = OverflowStrategy.DROP_OLDEST
+STATISTICS_HIGH_WATER_MARK = 10
+STATISTICS_OVERFLOW_STRATEGY = OverflowStrategy.DROP_OLDEST
+STATISTICS_RESOLUTION_S = 0.5
+presence_tracker = PresenceTracker(SESSION_INACTIVE_PERIOD_S, SESSION_EXPIRY_RESOLUTION_S)
+statistics_broadcaster = StatisticsBroadcaster(presence_tracker, STATISTICS_RESOLUTION_S)
 
 
-async def check_online_sessions():
-    while True:
-        await asyncio.sleep(10)
-        offline_sessions = []
-        for user_session, timestamp in online_sessions.items():
-            if datetime.datetime.now().timestamp() - timestamp > SESSION_INACTIVE_PERIOD_S:
-                offline_sessions.append(user_session)
-        for offline_session in offline_sessions:
-            if offline_session in online_sessions:
-                online_sessions.pop(offline_session)
-            if offline_session in logged_in_users:
-                print(f'logged out {logged_in_users[offline_session]}')
-                logged_in_users.pop(offline_session)
+worker_bus = WorkerBus()
+background_tasks: Set[asyncio.Task] = set()
+
+
+def run_in_background(coroutine: Awaitable):
+    """Runs coroutine in a task which is referenced until it is done; its failure is logged."""
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(on_background_task_done)
+
+
+def on_background_task_done(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error('background task failed', exc_info=task.exception())
+
+
+def on_presence_changed(user_session: str, user_id: int, online: bool):
+    if worker_bus.connected and not presence_tracker.is_remote(user_session):
+        run_in_background(worker_bus.publish('presence', schema_to_bytes(
+            PresenceEvent(session=user_session, user_id=user_id, online=online))))
+
+
+presence_tracker.subscribe(on_presence_changed)
+
+
+def on_remote_session(data: bytes):
+    event = SessionEvent.model_validate_json(data)
+    session_store.add(event.session, event.user, owned=False)
+
+
+def on_remote_presence(data: bytes):
+    event = PresenceEvent.model_validate_json(data)
+    presence_tracker.set_remote(event.session, event.user_id, event.online)
+
+
+def on_remote_logout(data: bytes):
+    user_session = data.decode()
+    ChatRequestHandler.revoke(user_session)
+    presence_tracker.remove(user_session)
+    session_store.remove(user_session)
+
+
+def on_remote_message(data: bytes):
+    message = Message.model_validate_json(data)
+    new_messages_storage.add(message)
+    message_hub.publish(message, EncodedSchema(message, JSON_CODEC, data))
+
+
+def on_remote_room_message(data: bytes):
+    message = RoomMessage.model_validate_json(data)
+
+    async def publish():
+        members = await room_service.get_members(message.room_id)
+        message_hub.publish_to(members, message, EncodedSchema(message, JSON_CODEC, data), message.from_user_id)
+
+    run_in_background(publish())
+
+
+def on_remote_room_members(data: bytes):
+    event = RoomMembersEvent.model_validate_json(data)
+    room_membership_index.add_members(event.room_id, event.users_ids)
+
+
+def on_remote_mark_read(data: bytes):
+    event = MarkReadEvent.model_validate_json(data)
+    for peer_id in event.peers_ids:
+        new_messages_storage.mark_read(event.user_id, peer_id)
+
+
+def on_remote_receipt(data: bytes):
+    receipt = Receipt.model_validate_json(data)
+    receipts_storage.remember(receipt)
+    if receipt.read_message_id is not None:
+        new_messages_storage.mark_read(receipt.user_id, receipt.peer_id, receipt.read_message_id)
+    message_hub.publish_to((receipt.peer_id,), receipt, EncodedSchema(receipt, JSON_CODEC, data))
+
+
+worker_bus.subscribe('session', on_remote_session)
+worker_bus.subscribe('presence', on_remote_presence)
+worker_bus.subscribe('logout', on_remote_logout)
+worker_bus.subscribe('message', on_remote_message)
+worker_bus.subscribe('room_message', on_remote_room_message)
+worker_bus.subscribe('room_members', on_remote_room_members)
+worker_bus.subscribe('receipt', on_remote_receipt)
+worker_bus.subscribe('mark_read', on_remote_mark_read)
+
+
+class ChatRequestHandler(RoutingRequestHandler):
+    """
+    Routing handler of a single connection. The connection is authenticated once, by the session of its
+    SETUP payload or of a login through it; from then on requests carry no session and are served without
+    any lookup, while requests of an unauthenticated connection are refused before their payload is decoded.
+    The bound session stays online while keepalive frames of the connection arrive and goes offline as soon
+    as the last connection it is bound to is closed. Streams opened by the user end once the session is
+    unbound, e.g. on logout. Payload data is encoded with the codec of the data MIME type the client set up
+    the connection with.
+    """
+
+    authenticated: Dict[str, Set['ChatRequestHandler']] = {}
+
+    def __init__(self, router: RequestRouter):
+        super().__init__(router)
+        self.codec: Codec = JSON_CODEC
+        self.session: Optional[str] = None
+        self.user: Optional[User] = None
+        self.streams: MutableSet[BufferedPublisher] = weakref.WeakSet()
+
+    async def on_setup(self, data_encoding: bytes, metadata_encoding: bytes, payload: Payload):
+        codec = get_codec(data_encoding)
+        if codec is None:
+            raise Exception(f'unsupported data encoding {data_encoding!r}')
+        self.codec = codec
+        await super().on_setup(data_encoding, metadata_encoding, payload)
+        if payload is None or not payload.data:
+            return
+        setup_request: SetupRequest = payload_to_schema(payload, SetupRequest, codec)
+        if setup_request.session is not None:
+            user = auth_middleware.authenticate(setup_request.session)
+            if user is None:
+                raise Exception('wrong session')
+            self.bind(setup_request.session, user)
+
+    def bind(self, user_session: str, user: User):
+        if self.session is not None and self.session != user_session:
+            self.unbind()
+        self.session = user_session
+        self.user = user
+        self.authenticated.setdefault(user_session, set()).add(self)
+        presence_tracker.touch(user_session, user.id)
+
+    def unbind(self):
+        if self.session is None:
+            return
+        handlers = self.authenticated.get(self.session, set())
+        handlers.discard(self)
+        if not handlers:
+            self.authenticated.pop(self.session, None)
+            presence_tracker.remove(self.session)
+        self.session = None
+        self.user = None
+        for stream in list(self.streams):
+            stream.fail(Exception('not authenticated'))
+        self.streams.clear()
+
+    @classmethod
+    def revoke(cls, user_session: str):
+        """Unbinds a logged out session from all connections it is bound to."""
+        for handler in list(cls.authenticated.get(user_session, ())):
+            handler.unbind()
+
+    def on_keepalive(self):
+        if self.session is not None:
+            session_store.touch(self.session)
+            presence_tracker.touch(self.session, self.user.id)
+
+    async def on_close(self, rsocket, exception: Optional[Exception] = None):
+        for stream in list(self.streams):
+            stream.cancel()
+        self.streams.clear()
+        self.unbind()
+        await super().on_close(rsocket, exception)
+
+
+class MessagePublisher(BufferedPublisher):
+    """
+    Live messages of the user. If since_message_id is set, the messages missed since then are
+    replayed first: from the hub history if it still holds all of them, otherwise from the
+    database page by page as the subscriber drains them. Live messages arriving during the
+    last page are held back and sent after it, skipping those the page already contained.
+    """
+
+    def __init__(self, hub: MessageHub, message_crud: AsyncMessageCRUD, user_id: int, name: str,
+                 since_message_id: Optional[int], codec: Codec = JSON_CODEC,
+                 high_water_mark: int = MESSAGES_HIGH_WATER_MARK,
+                 overflow_strategy: OverflowStrategy = MESSAGES_OVERFLOW_STRATEGY):
+        super().__init__(name, high_water_mark, overflow_strategy)
+        self._hub = hub
+        self._message_crud = message_crud
+        self._user_id = user_id
+        self._codec = codec
+        self._page_size = high_water_mark
+        self._last_message_id = since_message_id
+        self._held_back: Optional[list] = None
+        self._demand = asyncio.Event()
+        self._catching_up: Optional[asyncio.Task] = None
+
+    def cancel(self):
+        self._hub.unsubscribe(self._user_id, self._send_message)
+        if self._catching_up is not None:
+            self._catching_up.cancel()
+        super().cancel()
+
+    def request(self, n: int):
+        super().request(n)
+        self._demand.set()
+
+    def subscribe(self, subscriber: Subscriber):
+        super().subscribe(subscriber)
+        self._hub.subscribe(self._user_id, self._send_message)
+        if self._last_message_id is None:
+            return
+        recent_messages = self._hub.get_recent_messages(self._user_id, self._last_message_id)
+        if recent_messages is not None:
+            for _, encoded in recent_messages:
+                self.emit(encoded.encode(self._codec))
+        else:
+            self._held_back = []
+            self._catching_up = asyncio.create_task(self._catch_up())
+
+    def _send_message(self, message: BaseModel, encoded: EncodedSchema):
+        if self._held_back is not None:
+            self._held_back.append((message, encoded))
+        else:
+            self.emit(encoded.encode(self._codec))
+
+    async def _catch_up(self):
+        try:
+            while True:
+                while self.buffered_count:
+                    self._demand.clear()
+                    await self._demand.wait()
+                self._held_back = [(message, encoded) for message, encoded in self._held_back
+                                   if not isinstance(message, Message)]
+                messages = await self._message_crud.get_incoming(self._user_id, self._last_message_id,
+                                                                 self._page_size)
+                for message in messages:
+                    self.emit(schema_to_bytes(message, self._codec))
+                if messages:
+                    self._last_message_id = messages[-1].id
+                if len(messages) < self._page_size:
+                    break
+            held_back, self._held_back = self._held_back, None
+            for message, encoded in held_back:
+                if not isinstance(message, Message) or message.id > self._last_message_id:
+                    self.emit(encoded.encode(self._codec))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._catching_up = None
+            self.cancel()
+            self._subscriber.on_error(e)
+        finally:
+            self._catching_up = None
 
 
 def handler_factory() -> RoutingRequestHandler:
     router = RequestRouter()
+    handler = ChatRequestHandler(router)
+    authorized_routes: Dict[str, Tuple[Type[BaseRequest], AuthorizedHandler]] = {}
+
+    def authorized(route: str, request_class: Type[BaseRequest]):
+        """
+        Registers a request-response route which needs an authenticated connection. The decorated function
+        gets the decoded request and the user of the connection; it can be called on its own or as part of
+        a batch.
+        """
+
+        def decorator(func: AuthorizedHandler) -> AuthorizedHandler:
+            authorized_routes[route] = (request_class, func)
+
+            @router.response(route)
+            async def respond(payload: Payload) -> Awaitable[Payload]:
+                if handler.user is None:
+                    return create_response(NOT_AUTHENTICATED.encode(handler.codec))
+                request = payload_to_schema(payload, request_class, handler.codec)
+                response = await func(request, handler.user)
+                return create_response(schema_to_bytes(response, handler.codec))
+
+            return func
+
+        return decorator
 
     @router.response('login')
     async def login(payload: Payload) -> Awaitable[Payload]:
-        request: LoginRequest = payload_to_schema(payload, LoginRequest)
-        response = auth_service.auth(request)
+        request: LoginRequest = payload_to_schema(payload, LoginRequest, handler.codec)
+        response = await auth_service.auth(request)
         if response.success:
-            logged_in_users[response.session] = response.user
-            online_sessions[response.session] = datetime.datetime.now().timestamp()
-        return create_response(schema_to_bytes(response))
+            await worker_bus.publish('session', schema_to_bytes(SessionEvent(session=response.session,
+                                                                             user=response.user)))
+            handler.bind(response.session, response.user)
+        return create_response(schema_to_bytes(response, handler.codec))
 
     @router.response('register')
     async def register(payload: Payload) -> Awaitable[Payload]:
-        request: RegisterRequest = payload_to_schema(payload, RegisterRequest)
-        response = auth_service.register(request)
-        return create_response(schema_to_bytes(response))
+        request: RegisterRequest = payload_to_schema(payload, RegisterRequest, handler.codec)
+        response = await auth_service.register(request)
+        return create_response(schema_to_bytes(response, handler.codec))
 
     @router.response('logout')
     async def logout(payload: Payload) -> Awaitable[Payload]:
-        request: LogoutRequest = payload_to_schema(payload, LogoutRequest)
-        response = auth_service.logout(request)
+        user_session = handler.session
+        response = auth_service.logout(user_session)
         if response.success:
-            online_sessions.pop(request.session)
-        return create_response(schema_to_bytes(response))
-
-    @router.response('find_users')
-    async def find_users(payload: Payload) -> Awaitable[Payload]:
-        request: FindUsersRequest = payload_to_schema(payload, FindUsersRequest)
-        check_response = auth_middleware.check_session(request)
-        if not check_response.success:
-            return create_response(schema_to_bytes(check_response))
-        response = chat_service.find_users(request)
-        return create_response(schema_to_bytes(response))
-
-    @router.response('get_user_by_id')
-    async def get_user_by_id(payload: Payload) -> Awaitable[Payload]:
-        request: GetUserByIdRequest = payload_to_schema(payload, GetUserByIdRequest)
-        check_response = auth_middleware.check_session(request)
-        if not check_response.success:
-            return create_response(schema_to_bytes(check_response))
-        response = chat_service.get_user_by_id(request)
-        return create_response(schema_to_bytes(response))
-
-    @router.response('send_message')
-    async def send_message(payload: Payload) -> Awaitable[Payload]:
-        request: SendMessageRequest = payload_to_schema(payload, SendMessageRequest)
-        check_response = auth_middleware.check_session(request)
-        if not check_response.success:
-            return create_response(schema_to_bytes(check_response))
-        response = chat_service.send_message(request)
-        incoming_messages.put_nowait(response.message)
-        return create_response(schema_to_bytes(response))
-
-    @router.stream('messages.incoming')
-    async def messages_incoming():
-        class MessagePublisher(DefaultPublisher, DefaultSubscription):
-            def __init__(self, queue: asyncio.Queue):
-                self._queue = queue
+            ChatRequestHandler.revoke(user_session)
+            await worker_bus.publish('logout', user_session.encode())
+        return create_response(schema_to_bytes(response, handler.codec))
+
+    @authorized('find_users', FindUsersRequest)
+    async def find_users(request: FindUsersRequest, user: User) -> BaseResponse:
+        return await chat_service.find_users(request)
+
+    @authorized('get_user_by_id', GetUserByIdRequest)
+    async def get_user_by_id(request: GetUserByIdRequest, user: User) -> BaseResponse:
+        return await chat_service.get_user_by_id(request)
+
+    @authorized('send_message', SendMessageRequest)
+    async def send_message(request: SendMessageRequest, user: User) -> BaseResponse:
+        response = await chat_service.send_message(user.id, request)
+        new_messages_storage.add(response.message)
+        encoded = EncodedSchema(response.message)
+        message_hub.publish(response.message, encoded)
+        await worker_bus.publish('message', encoded.encode(JSON_CODEC))
+        return response
+
+    @authorized('get_dialogs', GetDialogsRequest)
+    async def get_dialogs(request: GetDialogsRequest, user: User) -> BaseResponse:
+        return await chat_service.get_dialogs(user.id, request)
+
+    @authorized('get_dialog_messages', GetDialogMessagesRequest)
+    async def get_dialog_messages(request: GetDialogMessagesRequest, user: User) -> BaseResponse:
+        return await chat_service.get_dialog_messages(user.id, request)
+
+    @router.stream('get_dialog_messages.stream')
+    async def get_dialog_messages_stream(payload: Payload):
+        if handler.user is None:
+            raise Exception('not authenticated')
+        request: GetDialogMessagesRequest = payload_to_schema(payload, GetDialogMessagesRequest, handler.codec)
+
+        class DialogHistoryPublisher(DefaultPublisher, DefaultSubscription):
+            """
+            Emits one history page per requested item, walking from the request cursor
+            towards older messages (or newer ones if only after_id is set).
+            """
+
+            def __init__(self, user_id: int, page_request: GetDialogMessagesRequest):
+                self._user_id = user_id
+                self._page_request = page_request
+                self._requested = 0
                 self._sender = None
-
-            def cancel(self):
-                self._sender.cancel()
+                self._completed = False
 
             def subscribe(self, subscriber: Subscriber):
-                super(MessagePublisher, self).subscribe(subscriber)
+                super().subscribe(subscriber)
                 subscriber.on_subscribe(self)
-                self._sender = asyncio.create_task(self._message_sender())
 
-            async def _message_sender(self):
-                while True:
-                    message: Message = await self._queue.get()
-                    message_bytes = schema_to_bytes(message)
-                    next_payload = Payload(message_bytes)
-                    self._subscriber.on_next(next_payload)
+            def request(self, n: int):
+                self._requested += n
+                if self._sender is None and not self._completed:
+                    self._sender = asyncio.create_task(self._pages_sender())
+
+            def cancel(self):
+                self._completed = True
+                if self._sender:
+                    self._sender.cancel()
+
+            async def _pages_sender(self):
+                backwards = self._page_request.after_id is None or self._page_request.before_id is not None
+                try:
+                    while self._requested > 0 and not self._completed:
+                        if handler.user is None or handler.user.id != self._user_id:
+                            raise Exception('not authenticated')
+                        page = await chat_service.get_dialog_messages(self._user_id, self._page_request)
+                        self._requested -= 1
+                        self._completed = not page.has_more
+                        self._subscriber.on_next(Payload(schema_to_bytes(page, handler.codec)), is_complete=self._completed)
+                        if backwards:
+                            self._page_request = self._page_request.model_copy(
+                                update={'before_id': page.messages[0].id} if page.messages else {})
+                        else:
+                            self._page_request = self._page_request.model_copy(
+                                update={'after_id': page.messages[-1].id} if page.messages else {})
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self._completed = True
+                    self._subscriber.on_error(e)
+                finally:
+                    self._sender = None
+
+        return DialogHistoryPublisher(handler.user.id, request)
+
+    @authorized('get_unread', GetUnreadRequest)
+    async def get_unread(request: GetUnreadRequest, user: User) -> BaseResponse:
+        response = chat_service.get_unread(user.id, request)
+        if request.mark_read and response.dialogs:
+            await worker_bus.publish('mark_read', schema_to_bytes(MarkReadEvent(
+                user_id=user.id, peers_ids=[dialog.with_user_id for dialog in response.dialogs])))
+        return response
+
+    @authorized('search_messages', SearchMessagesRequest)
+    async def search_messages(request: SearchMessagesRequest, user: User) -> BaseResponse:
+        return await chat_service.search_messages(user.id, request)
+
+    @authorized('create_room', CreateRoomRequest)
+    async def create_room(request: CreateRoomRequest, user: User) -> BaseResponse:
+        response = await room_service.create_room(user.id, request)
+        await worker_bus.publish('room_members', schema_to_bytes(RoomMembersEvent(
+            room_id=response.room.id, users_ids=[user.id, *request.members_ids])))
+        return response
+
+    @authorized('add_room_members', AddRoomMembersRequest)
+    async def add_room_members(request: AddRoomMembersRequest, user: User) -> BaseResponse:
+        response = await room_service.add_members(user.id, request)
+        if response.success:
+            await worker_bus.publish('room_members', schema_to_bytes(RoomMembersEvent(room_id=request.room_id,
+                                                                                      users_ids=request.users_ids)))
+        return response
+
+    @authorized('get_rooms', GetRoomsRequest)
+    async def get_rooms(request: GetRoomsRequest, user: User) -> BaseResponse:
+        return await room_service.get_rooms(user.id, request)
 
-        return MessagePublisher(incoming_messages)
+    @authorized('send_room_message', SendRoomMessageRequest)
+    async def send_room_message(request: SendRoomMessageRequest, user: User) -> BaseResponse:
+        response = await room_service.send_room_message(user.id, request)
+        if response.success:
+            members = await room_service.get_members(request.room_id)
+            encoded = EncodedSchema(response.message)
+            message_hub.publish_to(members, response.message, encoded, user.id)
+            await worker_bus.publish('room_message', encoded.encode(JSON_CODEC))
+        return response
+
+    @authorized('get_room_messages', GetRoomMessagesRequest)
+    async def get_room_messages(request: GetRoomMessagesRequest, user: User) -> BaseResponse:
+        return await room_service.get_room_messages(user.id, request)
+
+    @router.response('batch')
+    async def batch(payload: Payload) -> Awaitable[Payload]:
+        """
+        Runs sub-requests of authorized routes under the single authentication check of the batch, at most
+        BATCH_CONCURRENCY at a time, and returns their responses in the order of the requests.
+        A failed sub-request gets an error response and doesn't affect the others.
+        """
+        if handler.user is None:
+            return create_response(NOT_AUTHENTICATED.encode(handler.codec))
+        request: BatchRequest = payload_to_schema(payload, BatchRequest, handler.codec)
+        if len(request.requests) > BATCH_MAX_REQUESTS:
+            response = BatchResponse(success=False, error=f'batch is limited to {BATCH_MAX_REQUESTS} requests')
+            return create_response(schema_to_bytes(response, handler.codec))
+        user = handler.user
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        async def run(item: BatchItem) -> BaseResponse:
+            route_handler = authorized_routes.get(item.route)
+            if route_handler is None:
+                return BaseResponse(success=False, error=f'unknown route {item.route}')
+            request_class, func = route_handler
+            async with semaphore:
+                try:
+                    return await func(request_class.model_validate(item.data), user)
+                except Exception as e:
+                    logger.warning(f'batch request to {item.route} failed: {e}')
+                    return BaseResponse(success=False, error=str(e))
+
+        results = await asyncio.gather(*(run(item) for item in request.requests))
+        return create_response(schema_to_bytes(BatchResponse(results=results), handler.codec))
+
+    @router.stream('messages.incoming')
+    async def messages_incoming(payload: Payload):
+        if handler.user is None:
+            raise Exception('not authenticated')
+        request: IncomingMessagesRequest = payload_to_schema(payload, IncomingMessagesRequest, handler.codec)
+        user = handler.user
+        publisher = MessagePublisher(message_hub, message_crud, user.id,
+                                     f'messages.incoming:{user.username}:{get_uid()}', request.since_message_id,
+                                     handler.codec)
+        handler.streams.add(publisher)
+        return publisher
 
     @router.fire_and_forget('online')
     async def receive_online(payload: Payload):
-        metric = payload_to_schema(payload, OnlineMetric)
-        online_sessions[metric.session] = datetime.datetime.now().timestamp()
+        """Kept for clients which don't bind presence to the connection keepalive."""
+        if handler.user is not None:
+            presence_tracker.touch(handler.session, handler.user.id)
+
+    @router.fire_and_forget('receipts')
+    async def receive_receipt(payload: Payload):
+        user = handler.user
+        if user is None:
+            return
+        request: ReceiptRequest = payload_to_schema(payload, ReceiptRequest, handler.codec)
+        receipt = await receipts_storage.update(user.id, request.with_user_id, request.delivered_message_id,
+                                                request.read_message_id)
+        if receipt is None:
+            return
+        if request.read_message_id is not None:
+            new_messages_storage.mark_read(user.id, request.with_user_id, receipt.read_message_id)
+        encoded = EncodedSchema(receipt)
+        message_hub.publish_to((request.with_user_id,), receipt, encoded)
+        await worker_bus.publish('receipt', encoded.encode(JSON_CODEC))
 
     @router.channel('statistics')
     async def send_statistics(payload: Payload):
+        if handler.user is None:
+            raise Exception('not authenticated')
+        request: MetricRequest = payload_to_schema(payload, MetricRequest, handler.codec)
 
-        request: MetricRequest = payload_to_schema(payload, MetricRequest)
-
-        class StatisticsChannel(DefaultPublisher, DefaultSubscriber, DefaultSubscription):
+        class StatisticsChannel(BufferedPublisher, DefaultSubscriber):
 
             def __init__(self, requested_statistics: MetricRequest):
-                super().__init__()
+                BufferedPublisher.__init__(self, f'statistics:{get_uid()}',
+                                           STATISTICS_HIGH_WATER_MARK, STATISTICS_OVERFLOW_STRATEGY)
+                DefaultSubscriber.__init__(self)
                 self._requested_statistics = requested_statistics
+                self._subscription = None
 
             def cancel(self):
-                self._sender.cancel()
+                if self._subscription:
+                    statistics_broadcaster.unsubscribe(self._subscription)
+                super().cancel()
 
             def subscribe(self, subscriber: Subscriber):
                 super().subscribe(subscriber)
-                subscriber.on_subscribe(self)
-                self._sender = asyncio.create_task(self._statistics_sender())
-
-            async def _statistics_sender(self):
-                while True:
-                    try:
-                        await asyncio.sleep(5)
-                        next_message = TotalOnlineMetric(total=len(online_sessions))
-
-                        self._subscriber.on_next(Payload(schema_to_bytes(next_message)))
-                    except Exception:
-                        logger.error('Statistics', exc_info=True)
+                self._subscription = statistics_broadcaster.subscribe(self.emit,
+                                                                      self._requested_statistics.period_seconds,
+                                                                      self._requested_statistics.ids,
+                                                                      handler.codec)
 
             def on_next(self, value: Payload, is_complete=False):
-                request = payload_to_schema(value, MetricRequest)
+                request = payload_to_schema(value, MetricRequest, handler.codec)
 
                 logger.info(f'Received statistics request {request.ids}, {request.period_seconds}')
+                self._requested_statistics = request
+                if self._subscription:
+                    statistics_broadcaster.update(self._subscription, request.period_seconds, request.ids)
 
         response = StatisticsChannel(request)
+        handler.streams.add(response)
 
         return response, response
 
-    return RoutingRequestHandler(router)
+    @authorized('metrics.buffers', BuffersMetricsRequest)
+    async def buffers_metrics(request: BuffersMetricsRequest, user: User) -> BaseResponse:
+        return BuffersMetricsResponse(buffers=get_buffers_metrics())
+
+    @authorized('metrics.cache', CacheMetricsRequest)
+    async def cache_metrics(request: CacheMetricsRequest, user: User) -> BaseResponse:
+        users_metric = CacheMetric(hits=user_account_crud.hits, misses=user_account_crud.misses,
+                                   size=user_account_crud.size)
+        usernames_metric = CacheMetric(hits=user_account_crud.usernames_hits,
+                                       misses=user_account_crud.usernames_misses,
+                                       size=user_account_crud.usernames_size)
+        return CacheMetricsResponse(users=users_metric, usernames=usernames_metric)
+
+    return handler
@@ -1,7 +1,7 @@
 import datetime
-from typing import List
+from typing import Optional
 
-from sqlalchemy import ForeignKey, DateTime, func
+from sqlalchemy import ForeignKey, DateTime, func, Index
 from sqlalchemy import String
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped
@@ -16,25 +16,103 @@ class Base(DeclarativeBase):
 class User(Base):
     __tablename__ = "user_account"
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    username: Mapped[str] = mapped_column(String(64))
+    username: Mapped[str] = mapped_column(String(64), unique=True, index=True)
     load_timestamp: Mapped[datetime.datetime] = mapped_column(DateTime, server_default=func.now())
 
     def __repr__(self) -> str:
         return f"User(id={self.id!r}, name={self.username!r})"
 
 
+Index('ix_user_account_username_lower', func.lower(User.username))
+
+
 class Message(Base):
     __tablename__ = "message"
+    __table_args__ = (
+        Index('ix_message_from_user_id_to_user_id_id', 'from_user_id', 'to_user_id', 'id'),
+        Index('ix_message_to_user_id_from_user_id_id', 'to_user_id', 'from_user_id', 'id'),
+        Index('ix_message_to_user_id_id', 'to_user_id', 'id'),
+    )
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     message_text: Mapped[str]
     from_user_id: Mapped[int] = mapped_column(ForeignKey("user_account.id"))
-    from_user: Mapped["User"] = relationship(primaryjoin=from_user_id == User.id,
-                                             lazy='joined')
+    from_user: Mapped["User"] = relationship(primaryjoin=from_user_id == User.id)
     to_user_id: Mapped[int] = mapped_column(ForeignKey("user_account.id"))
-    to_user: Mapped["User"] = relationship(primaryjoin=to_user_id == User.id,
-                                           lazy='joined')
+    to_user: Mapped["User"] = relationship(primaryjoin=to_user_id == User.id)
     load_timestamp: Mapped[datetime.datetime] = mapped_column(DateTime, server_default=func.now())
 
     def __repr__(self) -> str:
         return f"Message(id={self.id!r}, message_text={self.message_text!r})"
 
+
+
+class Dialog(Base):
+    """
+    Per-user inbox entry, kept up to date by MessageCRUD on every created message.
+    """
+    __tablename__ = "dialog"
+    __table_args__ = (
+        Index('ix_dialog_user_id_last_message_id', 'user_id', 'last_message_id'),
+    )
+    user_id: Mapped[int] = mapped_column(ForeignKey("user_account.id"), primary_key=True)
+    peer_id: Mapped[int] = mapped_column(ForeignKey("user_account.id"), primary_key=True)
+    last_message_id: Mapped[int] = mapped_column(ForeignKey("message.id"))
+    last_timestamp: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime)
+    unread_count: Mapped[int] = mapped_column(default=0)
+    delivered_message_id: Mapped[Optional[int]]
+    read_message_id: Mapped[Optional[int]]
+
+    def __repr__(self) -> str:
+        return f"Dialog(user_id={self.user_id!r}, peer_id={self.peer_id!r}, last_message_id={self.last_message_id!r})"
+
+
+class Room(Base):
+    __tablename__ = "room"
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    name: Mapped[str] = mapped_column(String(128))
+    owner_id: Mapped[int] = mapped_column(ForeignKey("user_account.id"))
+    load_timestamp: Mapped[datetime.datetime] = mapped_column(DateTime, server_default=func.now())
+
+    def __repr__(self) -> str:
+        return f"Room(id={self.id!r}, name={self.name!r})"
+
+
+class RoomMember(Base):
+    __tablename__ = "room_member"
+    __table_args__ = (
+        Index('ix_room_member_user_id_room_id', 'user_id', 'room_id'),
+    )
+    room_id: Mapped[int] = mapped_column(ForeignKey("room.id"), primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("user_account.id"), primary_key=True)
+    load_timestamp: Mapped[datetime.datetime] = mapped_column(DateTime, server_default=func.now())
+
+    def __repr__(self) -> str:
+        return f"RoomMember(room_id={self.room_id!r}, user_id={self.user_id!r})"
+
+
+class RoomMessage(Base):
+    __tablename__ = "room_message"
+    __table_args__ = (
+        Index('ix_room_message_room_id_id', 'room_id', 'id'),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    room_id: Mapped[int] = mapped_column(ForeignKey("room.id"))
+    from_user_id: Mapped[int] = mapped_column(ForeignKey("user_account.id"))
+    message_text: Mapped[str]
+    load_timestamp: Mapped[datetime.datetime] = mapped_column(DateTime, server_default=func.now())
+
+    def __repr__(self) -> str:
+        return f"RoomMessage(id={self.id!r}, room_id={self.room_id!r}, message_text={self.message_text!r})"
+
+
+class UserSession(Base):
+    __tablename__ = "user_session"
+    __table_args__ = (
+        Index('ix_user_session_expires_at', 'expires_at'),
+    )
+    token: Mapped[str] = mapped_column(String(64), primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("user_account.id"))
+    expires_at: Mapped[float]
+
+    def __repr__(self) -> str:
+        return f"UserSession(user_id={self.user_id!r}, expires_at={self.expires_at!r})"
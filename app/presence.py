@@ -0,0 +1,120 @@
+import asyncio
+import heapq
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+PresenceListener = Callable[[str, int, bool], None]
+
+
+class PresenceTracker:
+    """
+    Tracks online sessions with a lazy-deletion min-heap of deadlines on a monotonic clock.
+    touch() only pushes a new deadline; stale heap entries are skipped when popped, so expiring
+    costs O(expired * log n) instead of a scan over all sessions. Listeners are called with
+    (session, user_id, online) whenever a session goes online or offline.
+    Sessions of other worker processes are reported with set_remote: they count as online but
+    are never expired here, only their own worker takes them offline.
+    """
+
+    def __init__(self, inactive_period_s: float, resolution_s: float = 0.1,
+                 clock: Callable[[], float] = time.monotonic):
+        self._inactive_period_s = inactive_period_s
+        self._resolution_s = resolution_s
+        self._clock = clock
+        self._deadlines: Dict[str, float] = {}
+        self._users: Dict[str, int] = {}
+        self._users_sessions: Dict[int, int] = {}
+        self._remote: Set[str] = set()
+        self._heap: List[Tuple[float, str]] = []
+        self._listeners: List[PresenceListener] = []
+
+    def __len__(self) -> int:
+        return len(self._deadlines) + len(self._remote)
+
+    def __contains__(self, session: str) -> bool:
+        return session in self._deadlines or session in self._remote
+
+    def is_remote(self, session: str) -> bool:
+        return session in self._remote
+
+    def is_user_online(self, user_id: int) -> bool:
+        return user_id in self._users_sessions
+
+    def get_user_sessions_count(self, user_id: int) -> int:
+        return self._users_sessions.get(user_id, 0)
+
+    def get_online_users_ids(self) -> List[int]:
+        return list(self._users_sessions)
+
+    def subscribe(self, listener: PresenceListener):
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: PresenceListener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def touch(self, session: str, user_id: int):
+        deadline = self._clock() + self._inactive_period_s
+        is_new = session not in self._deadlines
+        self._deadlines[session] = deadline
+        heapq.heappush(self._heap, (deadline, session))
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(deadline, session) for session, deadline in self._deadlines.items()]
+            heapq.heapify(self._heap)
+        if is_new and session in self._remote:
+            self._remote.discard(session)
+        elif is_new:
+            self._users[session] = user_id
+            self._users_sessions[user_id] = self._users_sessions.get(user_id, 0) + 1
+            self._notify(session, user_id, True)
+
+    def set_remote(self, session: str, user_id: int, online: bool):
+        if online:
+            if session in self._users:
+                return
+            self._remote.add(session)
+            self._users[session] = user_id
+            self._users_sessions[user_id] = self._users_sessions.get(user_id, 0) + 1
+            self._notify(session, user_id, True)
+        elif session in self._remote:
+            self._set_offline(session)
+
+    def remove(self, session: str):
+        if self._deadlines.pop(session, None) is not None:
+            self._set_offline(session)
+
+    def expire(self) -> List[str]:
+        now = self._clock()
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, session = heapq.heappop(self._heap)
+            if self._deadlines.get(session) == deadline:
+                self._deadlines.pop(session)
+                self._set_offline(session)
+                expired.append(session)
+        return expired
+
+    def next_deadline(self) -> Optional[float]:
+        return self._heap[0][0] if self._heap else None
+
+    async def run(self):
+        while True:
+            next_deadline = self.next_deadline()
+            if next_deadline is None:
+                delay = self._inactive_period_s
+            else:
+                delay = max(next_deadline - self._clock(), self._resolution_s)
+            await asyncio.sleep(delay)
+            self.expire()
+
+    def _set_offline(self, session: str):
+        user_id = self._users.pop(session)
+        sessions_count = self._users_sessions.pop(user_id) - 1
+        if sessions_count:
+            self._users_sessions[user_id] = sessions_count
+        self._notify(session, user_id, False)
+        self._remote.discard(session)
+
+    def _notify(self, session: str, user_id: int, online: bool):
+        for listener in list(self._listeners):
+            listener(session, user_id, online)
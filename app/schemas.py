@@ -1,7 +1,7 @@
 import datetime
-from typing import Optional, List
+from typing import Any, Optional, List, Literal, Dict, Union
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, SerializeAsAny
 
 
 class User(BaseModel):
@@ -15,22 +15,53 @@ class User(BaseModel):
         return self.id == other.id and isinstance(other, User)
 
 
-class Message(BaseModel):
+class LeanMessage(BaseModel):
+    """Message without its users: responses carry them once in their users map."""
     id: int
     message_text: str
     from_user_id: int
     to_user_id: int
+    load_timestamp: Optional[datetime.datetime] = None
+
+
+class Message(LeanMessage):
     from_user: User
     to_user: User
+
+
+class Room(BaseModel):
+    id: int
+    name: str
+    owner_id: int
+
+
+class RoomMessage(BaseModel):
+    id: int
+    room_id: int
+    from_user_id: int
+    message_text: str
     load_timestamp: Optional[datetime.datetime] = None
 
 
+class Receipt(BaseModel):
+    """user_id has received (delivered) and read the messages of peer_id up to these ids."""
+    user_id: int
+    peer_id: int
+    delivered_message_id: Optional[int] = None
+    read_message_id: Optional[int] = None
+
+
 class Dialog(BaseModel):
     user: User
     with_user: User
+    last_message_id: Optional[int] = None
+    last_timestamp: Optional[datetime.datetime] = None
+    unread_count: int = 0
+    peer_delivered_message_id: Optional[int] = None
+    peer_read_message_id: Optional[int] = None
 
     def __hash__(self):
-        return hash(self.user.id) + hash(self.with_user.id)
+        return hash((self.user.id, self.with_user.id))
 
     def __eq__(self, other):
         return self.user.id == other.user.id and self.with_user.id == other.with_user.id
@@ -55,7 +86,7 @@ class LogoutResponse(BaseResponse):
 
 
 class CheckSessionResponse(BaseResponse):
-    session: Optional[str] = None
+    pass
 
 
 class FindUsersResponse(BaseResponse):
@@ -63,7 +94,15 @@ class FindUsersResponse(BaseResponse):
 
 
 class GetDialogMessagesResponse(BaseResponse):
-    messages: List[Message] = Field(default_factory=list)
+    messages: List[Union[Message, LeanMessage]] = Field(default_factory=list)
+    users: Dict[int, User] = Field(default_factory=dict)
+    has_more: bool = False
+
+
+class SearchMessagesResponse(BaseResponse):
+    messages: List[Union[Message, LeanMessage]] = Field(default_factory=list)
+    users: Dict[int, User] = Field(default_factory=dict)
+    has_more: bool = False
 
 
 class GetDialogsResponse(BaseResponse):
@@ -74,14 +113,56 @@ class SendMessageResponse(BaseResponse):
     message: Optional[Message] = None
 
 
+class CreateRoomResponse(BaseResponse):
+    room: Optional[Room] = None
+
+
+class AddRoomMembersResponse(BaseResponse):
+    users_ids: List[int] = Field(default_factory=list)
+
+
+class GetRoomsResponse(BaseResponse):
+    rooms: List[Room] = Field(default_factory=list)
+
+
+class SendRoomMessageResponse(BaseResponse):
+    message: Optional[RoomMessage] = None
+
+
+class GetRoomMessagesResponse(BaseResponse):
+    messages: List[RoomMessage] = Field(default_factory=list)
+    has_more: bool = False
+
+
+class UnreadDialog(BaseModel):
+    with_user_id: int
+    unread_count: int
+    messages: List[Message] = Field(default_factory=list)
+
+
+class GetUnreadResponse(BaseResponse):
+    dialogs: List[UnreadDialog] = Field(default_factory=list)
+    total: int = 0
+
+
 class GetUserByIdResponse(BaseResponse):
     user: Optional[User] = None
 
 
-class BaseRequest(BaseModel):
+class BatchResponse(BaseResponse):
+    """Responses of the batch sub-requests, in their order; each is encoded as its own response type."""
+    results: List[SerializeAsAny[BaseResponse]] = Field(default_factory=list)
+
+
+class SetupRequest(BaseModel):
+    """Data of the SETUP frame: a connection set up with a valid session is authenticated from the start."""
     session: Optional[str] = None
 
 
+class BaseRequest(BaseModel):
+    """Requests carry no session: they are authorized by the session bound to their connection."""
+
+
 class LoginRequest(BaseRequest):
     username: str
 
@@ -99,35 +180,152 @@ class FindUsersRequest(BaseRequest):
 
 
 class GetDialogMessagesRequest(BaseRequest):
-    user_id: int
     with_user_id: int
+    before_id: Optional[int] = None
+    after_id: Optional[int] = None
+    limit: int = Field(default=50, gt=0, le=500)
+    with_users: bool = False
+
+
+class SearchMessagesRequest(BaseRequest):
+    query: str = Field(min_length=1)
+    with_user_id: Optional[int] = None
+    order_by: Literal['recency', 'relevance'] = 'recency'
+    before_id: Optional[int] = None
+    offset: int = Field(default=0, ge=0)
+    limit: int = Field(default=20, gt=0, le=100)
+    with_users: bool = False
 
 
 class GetDialogsRequest(BaseRequest):
-    user_id: int
+    pass
 
 
 class SendMessageRequest(BaseRequest):
     message_text: str
-    from_user_id: int
     to_user_id: int
 
 
+class CreateRoomRequest(BaseRequest):
+    name: str = Field(min_length=1, max_length=128)
+    members_ids: List[int] = Field(default_factory=list)
+
+
+class AddRoomMembersRequest(BaseRequest):
+    room_id: int
+    users_ids: List[int]
+
+
+class GetRoomsRequest(BaseRequest):
+    pass
+
+
+class SendRoomMessageRequest(BaseRequest):
+    room_id: int
+    message_text: str
+
+
+class GetRoomMessagesRequest(BaseRequest):
+    room_id: int
+    before_id: Optional[int] = None
+    after_id: Optional[int] = None
+    limit: int = Field(default=50, gt=0, le=500)
+
+
+class ReceiptRequest(BaseRequest):
+    with_user_id: int
+    delivered_message_id: Optional[int] = None
+    read_message_id: Optional[int] = None
+
+
+class GetUnreadRequest(BaseRequest):
+    with_user_id: Optional[int] = None
+    with_messages: bool = False
+    mark_read: bool = False
+
+
 class GetUserByIdRequest(BaseRequest):
     user_id: int
 
 
+class IncomingMessagesRequest(BaseRequest):
+    since_message_id: Optional[int] = None
+
+
+class BatchItem(BaseModel):
+    """Request of route, given as the data it would be sent with on its own."""
+    route: str
+    data: Dict[str, Any] = Field(default_factory=dict)
+
+
+class BatchRequest(BaseRequest):
+    requests: List[BatchItem] = Field(default_factory=list)
+
+
 class BaseMetric(BaseModel):
     pass
 
 
 class OnlineMetric(BaseMetric):
-    session: str
+    pass
 
 
 class TotalOnlineMetric(BaseMetric):
     total: int
+    online: List[int] = Field(default_factory=list)
+    offline: List[int] = Field(default_factory=list)
+
+
+class BufferedBytesMetric(BaseMetric):
+    subscriber: str
+    buffered_bytes: int
+    buffered_count: int
+
+
+class CacheMetric(BaseMetric):
+    hits: int
+    misses: int
+    size: int
 
 
 class MetricRequest(BaseRequest):
+    ids: Optional[List[int]] = None
+    period_seconds: float = Field(default=5, ge=0.5)
+
+
+class BuffersMetricsRequest(BaseRequest):
+    pass
+
+
+class BuffersMetricsResponse(BaseResponse):
+    buffers: List[BufferedBytesMetric] = Field(default_factory=list)
+
+
+class CacheMetricsRequest(BaseRequest):
     pass
+
+
+class CacheMetricsResponse(BaseResponse):
+    users: Optional[CacheMetric] = None
+    usernames: Optional[CacheMetric] = None
+
+
+class SessionEvent(BaseModel):
+    session: str
+    user: User
+
+
+class PresenceEvent(BaseModel):
+    session: str
+    user_id: int
+    online: bool
+
+
+class RoomMembersEvent(BaseModel):
+    room_id: int
+    users_ids: List[int]
+
+
+class MarkReadEvent(BaseModel):
+    user_id: int
+    peers_ids: List[int]
@@ -1,37 +1,137 @@
+import argparse
 import asyncio
+import os
+import shutil
+import signal
+import socket
+import tempfile
+from typing import Optional
 
 from rsocket.rsocket_server import RSocketServer
 from rsocket.transports.tcp import TransportTCP
 
-from app.handlers import handler_factory, check_online_sessions
+from app import database
+from app.bus import BusBroker
+from app.handlers import handler_factory, presence_tracker, statistics_broadcaster, new_messages_storage, \
+    receipts_storage, worker_bus, session_store
 from app.logs import logger
 
 
+class ChatRSocketServer(RSocketServer):
+    """
+    RSocketServer ignores the client's keepalive frames; here each one is reported to the handler,
+    which keeps the connection's sessions online.
+    """
+
+    def _update_last_keepalive(self):
+        on_keepalive = getattr(self._handler, 'on_keepalive', None)
+        if on_keepalive is not None:
+            on_keepalive()
+
+
 class Server:
 
-    def __init__(self, host: str, port: int, handler_factory):
+    def __init__(self, host: str, port: int, handler_factory, reuse_port: bool = False):
         self._host = host
         self._port = port
         self._handler_factory = handler_factory
+        self._reuse_port = reuse_port
 
     async def run(self):
         def session(*connection):
-            RSocketServer(TransportTCP(*connection),
+            ChatRSocketServer(TransportTCP(*connection),
                           handler_factory=self._handler_factory
                           )
 
         logger.info(f'starting rsocket server at {self._host}:{self._port}')
-        async with await asyncio.start_server(session, self._host, self._port) as server:
+        async with await asyncio.start_server(session, self._host, self._port,
+                                              reuse_port=self._reuse_port or None) as server:
             await server.serve_forever()
 
 
-async def main():
-    host = 'localhost'
-    port = 1875
-    server = Server(host, port, handler_factory)
-    task = asyncio.create_task(check_online_sessions())
-    await server.run()
+async def main(host: str = 'localhost', port: int = 1875, reuse_port: bool = False, bus_path: Optional[str] = None):
+    server = Server(host, port, handler_factory, reuse_port)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    if bus_path is not None:
+        await worker_bus.connect(bus_path)
+    await session_store.load()
+    await new_messages_storage.load()
+    sessions_task = asyncio.create_task(session_store.run())
+    unread_task = asyncio.create_task(new_messages_storage.run())
+    receipts_task = asyncio.create_task(receipts_storage.run())
+    presence_task = asyncio.create_task(presence_tracker.run())
+    statistics_task = asyncio.create_task(statistics_broadcaster.run())
+    try:
+        await server.run()
+    finally:
+        sessions_task.cancel()
+        unread_task.cancel()
+        receipts_task.cancel()
+        presence_task.cancel()
+        statistics_task.cancel()
+        await asyncio.gather(sessions_task, unread_task, receipts_task, presence_task, statistics_task,
+                             return_exceptions=True)
+        await worker_bus.close()
+
+
+async def run_broker(bus_socket: socket.socket):
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    await BusBroker(bus_socket).run()
+
+
+def run_workers(host: str, port: int, workers: int):
+    """
+    Forks workers which accept connections on the same port (SO_REUSEPORT) and share sessions,
+    presence and messages through the BusBroker run by this process.
+    """
+    bus_dir = tempfile.mkdtemp(prefix='chat-bus-')
+    bus_path = os.path.join(bus_dir, 'bus.sock')
+    bus_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    bus_socket.bind(bus_path)
+    bus_socket.listen()
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            bus_socket.close()
+            database.engine.dispose(close=False)
+            exit_code = 0
+            try:
+                asyncio.run(main(host, port, True, bus_path))
+            except (KeyboardInterrupt, asyncio.CancelledError):
+                pass
+            except Exception:
+                logger.error('worker failed', exc_info=True)
+                exit_code = 1
+            os._exit(exit_code)
+        pids.append(pid)
+    logger.info(f'started {workers} workers: {pids}')
+    try:
+        asyncio.run(run_broker(bus_socket))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in pids:
+            os.waitpid(pid, 0)
+        shutil.rmtree(bus_dir, ignore_errors=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='rsocket chat server')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=1875)
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    if args.workers > 1:
+        run_workers(args.host, args.port, args.workers)
+    else:
+        asyncio.run(main(args.host, args.port))
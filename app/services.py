@@ -1,116 +1,490 @@
-from asyncio import Queue
-from typing import Dict, List
+import asyncio
+from collections import deque
+from typing import Dict, List, Callable, Set, Collection, Optional, Tuple, Deque
 
 from app import schemas
-from app.cruds import UserAccountCRUD, MessageCRUD
-from app.schemas import RegisterResponse, AuthResponse, Dialog, Message, User, CheckSessionResponse, LoginRequest, \
-    RegisterRequest, BaseRequest, FindUsersRequest, GetDialogsRequest, SendMessageRequest, GetDialogMessagesRequest, \
+from pydantic import BaseModel
+
+from app.cache import LRUCache
+from app.codecs import EncodedSchema
+from app.cruds import AsyncUserAccountCRUD, AsyncMessageCRUD, AsyncRoomCRUD
+from app.logs import logger
+from app.sessions import SessionStore
+from app.schemas import RegisterResponse, AuthResponse, Message, User, LoginRequest, \
+    RegisterRequest, FindUsersRequest, GetDialogsRequest, SendMessageRequest, GetDialogMessagesRequest, \
     SendMessageResponse, GetDialogsResponse, GetDialogMessagesResponse, FindUsersResponse, LogoutResponse, \
-    LogoutRequest, GetUserByIdResponse, GetUserByIdRequest
+    GetUserByIdResponse, GetUserByIdRequest, SearchMessagesRequest, SearchMessagesResponse, \
+    CreateRoomRequest, CreateRoomResponse, AddRoomMembersRequest, AddRoomMembersResponse, GetRoomsRequest, \
+    GetRoomsResponse, SendRoomMessageRequest, SendRoomMessageResponse, GetRoomMessagesRequest, \
+    GetRoomMessagesResponse, GetUnreadRequest, GetUnreadResponse, UnreadDialog
+from app.utils import max_id
 
 
 class AuthMiddleWare:
+    """
+    Authenticates connections rather than requests: a session is looked up once, when it is bound to
+    a connection at SETUP, and requests of the connection are then served without any lookup.
+    """
 
-    def __init__(self, active_users: Dict[str, schemas.User]):
-        self._active_users: Dict[str, schemas.User] = active_users
+    def __init__(self, session_store: SessionStore):
+        self._session_store = session_store
 
-    def check_session(self, request: BaseRequest) -> CheckSessionResponse:
-        session = request.session
-        if session in self._active_users:
-            return CheckSessionResponse(success=True, session=session)
-        return CheckSessionResponse(success=False, session=session)
+    def authenticate(self, session: Optional[str]) -> Optional[User]:
+        if session is None:
+            return None
+        return self._session_store.get(session)
 
 
 class AuthService:
 
-    def __init__(self, user_account_crud: UserAccountCRUD,
-                 active_users: Dict[str, schemas.User]):
+    def __init__(self, user_account_crud: AsyncUserAccountCRUD, session_store: SessionStore):
         self._user_account_crud = user_account_crud
-        self._active_users: Dict[str, schemas.User] = active_users
+        self._session_store = session_store
 
-    def register(self, request: RegisterRequest) -> RegisterResponse:
+    async def register(self, request: RegisterRequest) -> RegisterResponse:
         try:
-            user = self._user_account_crud.create(request.username)
+            user = await self._user_account_crud.create(request.username)
         except BaseException as e:
             response = RegisterResponse(success=False, error=str(e))
         else:
             response = RegisterResponse(user=user)
         return response
 
-    def auth(self, request: LoginRequest) -> AuthResponse:
+    async def auth(self, request: LoginRequest) -> AuthResponse:
         username = request.username
         try:
-            user = self._user_account_crud.get_by_username(username)
+            user = await self._user_account_crud.get_by_username(username)
         except BaseException as e:
             response = AuthResponse(success=False, error=str(e))
         else:
-            session = username + '_session'
-            self._active_users[session] = user
+            session = self._session_store.create(user)
             response = AuthResponse(user=user, session=session)
         return response
 
-    def logout(self, request: LogoutRequest) -> LogoutResponse:
-        try:
-            session = request.session
-            self._active_users.pop(session)
-        except KeyError:
+    def logout(self, session: Optional[str]) -> LogoutResponse:
+        if session is None or self._session_store.remove(session) is None:
             return LogoutResponse(success=False, error='wrong session')
-        else:
-            return LogoutResponse(success=True)
+        return LogoutResponse(success=True)
 
 
 class ChatService:
 
-    def __init__(self, user_account_crud: UserAccountCRUD, message_crud: MessageCRUD, finding_limit: int = 10):
+    def __init__(self, user_account_crud: AsyncUserAccountCRUD, message_crud: AsyncMessageCRUD,
+                 finding_limit: int = 10, new_messages_storage: Optional['NewMessagesStorage'] = None,
+                 receipts_storage: Optional['ReceiptsStorage'] = None):
         self._user_account_crud = user_account_crud
         self._message_crud = message_crud
         self._finding_limit = finding_limit
+        self._new_messages_storage = new_messages_storage
+        self._receipts_storage = receipts_storage
 
-    def get_user_by_id(self, request: GetUserByIdRequest) -> GetUserByIdResponse:
+    async def get_user_by_id(self, request: GetUserByIdRequest) -> GetUserByIdResponse:
         user_id = request.user_id
-        user = self._user_account_crud.get_by_id(user_id)
+        user = await self._user_account_crud.get_by_id(user_id)
         return GetUserByIdResponse(user=user)
 
-    def find_users(self, request: FindUsersRequest) -> FindUsersResponse:
+    async def find_users(self, request: FindUsersRequest) -> FindUsersResponse:
         username_part = request.username_part
-        found_users = self._user_account_crud.find_by_username_part(username_part, self._finding_limit)
+        found_users = await self._user_account_crud.find_by_username_part(username_part, self._finding_limit)
         return FindUsersResponse(users=found_users)
 
-    def get_dialog_messages(self, request: GetDialogMessagesRequest) -> GetDialogMessagesResponse:
-        user_id = request.user_id
+    async def get_dialog_messages(self, user_id: int, request: GetDialogMessagesRequest) -> GetDialogMessagesResponse:
         with_user_id = request.with_user_id
-        dialog_messages = self._message_crud.get_user_dialog(user_id, with_user_id)
-        return GetDialogMessagesResponse(messages=dialog_messages)
+        dialog_messages = await self._message_crud.get_user_dialog(user_id, with_user_id, request.before_id,
+                                                                   request.after_id, request.limit + 1,
+                                                                   request.with_users)
+        has_more = len(dialog_messages) > request.limit
+        if has_more:
+            if request.after_id is None or request.before_id is not None:
+                dialog_messages = dialog_messages[1:]
+            else:
+                dialog_messages = dialog_messages[:-1]
+        users = {} if request.with_users else await self._get_users(dialog_messages)
+        return GetDialogMessagesResponse(messages=dialog_messages, users=users, has_more=has_more)
 
-    def get_dialogs(self, request: GetDialogsRequest) -> GetDialogsResponse:
-        user_id = request.user_id
-        user = self._user_account_crud.get_by_id(user_id)
-        dialogs_users_ids = self._message_crud.get_user_dialogs_users_ids(user_id)
-        dialogs_users = [self._user_account_crud.get_by_id(dialog_user_id) for dialog_user_id in dialogs_users_ids]
-        return GetDialogsResponse(dialogs=[Dialog(user=user, with_user=dialog_user) for dialog_user in dialogs_users])
+    async def search_messages(self, user_id: int, request: SearchMessagesRequest) -> SearchMessagesResponse:
+        messages = await self._message_crud.search(user_id, request.query, request.with_user_id,
+                                                   request.order_by == 'relevance', request.before_id,
+                                                   request.offset, request.limit + 1, request.with_users)
+        has_more = len(messages) > request.limit
+        messages = messages[:request.limit]
+        users = {} if request.with_users else await self._get_users(messages)
+        return SearchMessagesResponse(messages=messages, users=users, has_more=has_more)
+
+    async def get_dialogs(self, user_id: int, request: GetDialogsRequest) -> GetDialogsResponse:
+        dialogs = await self._message_crud.get_user_dialogs(user_id)
+        if self._new_messages_storage is not None:
+            for dialog in dialogs:
+                dialog.unread_count = self._new_messages_storage.get_new_messages_count(user_id, dialog.with_user.id)
+        if self._receipts_storage is not None:
+            for dialog in dialogs:
+                delivered, read = self._receipts_storage.get(dialog.with_user.id, user_id)
+                dialog.peer_delivered_message_id = max_id(dialog.peer_delivered_message_id, delivered)
+                dialog.peer_read_message_id = max_id(dialog.peer_read_message_id, read)
+        return GetDialogsResponse(dialogs=dialogs)
+
+    def get_unread(self, user_id: int, request: GetUnreadRequest) -> GetUnreadResponse:
+        storage = self._new_messages_storage
+        if storage is None:
+            return GetUnreadResponse(success=False, error='unread messages are not tracked')
+        if request.with_user_id is None:
+            peers_ids = storage.get_unread_peers_ids(user_id)
+        else:
+            peers_ids = [request.with_user_id]
+        dialogs = [UnreadDialog(with_user_id=peer_id,
+                                unread_count=storage.get_new_messages_count(user_id, peer_id),
+                                messages=storage.get_new_messages(user_id, peer_id) if request.with_messages else [])
+                   for peer_id in peers_ids]
+        if request.mark_read:
+            for peer_id in peers_ids:
+                storage.mark_read(user_id, peer_id)
+        return GetUnreadResponse(dialogs=dialogs, total=sum(dialog.unread_count for dialog in dialogs))
 
-    def send_message(self, request: SendMessageRequest) -> SendMessageResponse:
+    async def _get_users(self, messages: List[schemas.LeanMessage]) -> Dict[int, User]:
+        """Users of lean messages, looked up once per response."""
+        users_ids = {message.from_user_id for message in messages} | {message.to_user_id for message in messages}
+        return {user.id: user for user in await self._user_account_crud.get_by_ids(list(users_ids))}
+
+    async def send_message(self, from_user_id: int, request: SendMessageRequest) -> SendMessageResponse:
         message_text: str = request.message_text
-        from_user_id: int = request.from_user_id
         to_user_id: int = request.to_user_id
-        message = self._message_crud.create(message_text, from_user_id, to_user_id)
+        message = await self._message_crud.create(message_text, from_user_id, to_user_id)
         return SendMessageResponse(message=message)
 
 
+class RoomMembershipIndex:
+    """
+    In-memory room_id -> members ids index, loaded from the database on first use of a room and kept
+    up to date by add_members, so membership checks and fan-out need no database round trip.
+    """
+
+    def __init__(self, room_crud: AsyncRoomCRUD):
+        self._room_crud = room_crud
+        self._members: Dict[int, Set[int]] = {}
+        self._versions: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    async def get_members(self, room_id: int) -> Set[int]:
+        members = self._members.get(room_id)
+        while members is None:
+            version = self._versions.get(room_id, 0)
+            members_ids = await self._room_crud.get_members_ids(room_id)
+            members = self._members.get(room_id)
+            if members is None and self._versions.get(room_id, 0) == version:
+                members = self._members[room_id] = set(members_ids)
+        return members
+
+    async def is_member(self, room_id: int, user_id: int) -> bool:
+        return user_id in await self.get_members(room_id)
+
+    def add_members(self, room_id: int, users_ids: Collection[int]):
+        members = self._members.get(room_id)
+        if members is None:
+            self._versions[room_id] = self._versions.get(room_id, 0) + 1
+        else:
+            members.update(users_ids)
+
+
+class RoomService:
+
+    def __init__(self, room_crud: AsyncRoomCRUD, membership_index: RoomMembershipIndex):
+        self._room_crud = room_crud
+        self._membership_index = membership_index
+
+    async def create_room(self, owner_id: int, request: CreateRoomRequest) -> CreateRoomResponse:
+        room = await self._room_crud.create(request.name, owner_id, request.members_ids)
+        self._membership_index.add_members(room.id, [owner_id, *request.members_ids])
+        return CreateRoomResponse(room=room)
+
+    async def add_members(self, user_id: int, request: AddRoomMembersRequest) -> AddRoomMembersResponse:
+        if not await self._membership_index.is_member(request.room_id, user_id):
+            return AddRoomMembersResponse(success=False, error='not a room member')
+        await self._room_crud.add_members(request.room_id, request.users_ids)
+        self._membership_index.add_members(request.room_id, request.users_ids)
+        return AddRoomMembersResponse(users_ids=request.users_ids)
+
+    async def get_rooms(self, user_id: int, request: GetRoomsRequest) -> GetRoomsResponse:
+        rooms = await self._room_crud.get_user_rooms(user_id)
+        return GetRoomsResponse(rooms=rooms)
+
+    async def send_room_message(self, user_id: int, request: SendRoomMessageRequest) -> SendRoomMessageResponse:
+        if not await self._membership_index.is_member(request.room_id, user_id):
+            return SendRoomMessageResponse(success=False, error='not a room member')
+        message = await self._room_crud.create_message(request.room_id, user_id, request.message_text)
+        return SendRoomMessageResponse(message=message)
+
+    async def get_room_messages(self, user_id: int, request: GetRoomMessagesRequest) -> GetRoomMessagesResponse:
+        if not await self._membership_index.is_member(request.room_id, user_id):
+            return GetRoomMessagesResponse(success=False, error='not a room member')
+        messages = await self._room_crud.get_room_messages(request.room_id, request.before_id, request.after_id,
+                                                           request.limit + 1)
+        has_more = len(messages) > request.limit
+        if has_more:
+            if request.after_id is None or request.before_id is not None:
+                messages = messages[1:]
+            else:
+                messages = messages[:-1]
+        return GetRoomMessagesResponse(messages=messages, has_more=has_more)
+
+    async def get_members(self, room_id: int) -> Set[int]:
+        return await self._membership_index.get_members(room_id)
+
+
+DialogKey = Tuple[int, int]
+
+
 class NewMessagesStorage:
+    """
+    Unread messages of each dialog, keyed by (user_id, peer_id): a counter and a ring buffer with the
+    latest max_pending messages. Counts changed since the previous flush are written to the dialog table
+    every flush_interval_s seconds and on shutdown, and loaded back from it on start.
+    """
+
+    def __init__(self, message_crud: AsyncMessageCRUD, max_pending: int = 50, flush_interval_s: float = 5):
+        self._message_crud = message_crud
+        self._max_pending = max_pending
+        self._flush_interval_s = flush_interval_s
+        self._counts: Dict[DialogKey, int] = {}
+        self._pending: Dict[DialogKey, Deque[Message]] = {}
+        self._users_peers: Dict[int, Set[int]] = {}
+        self._dirty: Set[DialogKey] = set()
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    async def load(self):
+        for user_id, peer_id, unread_count in await self._message_crud.get_unread_counts():
+            self._counts[(user_id, peer_id)] = unread_count
+            self._users_peers.setdefault(user_id, set()).add(peer_id)
 
-    def __init__(self):
-        self._new_messages: Dict[Dialog, Queue] = {}
+    def add(self, message: Message):
+        """Counts the message as unread by its recipient; replying marks the sender's side of the dialog read."""
+        self.mark_read(message.from_user_id, message.to_user_id)
+        key = (message.to_user_id, message.from_user_id)
+        self._counts[key] = self._counts.get(key, 0) + 1
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = deque(maxlen=self._max_pending)
+        pending.append(message)
+        self._users_peers.setdefault(message.to_user_id, set()).add(message.from_user_id)
+        self._dirty.add(key)
 
-    def add(self, dialog: Dialog, message: Message):
-        pass
+    def get_new_messages_count(self, user_id: int, peer_id: int) -> int:
+        return self._counts.get((user_id, peer_id), 0)
 
-    def get_new_messages_count(self, dialog: Dialog) -> int:
+    def get_new_messages(self, user_id: int, peer_id: int) -> List[Message]:
+        return list(self._pending.get((user_id, peer_id), ()))
+
+    def get_unread_peers_ids(self, user_id: int) -> List[int]:
+        return list(self._users_peers.get(user_id, ()))
+
+    def mark_read(self, user_id: int, peer_id: int, up_to_message_id: Optional[int] = None):
+        """
+        Marks the dialog read up to up_to_message_id, or entirely. A partial read is applied only if the
+        ring buffer holds all messages after up_to_message_id, otherwise the count is left as it is; so is
+        a count loaded on start, which has no messages in the ring buffer to compare with.
+        """
+        key = (user_id, peer_id)
+        if key not in self._counts:
+            return
+        pending = self._pending.get(key)
+        if up_to_message_id is not None:
+            if not pending:
+                return
+            if up_to_message_id < pending[-1].id:
+                if up_to_message_id >= pending[0].id:
+                    while pending[0].id <= up_to_message_id:
+                        pending.popleft()
+                    self._counts[key] = len(pending)
+                    self._dirty.add(key)
+                return
+        self._counts.pop(key)
+        self._pending.pop(key, None)
+        peers = self._users_peers[user_id]
+        peers.discard(peer_id)
+        if not peers:
+            self._users_peers.pop(user_id)
+        self._dirty.add(key)
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        counts = [(user_id, peer_id, self._counts.get((user_id, peer_id), 0)) for user_id, peer_id in dirty]
+        try:
+            await self._message_crud.update_unread_counts(counts)
+        except Exception:
+            self._dirty.update(dirty)
+            raise
+
+    async def run(self):
+        try:
+            while True:
+                await asyncio.sleep(self._flush_interval_s)
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.error(f'failed to flush unread counts: {e}')
+        finally:
+            await self.flush()
+
+
+class ReceiptsStorage:
+    """
+    Delivered and read watermarks of dialogs, keyed by (user_id, peer_id). Receipts only move the
+    watermarks forward and are coalesced in memory; the latest ones are written in one batch every
+    flush_interval_s seconds and on shutdown. The last max_dialogs watermarks are remembered to
+    drop receipts which change nothing; the watermarks of other dialogs are read from the database
+    before they are updated.
+    """
+
+    def __init__(self, message_crud: AsyncMessageCRUD, flush_interval_s: float = 1, max_dialogs: int = 100000):
+        self._message_crud = message_crud
+        self._flush_interval_s = flush_interval_s
+        self._watermarks = LRUCache(max_dialogs)
+        self._dirty: Dict[DialogKey, Tuple[Optional[int], Optional[int]]] = {}
+
+    def get(self, user_id: int, peer_id: int) -> Tuple[Optional[int], Optional[int]]:
+        key = (user_id, peer_id)
+        return self._watermarks.get(key) or self._dirty.get(key) or (None, None)
+
+    async def _load(self, user_id: int, peer_id: int) -> Tuple[Optional[int], Optional[int]]:
+        key = (user_id, peer_id)
+        watermarks = self._watermarks.get(key) or self._dirty.get(key)
+        if watermarks is None:
+            stored_delivered, stored_read = await self._message_crud.get_receipts(user_id, peer_id)
+            delivered, read = self.get(user_id, peer_id)
+            watermarks = (max_id(delivered, stored_delivered), max_id(read, stored_read))
+            self._watermarks.put(key, watermarks)
+        return watermarks
+
+    def remember(self, receipt: schemas.Receipt):
+        """Moves the remembered watermarks forward with a receipt persisted elsewhere, e.g. by another worker."""
+        key = (receipt.user_id, receipt.peer_id)
+        watermarks = self._watermarks.get(key)
+        if watermarks is not None:
+            self._watermarks.put(key, (max_id(watermarks[0], receipt.delivered_message_id),
+                                       max_id(watermarks[1], receipt.read_message_id)))
+
+    async def update(self, user_id: int, peer_id: int, delivered_message_id: Optional[int] = None,
+                     read_message_id: Optional[int] = None) -> Optional[schemas.Receipt]:
+        """Returns the new watermarks, or None if the receipt didn't move them."""
+        delivered, read = await self._load(user_id, peer_id)
+        new_delivered = max_id(delivered, delivered_message_id, read_message_id)
+        new_read = max_id(read, read_message_id)
+        if new_delivered == delivered and new_read == read:
+            return None
+        key = (user_id, peer_id)
+        self._watermarks.put(key, (new_delivered, new_read))
+        self._dirty[key] = (new_delivered, new_read)
+        return schemas.Receipt(user_id=user_id, peer_id=peer_id,
+                               delivered_message_id=new_delivered, read_message_id=new_read)
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        try:
+            await self._message_crud.update_receipts([(user_id, peer_id, delivered, read)
+                                                      for (user_id, peer_id), (delivered, read) in dirty.items()])
+        except Exception:
+            for key, watermarks in dirty.items():
+                self._dirty.setdefault(key, watermarks)
+            raise
+
+    async def run(self):
         try:
-            new_messages_count = len(self._new_messages[dialog])
-        except KeyError:
-            new_messages_count = 0
-        return new_messages_count
+            while True:
+                await asyncio.sleep(self._flush_interval_s)
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.error(f'failed to flush receipts: {e}')
+        finally:
+            await self.flush()
+
+
+MessageCallback = Callable[[BaseModel, EncodedSchema], None]
+
+
+class RecentMessages:
+    """
+    Ring of the latest messages published to a user. It holds every message with id > floor.
+    """
+
+    def __init__(self, size: int, floor: int):
+        self.messages: Deque[Tuple[Message, EncodedSchema]] = deque(maxlen=size)
+        self.floor = floor
+
+    def append(self, message: Message, encoded: EncodedSchema):
+        if len(self.messages) == self.messages.maxlen:
+            self.floor = max(self.floor, self.messages[0][0].id)
+        self.messages.append((message, encoded))
+
 
-    def get_new_messages(self, dialog: Dialog) -> List[Message]:
-        pass
+class MessageHub:
+    """
+    Delivers each message to the subscribers of its recipient together with its EncodedSchema,
+    which is shared by all of them, so it is encoded once per codec rather than per subscriber.
+    If history_size is set, the latest history_size direct messages of up to history_users
+    recipients are kept as well, so reconnecting clients can catch up without a database query.
+    """
+
+    def __init__(self, history_size: int = 0, history_users: int = 10000):
+        self._subscribers: Dict[int, List[MessageCallback]] = {}
+        self._history_size = history_size
+        self._history = LRUCache(history_users)
+
+    def subscribe(self, user_id: int, callback: MessageCallback):
+        self._subscribers.setdefault(user_id, []).append(callback)
+
+    def unsubscribe(self, user_id: int, callback: MessageCallback):
+        callbacks = self._subscribers.get(user_id)
+        if callbacks is None or callback not in callbacks:
+            return
+        callbacks.remove(callback)
+        if not callbacks:
+            self._subscribers.pop(user_id)
+
+    def get_subscribers_count(self, user_id: int) -> int:
+        return len(self._subscribers.get(user_id, ()))
+
+    def publish(self, message: Message, encoded: EncodedSchema):
+        if self._history_size:
+            recent_messages = self._history.get(message.to_user_id)
+            if recent_messages is None:
+                recent_messages = RecentMessages(self._history_size, message.id - 1)
+                self._history.put(message.to_user_id, recent_messages)
+            recent_messages.append(message, encoded)
+        for callback in tuple(self._subscribers.get(message.to_user_id, ())):
+            callback(message, encoded)
+
+    def get_recent_messages(self, user_id: int,
+                            since_message_id: int) -> Optional[List[Tuple[Message, EncodedSchema]]]:
+        """
+        Messages published to the user after since_message_id, or None if some of them may be
+        missing from the history.
+        """
+        recent_messages = self._history.get(user_id)
+        if recent_messages is None or since_message_id < recent_messages.floor:
+            return None
+        return [(message, encoded) for message, encoded in recent_messages.messages
+                if message.id > since_message_id]
+
+    def publish_to(self, users_ids: Collection[int], message: BaseModel, encoded: EncodedSchema,
+                   exclude_user_id: Optional[int] = None):
+        """
+        Delivers to the subscribed users among users_ids, iterating whichever of the two is smaller,
+        so a room with many offline members costs as much as its online ones.
+        """
+        if len(users_ids) > len(self._subscribers):
+            receivers_ids = [user_id for user_id in self._subscribers if user_id in users_ids]
+        else:
+            receivers_ids = [user_id for user_id in users_ids if user_id in self._subscribers]
+        for user_id in receivers_ids:
+            if user_id == exclude_user_id:
+                continue
+            for callback in tuple(self._subscribers.get(user_id, ())):
+                callback(message, encoded)
@@ -0,0 +1,266 @@
+import abc
+import asyncio
+import heapq
+import secrets
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from app import schemas
+from app.cruds import AsyncSessionCRUD
+from app.logs import logger
+
+
+class SessionStore(abc.ABC):
+    """
+    Maps random session tokens to users. Sessions expire ttl_s seconds after they were last touched.
+    Sessions added as not owned (e.g. created by another worker) are owned from their first touch here.
+    """
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    @abc.abstractmethod
+    def __contains__(self, session: str) -> bool:
+        ...
+
+    def create(self, user: schemas.User) -> str:
+        session = secrets.token_urlsafe(32)
+        self.add(session, user)
+        return session
+
+    @abc.abstractmethod
+    def add(self, session: str, user: schemas.User, expires_at: Optional[float] = None, owned: bool = True):
+        ...
+
+    @abc.abstractmethod
+    def get(self, session: str) -> Optional[schemas.User]:
+        ...
+
+    @abc.abstractmethod
+    def touch(self, session: str):
+        ...
+
+    @abc.abstractmethod
+    def remove(self, session: str) -> Optional[schemas.User]:
+        ...
+
+    @abc.abstractmethod
+    def get_user_sessions(self, user_id: int) -> List[str]:
+        ...
+
+    @abc.abstractmethod
+    def expire(self) -> List[str]:
+        ...
+
+    async def run(self, resolution_s: float = 1):
+        while True:
+            await asyncio.sleep(resolution_s)
+            self.expire()
+
+
+class SessionEntry:
+    __slots__ = ('user', 'expires_at', 'scheduled_at', 'owned')
+
+    def __init__(self, user: schemas.User, expires_at: float, owned: bool = True):
+        self.user = user
+        self.expires_at = expires_at
+        self.scheduled_at = expires_at
+        self.owned = owned
+
+
+class SessionsShard:
+    """
+    Sessions of one shard with a min-heap of their deadlines. touch() only moves the deadline of the
+    entry; when its heap item comes due, an entry with a later deadline is pushed back instead of
+    expiring. Heap items of removed or replaced entries are skipped.
+    """
+
+    def __init__(self):
+        self.sessions: Dict[str, SessionEntry] = {}
+        self.heap: List[Tuple[float, str]] = []
+
+    def put(self, session: str, entry: SessionEntry):
+        self.sessions[session] = entry
+        heapq.heappush(self.heap, (entry.scheduled_at, session))
+        if len(self.heap) > 2 * len(self.sessions) + 64:
+            self.heap = [(entry.scheduled_at, session) for session, entry in self.sessions.items()]
+            heapq.heapify(self.heap)
+
+    def expire(self, now: float) -> List[Tuple[str, SessionEntry]]:
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, session = heapq.heappop(self.heap)
+            entry = self.sessions.get(session)
+            if entry is None or entry.scheduled_at != deadline:
+                continue
+            if entry.expires_at > now:
+                entry.scheduled_at = entry.expires_at
+                heapq.heappush(self.heap, (entry.scheduled_at, session))
+                continue
+            self.sessions.pop(session)
+            expired.append((session, entry))
+        return expired
+
+
+class ShardedSessionStore(SessionStore):
+    """
+    In-process session store split into shards by token hash, so lookups are O(1) and each expiry
+    pass only walks the due heap items of every shard. Sessions of a user are indexed by user id.
+    """
+
+    def __init__(self, ttl_s: float = 7 * 24 * 3600, shards: int = 16, clock: Callable[[], float] = time.time):
+        self._ttl_s = ttl_s
+        self._clock = clock
+        self._shards = [SessionsShard() for _ in range(shards)]
+        self._users_sessions: Dict[int, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(shard.sessions) for shard in self._shards)
+
+    def __contains__(self, session: str) -> bool:
+        return self.get(session) is not None
+
+    def _shard(self, session: str) -> SessionsShard:
+        return self._shards[hash(session) % len(self._shards)]
+
+    def add(self, session: str, user: schemas.User, expires_at: Optional[float] = None, owned: bool = True):
+        if expires_at is None:
+            expires_at = self._clock() + self._ttl_s
+        shard = self._shard(session)
+        previous = shard.sessions.get(session)
+        if previous is not None:
+            self._unindex(session, previous.user.id)
+        shard.put(session, SessionEntry(user, expires_at, owned))
+        self._users_sessions.setdefault(user.id, set()).add(session)
+
+    def get(self, session: Optional[str]) -> Optional[schemas.User]:
+        if session is None:
+            return None
+        entry = self._shard(session).sessions.get(session)
+        if entry is None or entry.expires_at <= self._clock():
+            return None
+        return entry.user
+
+    def get_expires_at(self, session: str) -> Optional[float]:
+        entry = self._shard(session).sessions.get(session)
+        return None if entry is None else entry.expires_at
+
+    def touch(self, session: str):
+        entry = self._shard(session).sessions.get(session)
+        if entry is not None:
+            entry.expires_at = self._clock() + self._ttl_s
+            entry.owned = True
+
+    def remove(self, session: str) -> Optional[schemas.User]:
+        entry = self._shard(session).sessions.pop(session, None)
+        if entry is None:
+            return None
+        self._unindex(session, entry.user.id)
+        return entry.user
+
+    def get_user_sessions(self, user_id: int) -> List[str]:
+        return list(self._users_sessions.get(user_id, ()))
+
+    def expire(self) -> List[str]:
+        return [session for session, _ in self._expire_entries()]
+
+    def _expire_entries(self) -> List[Tuple[str, SessionEntry]]:
+        now = self._clock()
+        expired = []
+        for shard in self._shards:
+            for session, entry in shard.expire(now):
+                self._unindex(session, entry.user.id)
+                expired.append((session, entry))
+        return expired
+
+    def _unindex(self, session: str, user_id: int):
+        sessions = self._users_sessions.get(user_id)
+        if sessions is None:
+            return
+        sessions.discard(session)
+        if not sessions:
+            self._users_sessions.pop(user_id)
+
+
+class PersistentSessionStore(ShardedSessionStore):
+    """
+    ShardedSessionStore backed by the user_session table, so sessions survive restarts. Lookups
+    never touch the database: sessions are loaded once on start, and created, extended or removed
+    ones are written behind in one batch every flush_interval_s seconds and on shutdown. Deadlines
+    are persisted only when they moved by more than a hundredth of the ttl.
+    Only owned sessions are persisted and deleted on expiry: those loaded on start or created by other
+    workers are extended by the worker that serves them, so expiring an untouched copy here must not
+    delete their row. Rows of sessions which expired unowned everywhere are deleted on the next start.
+    """
+
+    def __init__(self, session_crud: AsyncSessionCRUD, ttl_s: float = 7 * 24 * 3600, shards: int = 16,
+                 flush_interval_s: float = 1, clock: Callable[[], float] = time.time):
+        super().__init__(ttl_s, shards, clock)
+        self._session_crud = session_crud
+        self._flush_interval_s = flush_interval_s
+        self._persisted_expires_at: Dict[str, float] = {}
+        self._dirty: Set[str] = set()
+
+    async def load(self):
+        now = self._clock()
+        await self._session_crud.delete_expired(now)
+        for session, user, expires_at in await self._session_crud.get_active(now):
+            super().add(session, user, expires_at, owned=False)
+            self._persisted_expires_at[session] = expires_at
+
+    def add(self, session: str, user: schemas.User, expires_at: Optional[float] = None, owned: bool = True):
+        super().add(session, user, expires_at, owned)
+        if owned:
+            self._dirty.add(session)
+
+    def touch(self, session: str):
+        super().touch(session)
+        expires_at = self.get_expires_at(session)
+        persisted = self._persisted_expires_at.get(session)
+        if expires_at is not None and (persisted is None or expires_at - persisted > self._ttl_s / 100):
+            self._dirty.add(session)
+
+    def remove(self, session: str) -> Optional[schemas.User]:
+        user = super().remove(session)
+        if user is not None:
+            self._dirty.add(session)
+        return user
+
+    def expire(self) -> List[str]:
+        expired = self._expire_entries()
+        self._dirty.update(session for session, entry in expired if entry.owned)
+        return [session for session, _ in expired]
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        saved, removed = [], []
+        for session in dirty:
+            entry = self._shard(session).sessions.get(session)
+            if entry is None:
+                removed.append(session)
+            else:
+                saved.append((session, entry.user.id, entry.expires_at))
+        try:
+            await self._session_crud.save(saved, removed)
+        except Exception:
+            self._dirty.update(dirty)
+            raise
+        for session, _, expires_at in saved:
+            self._persisted_expires_at[session] = expires_at
+        for session in removed:
+            self._persisted_expires_at.pop(session, None)
+
+    async def run(self, resolution_s: float = 1):
+        try:
+            while True:
+                await asyncio.sleep(min(resolution_s, self._flush_interval_s))
+                self.expire()
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.error(f'failed to flush sessions: {e}')
+        finally:
+            await self.flush()
@@ -0,0 +1,121 @@
+import asyncio
+import time
+from typing import Callable, Dict, Iterable, Optional, Set
+
+from app.codecs import Codec, EncodedSchema, JSON_CODEC
+from app.logs import logger
+from app.presence import PresenceTracker
+from app.schemas import TotalOnlineMetric
+
+
+class StatisticsSubscription:
+
+    def __init__(self, emit: Callable[[bytes], None], period_s: float, next_due: float, codec: Codec):
+        self.emit = emit
+        self.codec = codec
+        self.period_s = period_s
+        self.next_due = next_due
+        self.ids: Set[int] = set()
+        self.online: Set[int] = set()
+        self.offline: Set[int] = set()
+
+
+class StatisticsBroadcaster:
+    """
+    Single producer of online statistics for all statistics channels. On every tick the total is
+    computed and serialized once per codec and shared by all due subscribers; subscribers watching user ids
+    additionally get the ids that came online or went offline since their previous update.
+    """
+
+    def __init__(self, presence_tracker: PresenceTracker, resolution_s: float = 0.5,
+                 clock: Callable[[], float] = time.monotonic):
+        self._presence_tracker = presence_tracker
+        self._resolution_s = resolution_s
+        self._clock = clock
+        self._subscriptions: Set[StatisticsSubscription] = set()
+        self._watchers: Dict[int, Set[StatisticsSubscription]] = {}
+        presence_tracker.subscribe(self._on_presence_changed)
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def subscribe(self, emit: Callable[[bytes], None], period_s: float,
+                  ids: Optional[Iterable[int]] = None, codec: Codec = JSON_CODEC) -> StatisticsSubscription:
+        subscription = StatisticsSubscription(emit, period_s, self._clock(), codec)
+        self._subscriptions.add(subscription)
+        self._watch(subscription, ids or ())
+        return subscription
+
+    def update(self, subscription: StatisticsSubscription, period_s: float, ids: Optional[Iterable[int]] = None):
+        self._unwatch(subscription)
+        subscription.period_s = period_s
+        subscription.next_due = min(subscription.next_due, self._clock() + period_s)
+        self._watch(subscription, ids or ())
+
+    def unsubscribe(self, subscription: StatisticsSubscription):
+        self._unwatch(subscription)
+        self._subscriptions.discard(subscription)
+
+    def tick(self):
+        now = self._clock()
+        total = len(self._presence_tracker)
+        total_metric = None
+        for subscription in list(self._subscriptions):
+            if subscription.next_due > now or subscription not in self._subscriptions:
+                continue
+            subscription.next_due = now + subscription.period_s
+            if subscription.online or subscription.offline:
+                metric = TotalOnlineMetric(total=total, online=sorted(subscription.online),
+                                           offline=sorted(subscription.offline))
+                subscription.online.clear()
+                subscription.offline.clear()
+                subscription.emit(subscription.codec.encode(metric))
+            else:
+                if total_metric is None:
+                    total_metric = EncodedSchema(TotalOnlineMetric(total=total))
+                subscription.emit(total_metric.encode(subscription.codec))
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self._resolution_s)
+            try:
+                self.tick()
+            except Exception:
+                logger.error('statistics tick failed', exc_info=True)
+
+    def _watch(self, subscription: StatisticsSubscription, ids: Iterable[int]):
+        subscription.ids = set(ids)
+        subscription.online.clear()
+        subscription.offline.clear()
+        for user_id in subscription.ids:
+            self._watchers.setdefault(user_id, set()).add(subscription)
+            if self._presence_tracker.is_user_online(user_id):
+                subscription.online.add(user_id)
+            else:
+                subscription.offline.add(user_id)
+
+    def _unwatch(self, subscription: StatisticsSubscription):
+        for user_id in subscription.ids:
+            watchers = self._watchers.get(user_id)
+            if watchers is None:
+                continue
+            watchers.discard(subscription)
+            if not watchers:
+                self._watchers.pop(user_id)
+        subscription.ids = set()
+
+    def _on_presence_changed(self, session: str, user_id: int, online: bool):
+        watchers = self._watchers.get(user_id)
+        if not watchers:
+            return
+        if online != self._presence_tracker.is_user_online(user_id):
+            return
+        if online and self._presence_tracker.get_user_sessions_count(user_id) > 1:
+            return
+        for subscription in watchers:
+            if online:
+                subscription.offline.discard(user_id)
+                subscription.online.add(user_id)
+            else:
+                subscription.online.discard(user_id)
+                subscription.offline.add(user_id)
@@ -0,0 +1,114 @@
+import enum
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from reactivestreams.publisher import DefaultPublisher
+from reactivestreams.subscriber import Subscriber
+from reactivestreams.subscription import DefaultSubscription
+from rsocket.payload import Payload
+
+from app.logs import logger
+from app.schemas import BufferedBytesMetric
+
+
+class OverflowStrategy(enum.Enum):
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+    DISCONNECT = 'disconnect'
+
+
+class BufferOverflowError(Exception):
+    pass
+
+
+class BufferedPublisher(DefaultPublisher, DefaultSubscription):
+    """
+    Publisher which emits payloads only as far as the subscriber has requested them with request(n).
+    Payloads without demand are kept in a buffer bounded by high_water_mark; overflow_strategy decides
+    what happens when the buffer is full.
+    """
+
+    active_publishers: Dict[str, 'BufferedPublisher'] = {}
+
+    def __init__(self, name: str, high_water_mark: int = 100,
+                 overflow_strategy: OverflowStrategy = OverflowStrategy.DROP_OLDEST):
+        self._name = name
+        self._high_water_mark = high_water_mark
+        self._overflow_strategy = overflow_strategy
+        self._buffer: Deque[bytes] = deque()
+        self._buffered_bytes = 0
+        self._requested = 0
+        self._subscriber: Optional[Subscriber] = None
+        self._cancelled = False
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def buffered_bytes(self) -> int:
+        return self._buffered_bytes
+
+    @property
+    def buffered_count(self) -> int:
+        return len(self._buffer)
+
+    @property
+    def requested(self) -> int:
+        return self._requested
+
+    def subscribe(self, subscriber: Subscriber):
+        super().subscribe(subscriber)
+        self.active_publishers[self._name] = self
+        subscriber.on_subscribe(self)
+
+    def request(self, n: int):
+        self._requested += n
+        self._drain()
+
+    def cancel(self):
+        self._cancelled = True
+        self._buffer.clear()
+        self._buffered_bytes = 0
+        if self.active_publishers.get(self._name) is self:
+            self.active_publishers.pop(self._name)
+
+    def fail(self, error: Exception):
+        """Cancels the publisher and ends the stream of its subscriber with error, unless it is cancelled already."""
+        if self._cancelled:
+            return
+        self.cancel()
+        if self._subscriber is not None:
+            self._subscriber.on_error(error)
+
+    def emit(self, data: bytes):
+        if self._cancelled:
+            return
+        if len(self._buffer) >= self._high_water_mark:
+            if self._overflow_strategy is OverflowStrategy.DROP_NEWEST:
+                logger.warning(f'{self._name}: buffer is full, dropping newest payload')
+                return
+            if self._overflow_strategy is OverflowStrategy.DROP_OLDEST:
+                logger.warning(f'{self._name}: buffer is full, dropping oldest payload')
+                self._buffered_bytes -= len(self._buffer.popleft())
+            else:
+                logger.warning(f'{self._name}: buffer is full, disconnecting subscriber')
+                self.fail(BufferOverflowError(f'{self._name}: subscriber is too slow'))
+                return
+        self._buffer.append(data)
+        self._buffered_bytes += len(data)
+        self._drain()
+
+    def _drain(self):
+        while self._requested > 0 and self._buffer and not self._cancelled:
+            data = self._buffer.popleft()
+            self._buffered_bytes -= len(data)
+            self._requested -= 1
+            self._subscriber.on_next(Payload(data))
+
+
+def get_buffers_metrics() -> List[BufferedBytesMetric]:
+    return [BufferedBytesMetric(subscriber=publisher.name,
+                                buffered_bytes=publisher.buffered_bytes,
+                                buffered_count=publisher.buffered_count)
+            for publisher in BufferedPublisher.active_publishers.values()]
@@ -1,34 +1,113 @@
-from typing import Type
+from typing import Callable, Dict, Iterable, List, Optional, Type, TypeVar
 from uuid import uuid4
 
 from pydantic import BaseModel
-from rsocket.frame_helpers import ensure_bytes
-from rsocket.helpers import utf8_decode
 from rsocket.payload import Payload
 
 from app import schemas
-from app.models import Message, User
+from app.codecs import Codec, JSON_CODEC
+from app.models import Message, User, Room, RoomMessage
+
+T = TypeVar('T', bound=BaseModel)
 
 
 def get_uid():
     return str(uuid4())
 
 
-def message_model_as_schema(message: Message) -> schemas.Message:
-    message_dict = message.__dict__
-    message_dict['from_user'] = message.from_user.__dict__
-    message_dict['to_user'] = message.to_user.__dict__
-    return schemas.Message.model_validate(message_dict)
+def max_id(*ids: Optional[int]) -> Optional[int]:
+    return max((message_id for message_id in ids if message_id is not None), default=None)
+
+
+def escape_like(value: str, escape: str = '\\') -> str:
+    return value.replace(escape, escape * 2).replace('%', escape + '%').replace('_', escape + '_')
+
+
+def schema_constructor(schema_class: Type[T]) -> Callable[[dict], T]:
+    """
+    Precompiled constructor of schema_class instances from trusted values, e.g. database rows.
+    Validation is skipped altogether (model_construct still walks the fields and their defaults),
+    so values must hold every field with a value of its type.
+    """
+    fields_set = set(schema_class.model_fields)
+    new = object.__new__
+    set_attribute = object.__setattr__
+
+    def construct(values: dict) -> T:
+        schema = new(schema_class)
+        set_attribute(schema, '__dict__', values)
+        set_attribute(schema, '__pydantic_fields_set__', fields_set.copy())
+        set_attribute(schema, '__pydantic_extra__', None)
+        set_attribute(schema, '__pydantic_private__', None)
+        return schema
+
+    return construct
+
+
+construct_user = schema_constructor(schemas.User)
+construct_message = schema_constructor(schemas.Message)
+construct_lean_message = schema_constructor(schemas.LeanMessage)
+construct_room = schema_constructor(schemas.Room)
+construct_room_message = schema_constructor(schemas.RoomMessage)
 
 
 def user_model_as_schema(user: User) -> schemas.User:
-    return schemas.User.model_validate(user.__dict__)
+    return construct_user({'id': user.id, 'username': user.username})
+
+
+def message_model_as_schema(message: Message, users: Optional[Dict[int, schemas.User]] = None) -> schemas.Message:
+    """Users are taken from users if given, otherwise loaded through the relationships of the message."""
+    if users is None:
+        from_user, to_user = user_model_as_schema(message.from_user), user_model_as_schema(message.to_user)
+    else:
+        from_user, to_user = users[message.from_user_id], users[message.to_user_id]
+    return construct_message({'id': message.id, 'message_text': message.message_text,
+                              'from_user_id': message.from_user_id, 'to_user_id': message.to_user_id,
+                              'from_user': from_user, 'to_user': to_user,
+                              'load_timestamp': message.load_timestamp})
+
+
+def lean_message_rows_as_schemas(rows: Iterable[tuple]) -> List[schemas.LeanMessage]:
+    """Lean messages from (id, message_text, from_user_id, to_user_id, load_timestamp) rows."""
+    return [construct_lean_message({'id': message_id, 'message_text': message_text, 'from_user_id': from_user_id,
+                                    'to_user_id': to_user_id, 'load_timestamp': load_timestamp})
+            for message_id, message_text, from_user_id, to_user_id, load_timestamp in rows]
+
+
+def message_rows_as_schemas(rows: Iterable[tuple]) -> List[schemas.Message]:
+    """
+    Messages from (id, message_text, from_user_id, to_user_id, load_timestamp, from_username,
+    to_username) rows. Each user is built once and shared by all messages of the rows.
+    """
+    users: Dict[int, schemas.User] = {}
+    messages = []
+    for message_id, message_text, from_user_id, to_user_id, load_timestamp, from_username, to_username in rows:
+        from_user = users.get(from_user_id)
+        if from_user is None:
+            from_user = users[from_user_id] = construct_user({'id': from_user_id, 'username': from_username})
+        to_user = users.get(to_user_id)
+        if to_user is None:
+            to_user = users[to_user_id] = construct_user({'id': to_user_id, 'username': to_username})
+        messages.append(construct_message({'id': message_id, 'message_text': message_text,
+                                           'from_user_id': from_user_id, 'to_user_id': to_user_id,
+                                           'from_user': from_user, 'to_user': to_user,
+                                           'load_timestamp': load_timestamp}))
+    return messages
+
+
+def room_model_as_schema(room: Room) -> schemas.Room:
+    return construct_room({'id': room.id, 'name': room.name, 'owner_id': room.owner_id})
+
+
+def room_message_model_as_schema(message: RoomMessage) -> schemas.RoomMessage:
+    return construct_room_message({'id': message.id, 'room_id': message.room_id,
+                                   'from_user_id': message.from_user_id, 'message_text': message.message_text,
+                                   'load_timestamp': message.load_timestamp})
 
 
-def payload_to_schema(payload: Payload, schema_class: Type[BaseModel]) -> BaseModel:
-    raw_request: dict = utf8_decode(payload.data)
-    return schema_class.model_validate_json(raw_request)
+def payload_to_schema(payload: Payload, schema_class: Type[BaseModel], codec: Codec = JSON_CODEC) -> BaseModel:
+    return codec.decode(payload.data, schema_class)
 
 
-def schema_to_bytes(schema: BaseModel) -> bytes:
-    return ensure_bytes(schema.model_dump_json())
+def schema_to_bytes(schema: BaseModel, codec: Codec = JSON_CODEC) -> bytes:
+    return codec.encode(schema)
@@ -0,0 +1,61 @@
+"""
+Username search latency: the old ILIKE '%part%' scan against the trigram-indexed find_by_username_part.
+
+    python -m benchmarks.find_users [users_count]
+"""
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+from app.cruds import UserAccountCRUD
+from app.database import create_session
+from app.models import User
+
+
+def random_username(rnd: random.Random) -> str:
+    return ''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(6, 14)))
+
+
+def fill_users(session, users_count: int):
+    rnd = random.Random(1875)
+    usernames = set()
+    while len(usernames) < users_count:
+        usernames.add(random_username(rnd))
+    with session() as s:
+        connection = s.connection().connection.dbapi_connection
+        connection.executemany('INSERT INTO user_account (username) VALUES (?)', ((name,) for name in usernames))
+        connection.commit()
+
+
+def measure(func, repeat: int = 20) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    users_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    db_name = os.path.join(tempfile.mkdtemp(), 'bench_find_users.db')
+    session = create_session(db_name)
+    started = time.perf_counter()
+    fill_users(session, users_count)
+    print(f'inserted {users_count} users in {time.perf_counter() - started:.1f} s')
+
+    crud = UserAccountCRUD(session)
+
+    def ilike_scan(part: str, limit: int = 10):
+        with session() as s:
+            return s.query(User).filter(User.username.ilike(f'%{part}%')).limit(limit).all()
+
+    print(f'{"query":>10} | {"ILIKE scan, ms":>15} | {"indexed, ms":>12}')
+    for part in ('a', 'qu', 'xyz', 'qzj', 'abcd', 'zzzzz'):
+        print(f'{part:>10} | {measure(lambda: ilike_scan(part)):>15.2f} | '
+              f'{measure(lambda: crud.find_by_username_part(part, 10)):>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
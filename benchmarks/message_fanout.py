@@ -0,0 +1,58 @@
+"""
+CPU cost of delivering one message to many messages.incoming subscribers:
+encoding per subscriber (previous behaviour) against one shared encoded buffer.
+
+    python -m benchmarks.message_fanout [subscribers_count] [messages_count]
+"""
+import sys
+import time
+
+from reactivestreams.subscriber import DefaultSubscriber
+
+from app.codecs import EncodedSchema, JSON_CODEC
+from app.schemas import Message, User
+from app.services import MessageHub
+from app.streams import BufferedPublisher
+from app.utils import schema_to_bytes
+
+
+class NullSubscriber(DefaultSubscriber):
+
+    def on_next(self, value, is_complete=False):
+        pass
+
+
+def make_subscribers(hub: MessageHub, subscribers_count: int, encode_per_subscriber: bool):
+    for i in range(subscribers_count):
+        publisher = BufferedPublisher(f'bench:{encode_per_subscriber}:{i}')
+        publisher.subscribe(NullSubscriber())
+        publisher.request(2 ** 31 - 1)
+        if encode_per_subscriber:
+            hub.subscribe(1, lambda message, _, emit=publisher.emit: emit(schema_to_bytes(message)))
+        else:
+            hub.subscribe(1, lambda _, encoded, emit=publisher.emit: emit(encoded.encode(JSON_CODEC)))
+
+
+def measure(subscribers_count: int, messages_count: int, encode_per_subscriber: bool) -> float:
+    hub = MessageHub()
+    make_subscribers(hub, subscribers_count, encode_per_subscriber)
+    message = Message(id=1, message_text='hello ' * 20, from_user_id=2, to_user_id=1,
+                      from_user=User(id=2, username='sender'), to_user=User(id=1, username='receiver'))
+    started = time.process_time()
+    for _ in range(messages_count):
+        hub.publish(message, EncodedSchema(message))
+    return (time.process_time() - started) / messages_count * 1000
+
+
+def main():
+    subscribers_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    messages_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    per_subscriber = measure(subscribers_count, messages_count, encode_per_subscriber=True)
+    shared = measure(subscribers_count, messages_count, encode_per_subscriber=False)
+    print(f'fan-out to {subscribers_count} subscribers, CPU ms per message:')
+    print(f'  encode per subscriber: {per_subscriber:.3f}')
+    print(f'  shared encoded buffer: {shared:.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Per-row cost of reading a dialog page: ORM entities with joined users converted through their
+__dict__ and full validation (previous behaviour) against column-only rows and the precompiled
+row mapper of MessageCRUD.get_user_dialog, with users joined into every message or lean messages
+only. Also prints the encoded size of the page in its full and lean (users map) forms.
+
+    python -m benchmarks.message_rows [messages_count] [page_size]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy.orm import joinedload
+
+from app import schemas
+from app.codecs import JSON_CODEC
+from app.cruds import MessageCRUD, UserAccountCRUD, keyset_page
+from app.database import create_session
+from app.models import Message
+
+
+def previous_message_model_as_schema(message: Message) -> schemas.Message:
+    message_dict = message.__dict__
+    message_dict['from_user'] = message.from_user.__dict__
+    message_dict['to_user'] = message.to_user.__dict__
+    return schemas.Message.model_validate(message_dict)
+
+
+def previous_get_user_dialog(session, user_id: int, with_user_id: int, limit: int):
+    with session() as s:
+        query = s.query(Message).options(joinedload(Message.from_user), joinedload(Message.to_user)).\
+            filter((Message.from_user_id == user_id) & (Message.to_user_id == with_user_id) |
+                   (Message.to_user_id == user_id) & (Message.from_user_id == with_user_id))
+        return [previous_message_model_as_schema(message) for message in keyset_page(query, Message.id, limit=limit)]
+
+
+def measure(read_page, rounds: int, page_size: int) -> float:
+    read_page()
+    started = time.perf_counter()
+    for _ in range(rounds):
+        read_page()
+    return (time.perf_counter() - started) / rounds / page_size * 1e6
+
+
+def main():
+    messages_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    rounds = 20
+    with tempfile.TemporaryDirectory() as directory:
+        session = create_session(os.path.join(directory, 'bench.db'))
+        user_account_crud = UserAccountCRUD(session)
+        message_crud = MessageCRUD(session)
+        first = user_account_crud.create('first')
+        second = user_account_crud.create('second')
+        message_crud.create_many([(f'message {i} ' * 5, *((first.id, second.id) if i % 2 else (second.id, first.id)))
+                                  for i in range(messages_count)])
+        previous = measure(lambda: previous_get_user_dialog(session, first.id, second.id, page_size),
+                           rounds, page_size)
+        current = measure(lambda: message_crud.get_user_dialog(first.id, second.id, limit=page_size),
+                          rounds, page_size)
+        lean = measure(lambda: message_crud.get_user_dialog(first.id, second.id, limit=page_size, with_users=False),
+                       rounds, page_size)
+        full_page = schemas.GetDialogMessagesResponse(
+            messages=message_crud.get_user_dialog(first.id, second.id, limit=page_size))
+        lean_page = schemas.GetDialogMessagesResponse(
+            messages=message_crud.get_user_dialog(first.id, second.id, limit=page_size, with_users=False),
+            users={first.id: first, second.id: second})
+    print(f'dialog page of {page_size} messages, us per row:')
+    print(f'  ORM entities + validation: {previous:.2f}')
+    print(f'  column rows + row mapper:  {current:.2f}')
+    print(f'  lean rows (no user joins): {lean:.2f}')
+    print(f'encoded page: {len(JSON_CODEC.encode(full_page))} bytes with users in every message, '
+          f'{len(JSON_CODEC.encode(lean_page))} bytes lean')
+
+
+if __name__ == '__main__':
+    main()
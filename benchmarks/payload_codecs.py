@@ -0,0 +1,48 @@
+"""
+Encoded size and encode/decode CPU time of the payload codecs for a single Message and a
+GetDialogMessagesResponse page.
+
+    python -m benchmarks.payload_codecs [page_size] [iterations]
+"""
+import datetime
+import sys
+import time
+
+from pydantic import BaseModel
+
+from app.codecs import CODECS, Codec
+from app.schemas import Message, User, GetDialogMessagesResponse
+
+
+def make_message(message_id: int) -> Message:
+    return Message(id=message_id, message_text='hello ' * 10, from_user_id=2, to_user_id=1,
+                   from_user=User(id=2, username='sender'), to_user=User(id=1, username='receiver'),
+                   load_timestamp=datetime.datetime(2023, 1, 1, 12, 0, message_id % 60))
+
+
+def measure(codec: Codec, schema: BaseModel, iterations: int):
+    data = codec.encode(schema)
+    started = time.process_time()
+    for _ in range(iterations):
+        codec.encode(schema)
+    encode_us = (time.process_time() - started) / iterations * 1e6
+    started = time.process_time()
+    for _ in range(iterations):
+        codec.decode(data, type(schema))
+    decode_us = (time.process_time() - started) / iterations * 1e6
+    return len(data), encode_us, decode_us
+
+
+def main():
+    page_size = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    page = GetDialogMessagesResponse(messages=[make_message(i) for i in range(page_size)], has_more=True)
+    for name, schema in (('Message', make_message(1)), (f'GetDialogMessagesResponse({page_size})', page)):
+        print(f'{name}:')
+        for mime_type, codec in CODECS.items():
+            size, encode_us, decode_us = measure(codec, schema, iterations)
+            print(f'  {mime_type:24} {size:7} bytes  encode {encode_us:8.1f} us  decode {decode_us:8.1f} us')
+
+
+if __name__ == '__main__':
+    main()
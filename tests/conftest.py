@@ -1,12 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import List
 
 import pytest
 
-from app.cruds import UserAccountCRUD, MessageCRUD
+from app.cruds import UserAccountCRUD, MessageCRUD, AsyncUserAccountCRUD, AsyncMessageCRUD, RoomCRUD, AsyncRoomCRUD
 from app.database import create_session
 from app.models import User
-from app.services import AuthService, ChatService
+from app.sessions import ShardedSessionStore
+from app.services import AuthService, ChatService, MessageHub, RoomService, RoomMembershipIndex
 
 
 @pytest.fixture(scope='module')
@@ -26,13 +28,45 @@ def message_crud(session):
 
 
 @pytest.fixture(scope='module')
-def auth_service(user_account_crud):
-    return AuthService(user_account_crud=user_account_crud)
+def db_executor():
+    executor = ThreadPoolExecutor(max_workers=2)
+    yield executor
+    executor.shutdown()
 
 
 @pytest.fixture(scope='module')
-def chat_service(user_account_crud, message_crud):
-    return ChatService(user_account_crud=user_account_crud, message_crud=message_crud)
+def async_user_account_crud(user_account_crud, db_executor):
+    return AsyncUserAccountCRUD(user_account_crud, db_executor)
+
+
+@pytest.fixture(scope='module')
+def async_message_crud(message_crud, db_executor):
+    return AsyncMessageCRUD(message_crud, db_executor)
+
+
+@pytest.fixture(scope='module')
+def room_crud(session):
+    return RoomCRUD(session=session)
+
+
+@pytest.fixture(scope='module')
+def async_room_crud(room_crud, db_executor):
+    return AsyncRoomCRUD(room_crud, db_executor)
+
+
+@pytest.fixture(scope='module')
+def auth_service(async_user_account_crud):
+    return AuthService(user_account_crud=async_user_account_crud, session_store=ShardedSessionStore())
+
+
+@pytest.fixture(scope='module')
+def chat_service(async_user_account_crud, async_message_crud):
+    return ChatService(user_account_crud=async_user_account_crud, message_crud=async_message_crud)
+
+
+@pytest.fixture
+def room_service(async_room_crud):
+    return RoomService(async_room_crud, RoomMembershipIndex(async_room_crud))
 
 
 un1 = f"first_{datetime.now()}"
@@ -71,3 +105,8 @@ def user3(user_account_crud):
 def users(user_account_crud):
     users_list = [user_account_crud.create(f"user_{datetime.now()}_{i}") for i in range(10)]
     return users_list
+
+
+@pytest.fixture
+def message_hub():
+    return MessageHub()
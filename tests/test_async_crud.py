@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+from app.cruds import UserAccountCRUD, AsyncUserAccountCRUD, MessageCRUD, AsyncMessageCRUD, CachedUserAccountCRUD
+
+
+class SlowUserAccountCRUD(UserAccountCRUD):
+
+    def get_by_id(self, user_id: int):
+        time.sleep(0.5)
+        return super().get_by_id(user_id)
+
+
+def test_slow_query_does_not_block_event_loop(session, db_executor, user1):
+    slow_crud = AsyncUserAccountCRUD(SlowUserAccountCRUD(session), db_executor)
+
+    async def unrelated_stream(ticks: list):
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        ticks = []
+        stream = asyncio.create_task(unrelated_stream(ticks))
+        started = time.monotonic()
+        user = await slow_crud.get_by_id(user1.id)
+        elapsed = time.monotonic() - started
+        stream.cancel()
+        return user, ticks, elapsed
+
+    user, ticks, elapsed = asyncio.run(run())
+    assert user.id == user1.id
+    assert elapsed >= 0.5
+    assert len(ticks) > 10
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.25
+
+
+class CountingMessageCRUD(MessageCRUD):
+
+    def __init__(self, session):
+        super().__init__(session)
+        self.batches = []
+
+    def create_many(self, messages):
+        self.batches.append(len(messages))
+        return super().create_many(messages)
+
+
+def test_concurrent_creates_are_group_committed(session, db_executor, users):
+    user1, user2 = users[0], users[1]
+    counting_crud = CountingMessageCRUD(session)
+    async_message_crud = AsyncMessageCRUD(counting_crud, db_executor, flush_interval_s=0.05, batch_size=3)
+
+    async def run():
+        return await asyncio.gather(*[async_message_crud.create(f'group {i}', user1.id, user2.id) for i in range(5)])
+
+    messages = asyncio.run(run())
+    assert [message.message_text for message in messages] == [f'group {i}' for i in range(5)]
+    assert len({message.id for message in messages}) == 5
+    assert counting_crud.batches == [3, 2]
+
+
+def test_group_commit_fails_only_writers_of_rejected_rows(session, db_executor, users):
+    user1, user2 = users[8], users[9]
+    counting_crud = CountingMessageCRUD(session)
+    async_message_crud = AsyncMessageCRUD(counting_crud, db_executor, flush_interval_s=0.05)
+
+    async def run():
+        return await asyncio.gather(async_message_crud.create('good 1', user1.id, user2.id),
+                                    async_message_crud.create('bad', user1.id, 99999),
+                                    async_message_crud.create('good 2', user2.id, user1.id),
+                                    return_exceptions=True)
+
+    good1, bad, good2 = asyncio.run(run())
+    assert counting_crud.batches == [3]
+    assert isinstance(bad, Exception)
+    assert (good1.message_text, good2.message_text) == ('good 1', 'good 2')
+    assert [message.id for message in counting_crud.get_user_dialog(user1.id, user2.id)] == [good1.id, good2.id]
+
+
+def test_cached_user_account_crud(session, db_executor, users):
+    cached_crud = CachedUserAccountCRUD(UserAccountCRUD(session), db_executor, cache_size=100)
+
+    async def run():
+        created = await cached_crud.create(f'cached_{users[0].username}')
+        assert (await cached_crud.get_by_id(created.id)).username == created.username
+        assert (await cached_crud.get_by_username(created.username)).id == created.id
+        assert cached_crud.misses == 0
+
+        first = await cached_crud.get_by_id(users[0].id)
+        assert first.id == users[0].id
+        assert cached_crud.misses == 1
+        await cached_crud.get_by_id(users[0].id)
+        assert cached_crud.misses == 1
+
+        found = await cached_crud.get_by_ids([users[1].id, users[0].id, -1, created.id])
+        assert [user.id for user in found] == [users[1].id, users[0].id, created.id]
+
+        usernames_misses = cached_crud.usernames_misses
+        assert (await cached_crud.get_by_username(users[2].username)).id == users[2].id
+        assert cached_crud.usernames_misses == usernames_misses + 1
+        usernames_hits = cached_crud.usernames_hits
+        await cached_crud.get_by_username(users[2].username)
+        assert cached_crud.usernames_hits == usernames_hits + 1
+        assert cached_crud.usernames_misses == usernames_misses + 1
+
+    asyncio.run(run())
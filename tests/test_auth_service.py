@@ -1,26 +1,45 @@
+import asyncio
+
 from app.schemas import RegisterRequest, LoginRequest
+from app.services import AuthMiddleWare, AuthService
+from app.sessions import ShardedSessionStore
 
 
 def test_register(auth_service, user1):
     unique_username = user1.username + '_1'
     request = RegisterRequest(username=unique_username)
-    response = auth_service.register(request)
+    response = asyncio.run(auth_service.register(request))
     assert response.success
     assert response.user.username == unique_username
 
-    response = auth_service.register(user1.username)
+    response = asyncio.run(auth_service.register(RegisterRequest(username=user1.username)))
     assert not response.success
     assert response.error
 
 
 def test_auth(auth_service, user1):
     request = LoginRequest(username=user1.username)
-    response = auth_service.auth(request)
+    response = asyncio.run(auth_service.auth(request))
     assert response.success
     assert response.user.id == user1.id
 
     does_not_existing_username = user1.username + str(hash(123))
     request = LoginRequest(username=does_not_existing_username)
-    response = auth_service.auth(request)
+    response = asyncio.run(auth_service.auth(request))
     assert not response.success
     assert response.error
+
+
+def test_authenticate_and_logout(async_user_account_crud, user1):
+    session_store = ShardedSessionStore()
+    auth_service = AuthService(user_account_crud=async_user_account_crud, session_store=session_store)
+    auth_middleware = AuthMiddleWare(session_store)
+    session = asyncio.run(auth_service.auth(LoginRequest(username=user1.username))).session
+    assert auth_middleware.authenticate(session).id == user1.id
+    assert auth_middleware.authenticate(None) is None
+    assert auth_middleware.authenticate(session + '_') is None
+
+    assert auth_service.logout(session).success
+    assert auth_middleware.authenticate(session) is None
+    assert not auth_service.logout(session).success
+    assert not auth_service.logout(None).success
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import socket
+import tempfile
+
+from app.bus import BusBroker, WorkerBus, read_frame
+
+
+def test_events_are_relayed_to_other_workers():
+    async def scenario(bus_path: str):
+        bus_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        bus_socket.bind(bus_path)
+        bus_socket.listen()
+        broker_task = asyncio.create_task(BusBroker(bus_socket).run())
+        workers = [WorkerBus() for _ in range(3)]
+        received = [[] for _ in workers]
+        for worker, worker_received in zip(workers, received):
+            worker.subscribe('message', worker_received.append)
+            await worker.connect(bus_path)
+        await asyncio.sleep(0.05)
+
+        await workers[0].publish('message', b'first')
+        await workers[0].publish('other', b'ignored')
+        await workers[1].publish('message', b'second')
+        await asyncio.sleep(0.05)
+
+        for worker in workers:
+            await worker.close()
+        broker_task.cancel()
+        return received
+
+    with tempfile.TemporaryDirectory() as bus_dir:
+        received = asyncio.run(scenario(os.path.join(bus_dir, 'bus.sock')))
+    assert received == [[b'second'], [b'first'], [b'first', b'second']]
+
+
+def test_stalled_worker_bounds_broker_buffer():
+    max_buffered_bytes = 64 * 1024
+    data = b'x' * 16 * 1024
+
+    async def scenario(bus_path: str):
+        bus_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        bus_socket.bind(bus_path)
+        bus_socket.listen()
+        broker = BusBroker(bus_socket, max_buffered_bytes)
+        broker_task = asyncio.create_task(broker.run())
+        sender = WorkerBus()
+        await sender.connect(bus_path)
+        stalled_reader, stalled_writer = await asyncio.open_unix_connection(bus_path)
+        await asyncio.sleep(0.05)
+
+        async def publish_all():
+            for _ in range(200):
+                await sender.publish('message', data)
+
+        publishing = asyncio.create_task(publish_all())
+        await asyncio.sleep(0.2)
+        buffered = [writer.transport.get_write_buffer_size() for writer in broker._writers]
+
+        received = 0
+        while received < 200:
+            _, body = await asyncio.wait_for(read_frame(stalled_reader), 5)
+            assert body.endswith(data)
+            received += 1
+        await asyncio.wait_for(publishing, 5)
+
+        await sender.close()
+        stalled_writer.close()
+        broker_task.cancel()
+        return buffered
+
+    with tempfile.TemporaryDirectory() as bus_dir:
+        buffered = asyncio.run(scenario(os.path.join(bus_dir, 'bus.sock')))
+    assert max(buffered) <= max_buffered_bytes + len(data) + 64
+
+
+def test_stalled_broker_bounds_worker_buffer():
+    max_buffered_bytes = 64 * 1024
+    data = b'x' * 16 * 1024
+
+    async def scenario(bus_path: str):
+        bus_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        bus_socket.bind(bus_path)
+        bus_socket.listen()
+        accepted = asyncio.Queue()
+        stalled_broker = await asyncio.start_unix_server(lambda *connection: accepted.put_nowait(connection),
+                                                         sock=bus_socket)
+        sender = WorkerBus(max_buffered_bytes)
+        await sender.connect(bus_path)
+        stalled_reader, _ = await accepted.get()
+
+        async def publish_all():
+            for _ in range(200):
+                await sender.publish('message', data)
+
+        publishing = asyncio.create_task(publish_all())
+        await asyncio.sleep(0.2)
+        buffered = sender._writer.transport.get_write_buffer_size()
+        assert not publishing.done()
+
+        received = 0
+        while received < 200:
+            _, body = await asyncio.wait_for(read_frame(stalled_reader), 5)
+            assert body.endswith(data)
+            received += 1
+        await asyncio.wait_for(publishing, 5)
+
+        await sender.close()
+        stalled_broker.close()
+        return buffered
+
+    with tempfile.TemporaryDirectory() as bus_dir:
+        buffered = asyncio.run(scenario(os.path.join(bus_dir, 'bus.sock')))
+    assert buffered <= max_buffered_bytes + len(data) + 64
+
+
+def test_publish_without_broker_does_nothing():
+    asyncio.run(WorkerBus().publish('message', b'data'))
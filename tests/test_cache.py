@@ -0,0 +1,24 @@
+import time
+
+from app.cache import LRUCache
+
+
+def test_lru_eviction():
+    cache = LRUCache(max_size=2)
+    cache.put(1, 'a')
+    cache.put(2, 'b')
+    assert cache.get(1) == 'a'
+    cache.put(3, 'c')
+    assert cache.get(2) is None
+    assert cache.get(1) == 'a'
+    assert cache.get(3) == 'c'
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_ttl_expiry():
+    cache = LRUCache(ttl_s=0.05)
+    cache.put(1, 'a')
+    assert cache.get(1) == 'a'
+    time.sleep(0.1)
+    assert cache.get(1) is None
+    assert len(cache) == 0
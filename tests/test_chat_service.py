@@ -1,27 +1,25 @@
-from app.schemas import GetDialogsRequest, SendMessageRequest, GetDialogMessagesRequest
+import asyncio
+
+from app.schemas import GetDialogsRequest, SendMessageRequest, GetDialogMessagesRequest, LeanMessage, Message
 
 
 def test_get_dialog(chat_service, users):
     user1 = users[-1]
     user2 = users[-2]
     user3 = users[-3]
-    get_dialogs_request = GetDialogsRequest(user_id=user1.id)
-    dialogs = chat_service.get_dialogs(get_dialogs_request).dialogs
+    get_dialogs_request = GetDialogsRequest()
+    dialogs = asyncio.run(chat_service.get_dialogs(user1.id, get_dialogs_request)).dialogs
     assert not dialogs
-    request = SendMessageRequest(message_text='test',
-                                 from_user_id=user1.id,
-                                 to_user_id=user2.id)
-    chat_service.send_message(request)
-    dialogs = chat_service.get_dialogs(get_dialogs_request).dialogs
+    request = SendMessageRequest(message_text='test', to_user_id=user2.id)
+    asyncio.run(chat_service.send_message(user1.id, request))
+    dialogs = asyncio.run(chat_service.get_dialogs(user1.id, get_dialogs_request)).dialogs
     assert len(dialogs) == 1
     assert dialogs[0].user.id == user1.id
     assert dialogs[0].with_user.id == user2.id
-    request = SendMessageRequest(message_text='test',
-                                 from_user_id=user3.id,
-                                 to_user_id=user1.id)
-    chat_service.send_message(request)
+    request = SendMessageRequest(message_text='test', to_user_id=user1.id)
+    asyncio.run(chat_service.send_message(user3.id, request))
 
-    dialogs = chat_service.get_dialogs(get_dialogs_request).dialogs
+    dialogs = asyncio.run(chat_service.get_dialogs(user1.id, get_dialogs_request)).dialogs
     assert len(dialogs) == 2
     for dialog in dialogs:
         assert dialog.user.id == user1.id
@@ -30,27 +28,70 @@ def test_get_dialog(chat_service, users):
 def test_get_dialog_messages(chat_service, users):
     user1 = users[-1]
     user2 = users[-2]
-    get_dialog_messages_request = GetDialogMessagesRequest(user_id=user1.id,
-                                                           with_user_id=user2.id)
-    messages = chat_service.get_dialog_messages(get_dialog_messages_request).messages
+    get_dialog_messages_request = GetDialogMessagesRequest(with_user_id=user2.id)
+    messages = asyncio.run(chat_service.get_dialog_messages(user1.id, get_dialog_messages_request)).messages
     assert not messages
     sent_messages = [
 
-        chat_service.send_message(SendMessageRequest(message_text='test 1',
-                                                     from_user_id=user1.id,
-                                                     to_user_id=user2.id)),
-        chat_service.send_message(SendMessageRequest(message_text='test 2',
-                                                     from_user_id=user2.id,
-                                                     to_user_id=user1.id)),
-        chat_service.send_message(SendMessageRequest(message_text='test 3',
-                                                     from_user_id=user1.id,
-                                                     to_user_id=user2.id)),
-        chat_service.send_message(SendMessageRequest(message_text='test 4',
-                                                     from_user_id=user2.id,
-                                                     to_user_id=user1.id)),
-        chat_service.send_message(SendMessageRequest(message_text='test 5',
-                                                     from_user_id=user1.id,
-                                                     to_user_id=user2.id)),
+        asyncio.run(chat_service.send_message(user1.id, SendMessageRequest(message_text='test 1',
+                                                                           to_user_id=user2.id))),
+        asyncio.run(chat_service.send_message(user2.id, SendMessageRequest(message_text='test 2',
+                                                                           to_user_id=user1.id))),
+        asyncio.run(chat_service.send_message(user1.id, SendMessageRequest(message_text='test 3',
+                                                                           to_user_id=user2.id))),
+        asyncio.run(chat_service.send_message(user2.id, SendMessageRequest(message_text='test 4',
+                                                                           to_user_id=user1.id))),
+        asyncio.run(chat_service.send_message(user1.id, SendMessageRequest(message_text='test 5',
+                                                                           to_user_id=user2.id))),
     ]
-    messages = chat_service.get_dialog_messages(get_dialog_messages_request).messages
+    messages = asyncio.run(chat_service.get_dialog_messages(user1.id, get_dialog_messages_request)).messages
     assert len(messages) == len(sent_messages)
+
+
+def test_get_dialog_messages_pages(chat_service, users):
+    user1 = users[0]
+    user2 = users[1]
+    sent = [asyncio.run(chat_service.send_message(user1.id, SendMessageRequest(message_text=f'page {i}',
+                                                                               to_user_id=user2.id))).message
+            for i in range(5)]
+    request = GetDialogMessagesRequest(with_user_id=user2.id, limit=3)
+    page = asyncio.run(chat_service.get_dialog_messages(user1.id, request))
+    assert [message.id for message in page.messages] == [message.id for message in sent[-3:]]
+    assert page.has_more
+
+    request = GetDialogMessagesRequest(with_user_id=user2.id, limit=3,
+                                       before_id=page.messages[0].id)
+    page = asyncio.run(chat_service.get_dialog_messages(user1.id, request))
+    assert [message.id for message in page.messages] == [message.id for message in sent[:2]]
+    assert not page.has_more
+
+
+def test_get_dialog_messages_side_loads_users(chat_service, users):
+    user1 = users[2]
+    user2 = users[3]
+    for i in range(3):
+        asyncio.run(chat_service.send_message(user1.id, SendMessageRequest(message_text=f'lean {i}',
+                                                                           to_user_id=user2.id)))
+    request = GetDialogMessagesRequest(with_user_id=user1.id)
+    page = asyncio.run(chat_service.get_dialog_messages(user2.id, request))
+    assert all(type(message) is LeanMessage for message in page.messages)
+    assert page.users == {user1.id: user1, user2.id: user2}
+
+    request = GetDialogMessagesRequest(with_user_id=user1.id, with_users=True)
+    page = asyncio.run(chat_service.get_dialog_messages(user2.id, request))
+    assert all(type(message) is Message for message in page.messages)
+    assert page.messages[0].from_user == user1
+    assert not page.users
+
+
+def test_get_dialog_messages_of_requesting_user(chat_service, users):
+    user1 = users[4]
+    user2 = users[5]
+    user3 = users[6]
+    asyncio.run(chat_service.send_message(user1.id, SendMessageRequest(message_text='private',
+                                                                       to_user_id=user2.id)))
+    request = GetDialogMessagesRequest.model_validate({'user_id': user1.id, 'with_user_id': user2.id})
+    assert len(asyncio.run(chat_service.get_dialog_messages(user1.id, request)).messages) == 1
+    page = asyncio.run(chat_service.get_dialog_messages(user3.id, request))
+    assert not page.messages
+    assert not page.users
@@ -0,0 +1,53 @@
+import datetime
+
+import pytest
+
+from app.codecs import CODECS, JSON_CODEC, EncodedSchema, get_codec
+from app.schemas import Message, User, GetDialogMessagesResponse, BatchResponse, GetUserByIdResponse, BaseResponse
+
+
+def make_message(message_id: int) -> Message:
+    return Message(id=message_id, message_text=f'test {message_id}', from_user_id=2, to_user_id=1,
+                   from_user=User(id=2, username='2'), to_user=User(id=1, username='1'),
+                   load_timestamp=datetime.datetime(2023, 1, 1, 12, 30))
+
+
+@pytest.mark.parametrize('mime_type', sorted(CODECS))
+def test_round_trip(mime_type):
+    codec = get_codec(mime_type.encode())
+    response = GetDialogMessagesResponse(messages=[make_message(1), make_message(2)], has_more=True)
+
+    assert codec.decode(codec.encode(response), GetDialogMessagesResponse) == response
+    assert codec.loads(codec.encode(response))['messages'][1]['id'] == 2
+
+
+def test_get_codec():
+    assert get_codec(None) is JSON_CODEC
+    assert get_codec(bytearray(b'application/json')) is JSON_CODEC
+    assert get_codec('text/plain') is None
+
+
+def test_encoded_schema_encodes_once_per_codec():
+    encoded = EncodedSchema(make_message(1))
+
+    assert encoded.encode(JSON_CODEC) is encoded.encode(JSON_CODEC)
+    for codec in CODECS.values():
+        assert codec.decode(encoded.encode(codec), Message) == encoded.schema
+
+
+def test_encoded_schema_keeps_given_encoding():
+    message = make_message(1)
+    data = JSON_CODEC.encode(message)
+
+    assert EncodedSchema(message, JSON_CODEC, data).encode(JSON_CODEC) is data
+
+
+@pytest.mark.parametrize('mime_type', sorted(CODECS))
+def test_batch_response_keeps_result_fields(mime_type):
+    codec = get_codec(mime_type)
+    response = BatchResponse(results=[GetUserByIdResponse(user=User(id=1, username='1')),
+                                      BaseResponse(success=False, error='unknown route')])
+
+    results = codec.loads(codec.encode(response))['results']
+    assert GetUserByIdResponse.model_validate(results[0]).user.id == 1
+    assert results[1] == {'success': False, 'error': 'unknown route'}
@@ -0,0 +1,77 @@
+from sqlalchemy import create_engine, text
+
+from app.database import migrate_database
+from app.models import Base
+
+BASELINE_SCHEMA = [
+    'CREATE TABLE user_account (id INTEGER NOT NULL, username VARCHAR(64) NOT NULL, '
+    'load_timestamp DATETIME DEFAULT (CURRENT_TIMESTAMP) NOT NULL, PRIMARY KEY (id))',
+    'CREATE TABLE message (id INTEGER NOT NULL, message_text VARCHAR NOT NULL, from_user_id INTEGER NOT NULL, '
+    'to_user_id INTEGER NOT NULL, load_timestamp DATETIME DEFAULT (CURRENT_TIMESTAMP) NOT NULL, PRIMARY KEY (id), '
+    'FOREIGN KEY(from_user_id) REFERENCES user_account (id), FOREIGN KEY(to_user_id) REFERENCES user_account (id))',
+]
+
+
+def create_engine_with(tmp_path, statements: list):
+    engine = create_engine(f"sqlite:///{tmp_path / 'chat.db'}")
+    with engine.begin() as connection:
+        for statement in statements:
+            connection.execute(text(statement))
+    return engine
+
+
+def upgrade(engine):
+    Base.metadata.create_all(engine)
+    migrate_database(engine)
+
+
+def test_baseline_database_is_migrated(tmp_path):
+    engine = create_engine_with(tmp_path, BASELINE_SCHEMA + [
+        "INSERT INTO user_account (id, username) VALUES (1, 'alice'), (2, 'bob'), (3, 'carol')",
+        "INSERT INTO message (id, message_text, from_user_id, to_user_id, load_timestamp) VALUES "
+        "(1, 'hello bob', 1, 2, '2023-01-01 10:00:00'), (2, 'hello alice', 2, 1, '2023-01-01 10:01:00'), "
+        "(3, 'hello carol', 1, 3, '2023-01-01 10:02:00')",
+    ])
+    upgrade(engine)
+    upgrade(engine)
+
+    with engine.connect() as connection:
+        indexes = set(connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+        dialog_columns = {row[1] for row in connection.execute(text('PRAGMA table_info(dialog)'))}
+        dialogs = connection.execute(text(
+            'SELECT user_id, peer_id, last_message_id, unread_count FROM dialog ORDER BY user_id, peer_id')).all()
+        found_users = connection.execute(text(
+            "SELECT rowid FROM user_account_fts WHERE user_account_fts MATCH '\"car\"'")).scalars().all()
+        found_messages = connection.execute(text(
+            "SELECT rowid FROM message_fts WHERE message_fts MATCH 'hello' ORDER BY rowid")).scalars().all()
+        connection.execute(text("INSERT INTO message (id, message_text, from_user_id, to_user_id) "
+                                "VALUES (4, 'written after migration', 3, 1)"))
+        found_new_messages = connection.execute(text(
+            "SELECT rowid FROM message_fts WHERE message_fts MATCH 'migration'")).scalars().all()
+    engine.dispose()
+
+    assert {'ix_user_account_username', 'ix_user_account_username_lower', 'ix_message_to_user_id_id',
+            'ix_dialog_user_id_last_message_id'} <= indexes
+    assert {'delivered_message_id', 'read_message_id'} <= dialog_columns
+    assert dialogs == [(1, 2, 2, 0), (1, 3, 3, 0), (2, 1, 2, 0), (3, 1, 3, 0)]
+    assert found_users == [3]
+    assert found_messages == [1, 2, 3]
+    assert found_new_messages == [4]
+
+
+def test_missing_columns_are_added(tmp_path):
+    engine = create_engine_with(tmp_path, BASELINE_SCHEMA + [
+        'CREATE TABLE dialog (user_id INTEGER NOT NULL, peer_id INTEGER NOT NULL, last_message_id INTEGER NOT NULL, '
+        'last_timestamp DATETIME, unread_count INTEGER NOT NULL, PRIMARY KEY (user_id, peer_id))',
+        "INSERT INTO user_account (id, username) VALUES (1, 'alice'), (2, 'bob')",
+        "INSERT INTO message (id, message_text, from_user_id, to_user_id) VALUES (1, 'hello', 1, 2)",
+        'INSERT INTO dialog (user_id, peer_id, last_message_id, unread_count) VALUES (2, 1, 1, 1)',
+    ])
+    upgrade(engine)
+
+    with engine.connect() as connection:
+        dialogs = connection.execute(text(
+            'SELECT user_id, peer_id, unread_count, delivered_message_id, read_message_id FROM dialog')).all()
+    engine.dispose()
+
+    assert dialogs == [(2, 1, 1, None, None)]
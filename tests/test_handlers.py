@@ -0,0 +1,375 @@
+import asyncio
+import json
+
+import pytest
+from reactivestreams.subscriber import DefaultSubscriber
+from rsocket.error_codes import ErrorCode
+from rsocket.extensions.helpers import composite, route
+from rsocket.extensions.mimetypes import WellKnownMimeTypes
+from rsocket.helpers import single_transport_provider
+from rsocket.payload import Payload
+from rsocket.request_handler import BaseRequestHandler
+from rsocket.rsocket_client import RSocketClient
+from rsocket.rsocket_server import RSocketServer
+from rsocket.transports.tcp import TransportTCP
+
+from app.codecs import EncodedSchema
+from app.schemas import SetupRequest, GetUserByIdRequest, SendMessageRequest, GetUnreadRequest, Message, \
+    BatchRequest, BatchItem
+from app.services import MessageHub
+from app.utils import schema_to_bytes, user_model_as_schema
+
+COMPOSITE_METADATA = WellKnownMimeTypes.MESSAGE_RSOCKET_COMPOSITE_METADATA.value.name
+
+
+@pytest.fixture(scope='module')
+def handlers(session):
+    """app.handlers, imported once the test database is set up, so that its services share it."""
+    import app.handlers
+    return app.handlers
+
+
+async def connect(handlers, user_session=None):
+    handler = handlers.handler_factory()
+    setup_payload = Payload(schema_to_bytes(SetupRequest(session=user_session))) if user_session else Payload()
+    await handler.on_setup(b'application/json', COMPOSITE_METADATA, setup_payload)
+    return handler
+
+
+async def request_response(handler, route_name: str, data: bytes) -> dict:
+    response = await (await handler.request_response(Payload(data, composite(route(route_name)))))
+    return json.loads(response.data)
+
+
+def test_setup_with_session_authenticates_connection(handlers, users):
+    user = user_model_as_schema(users[0])
+    user_session = handlers.session_store.create(user)
+
+    async def run():
+        handler = await connect(handlers, user_session)
+        assert handler.user == user
+        assert handler.session == user_session
+        response = await request_response(handler, 'get_user_by_id',
+                                          schema_to_bytes(GetUserByIdRequest(user_id=user.id)))
+        assert response['success']
+        assert response['user'] == user.model_dump()
+        await handler.on_close(None)
+        assert handler.user is None
+        assert user_session not in handlers.ChatRequestHandler.authenticated
+
+    asyncio.run(run())
+
+
+def test_setup_with_unknown_session_is_rejected(handlers):
+    async def run():
+        errors = asyncio.Queue()
+
+        class ClientHandler(BaseRequestHandler):
+            async def on_error(self, error_code: ErrorCode, payload: Payload):
+                errors.put_nowait(error_code)
+
+        server = await asyncio.start_server(
+            lambda *connection: RSocketServer(TransportTCP(*connection), handler_factory=handlers.handler_factory),
+            'localhost', 0)
+        async with server:
+            connection = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+            async with RSocketClient(single_transport_provider(TransportTCP(*connection)),
+                                     handler_factory=ClientHandler,
+                                     metadata_encoding=COMPOSITE_METADATA,
+                                     setup_payload=Payload(schema_to_bytes(SetupRequest(session='unknown')))):
+                return await asyncio.wait_for(errors.get(), 5)
+
+    assert asyncio.run(run()) is ErrorCode.REJECTED_SETUP
+
+
+def test_unauthenticated_requests_are_refused_before_decode(handlers):
+    async def run():
+        handler = await connect(handlers)
+        response = await request_response(handler, 'get_user_by_id', b'not a request')
+        assert response == {'success': False, 'error': 'not authenticated'}
+        errors = []
+
+        class ErrorsCollector(DefaultSubscriber):
+            def on_error(self, exception: Exception):
+                errors.append(str(exception))
+
+        stream = await handler.request_stream(Payload(b'not a request', composite(route('messages.incoming'))))
+        stream.subscribe(ErrorsCollector())
+        stream.request(1)
+        assert errors == ['not authenticated']
+
+    asyncio.run(run())
+
+
+def test_send_message_is_sent_by_connection_user(handlers, users):
+    user1, user2, user3 = users[0], users[1], users[2]
+    user_session = handlers.session_store.create(user_model_as_schema(user1))
+
+    async def run():
+        handler = await connect(handlers, user_session)
+        data = json.dumps({**SendMessageRequest(message_text='as myself', to_user_id=user2.id).model_dump(),
+                           'from_user_id': user3.id}).encode()
+        response = await request_response(handler, 'send_message', data)
+        await handler.on_close(None)
+        return response
+
+    response = asyncio.run(run())
+    assert response['success']
+    assert response['message']['from_user_id'] == user1.id
+    assert response['message']['to_user_id'] == user2.id
+
+
+def test_mark_read_through_get_unread_reaches_other_workers(handlers, users, monkeypatch):
+    user1, user2 = user_model_as_schema(users[3]), user_model_as_schema(users[4])
+    published = []
+
+    async def publish_on_bus(topic: str, data: bytes):
+        published.append((topic, data))
+
+    monkeypatch.setattr(handlers.worker_bus, 'publish', publish_on_bus)
+    message = Message(id=1, message_text='unread', from_user_id=user2.id, to_user_id=user1.id,
+                      from_user=user2, to_user=user1)
+    handlers.new_messages_storage.add(message)
+    user_session = handlers.session_store.create(user1)
+
+    async def run():
+        handler = await connect(handlers, user_session)
+        response = await request_response(handler, 'get_unread', schema_to_bytes(GetUnreadRequest(mark_read=True)))
+        await handler.on_close(None)
+        return response
+
+    assert asyncio.run(run())['total'] == 1
+    assert handlers.new_messages_storage.get_new_messages_count(user1.id, user2.id) == 0
+    [data] = [data for topic, data in published if topic == 'mark_read']
+
+    handlers.new_messages_storage.add(message)
+    handlers.on_remote_mark_read(data)
+    assert handlers.new_messages_storage.get_new_messages_count(user1.id, user2.id) == 0
+
+
+def test_session_stays_online_until_its_last_connection_closes(handlers, users):
+    user_session = handlers.session_store.create(user_model_as_schema(users[5]))
+    presence_events = []
+
+    def listener(session: str, user_id: int, online: bool):
+        if session == user_session:
+            presence_events.append(online)
+
+    handlers.presence_tracker.subscribe(listener)
+
+    async def run():
+        first, second = await connect(handlers, user_session), await connect(handlers, user_session)
+        await first.on_close(None)
+        assert user_session in handlers.presence_tracker
+        second.on_keepalive()
+        await second.on_close(None)
+        assert user_session not in handlers.presence_tracker
+
+    try:
+        asyncio.run(run())
+    finally:
+        handlers.presence_tracker.unsubscribe(listener)
+    assert presence_events == [True, False]
+
+
+def test_batch_keeps_order_and_isolates_errors(handlers, users, monkeypatch):
+    user1, user2 = user_model_as_schema(users[0]), user_model_as_schema(users[1])
+    user_session = handlers.session_store.create(user1)
+
+    async def find_users(request):
+        raise RuntimeError('find_users failed')
+
+    monkeypatch.setattr(handlers.chat_service, 'find_users', find_users)
+    request = BatchRequest(requests=[BatchItem(route='get_user_by_id', data={'user_id': user1.id}),
+                                     BatchItem(route='unknown'),
+                                     BatchItem(route='get_user_by_id', data={'user_id': 'not an id'}),
+                                     BatchItem(route='find_users', data={'username_part': 'user'}),
+                                     BatchItem(route='get_user_by_id', data={'user_id': user2.id})])
+
+    async def run():
+        handler = await connect(handlers, user_session)
+        response = await request_response(handler, 'batch', schema_to_bytes(request))
+        await handler.on_close(None)
+        return response
+
+    response = asyncio.run(run())
+    assert response['success']
+    first, unknown, invalid, failed, last = response['results']
+    assert first['user'] == user1.model_dump()
+    assert unknown == {'success': False, 'error': 'unknown route unknown'}
+    assert not invalid['success'] and 'user_id' in invalid['error']
+    assert failed == {'success': False, 'error': 'find_users failed'}
+    assert last['user'] == user2.model_dump()
+
+
+def test_batch_is_limited(handlers, users):
+    user_session = handlers.session_store.create(user_model_as_schema(users[0]))
+    request = BatchRequest(requests=[BatchItem(route='get_rooms')] * (handlers.BATCH_MAX_REQUESTS + 1))
+
+    async def run():
+        handler = await connect(handlers, user_session)
+        response = await request_response(handler, 'batch', schema_to_bytes(request))
+        await handler.on_close(None)
+        return response
+
+    response = asyncio.run(run())
+    assert response == {'success': False, 'error': f'batch is limited to {handlers.BATCH_MAX_REQUESTS} requests',
+                        'results': []}
+
+
+def test_batch_of_unauthenticated_connection_is_refused(handlers):
+    async def run():
+        handler = await connect(handlers)
+        return await request_response(handler, 'batch', b'not a batch')
+
+    assert asyncio.run(run()) == {'success': False, 'error': 'not authenticated'}
+
+
+def test_logout_ends_streams_of_the_session(handlers, users):
+    user1, user2 = user_model_as_schema(users[2]), user_model_as_schema(users[3])
+    user_session = handlers.session_store.create(user1)
+    message = Message(id=1, message_text='after logout', from_user_id=user2.id, to_user_id=user1.id,
+                      from_user=user2, to_user=user1)
+
+    class StreamCollector(DefaultSubscriber):
+        def __init__(self):
+            super().__init__()
+            self.received = []
+            self.errors = []
+
+        def on_next(self, value: Payload, is_complete=False):
+            self.received.append(value.data)
+
+        def on_error(self, exception: Exception):
+            self.errors.append(str(exception))
+
+    async def run():
+        handler = await connect(handlers, user_session)
+        collector = StreamCollector()
+        stream = await handler.request_stream(Payload(b'{}', composite(route('messages.incoming'))))
+        stream.subscribe(collector)
+        stream.request(10)
+        publish(handlers.message_hub, message)
+        assert len(collector.received) == 1
+
+        response = await request_response(handler, 'logout', b'{}')
+        assert response['success']
+        publish(handlers.message_hub, message)
+        await handler.on_close(None)
+        return collector
+
+    collector = asyncio.run(run())
+    assert len(collector.received) == 1
+    assert collector.errors == ['not authenticated']
+    assert handlers.message_hub.get_subscribers_count(user1.id) == 0
+
+
+class MessagesCollector(DefaultSubscriber):
+    def __init__(self, initial_demand: int):
+        super().__init__()
+        self.ids = []
+        self._initial_demand = initial_demand
+
+    def on_subscribe(self, subscription):
+        super().on_subscribe(subscription)
+        subscription.request(self._initial_demand)
+
+    def on_next(self, value: Payload, is_complete=False):
+        self.ids.append(json.loads(value.data)['id'])
+
+
+async def drain(collector: MessagesCollector, count: int, demand: int = 2):
+    while len(collector.ids) < count:
+        await asyncio.sleep(0.01)
+        collector.subscription.request(demand)
+
+
+def publish(hub: MessageHub, message: Message):
+    hub.publish(message, EncodedSchema(message))
+
+
+def test_message_publisher_replays_from_hub_history(handlers, users):
+    sender, receiver = user_model_as_schema(users[6]), user_model_as_schema(users[7])
+    hub = MessageHub(history_size=10)
+
+    def make_message(message_id: int) -> Message:
+        return Message(id=message_id, message_text=f'ring {message_id}', from_user_id=sender.id,
+                       to_user_id=receiver.id, from_user=sender, to_user=receiver)
+
+    for message_id in range(1, 4):
+        publish(hub, make_message(message_id))
+    publisher = handlers.MessagePublisher(hub, None, receiver.id, 'ring replay', since_message_id=1)
+    collector = MessagesCollector(10)
+    publisher.subscribe(collector)
+    publish(hub, make_message(4))
+
+    assert collector.ids == [2, 3, 4]
+
+
+def test_message_publisher_replays_from_database_in_pages(handlers, users, message_crud, async_message_crud):
+    sender, receiver = users[6], users[8]
+    seen = message_crud.create('seen', sender.id, receiver.id)
+    missed = [message_crud.create(f'missed {i}', sender.id, receiver.id) for i in range(7)]
+    queried_pages = []
+
+    class PagesRecorder:
+        async def get_incoming(self, user_id: int, after_id: int, limit: int = None):
+            messages = await async_message_crud.get_incoming(user_id, after_id, limit)
+            queried_pages.append([message.id for message in messages])
+            return messages
+
+    async def run():
+        hub = MessageHub()
+        publisher = handlers.MessagePublisher(hub, PagesRecorder(), receiver.id, 'database replay',
+                                              since_message_id=seen.id, high_water_mark=3)
+        collector = MessagesCollector(2)
+        publisher.subscribe(collector)
+        await asyncio.wait_for(drain(collector, len(missed)), 5)
+        live = message_crud.create('live', sender.id, receiver.id)
+        publish(hub, live)
+        await asyncio.wait_for(drain(collector, len(missed) + 1), 5)
+        publisher.cancel()
+        return collector.ids, live
+
+    ids, live = asyncio.run(run())
+    assert ids == [message.id for message in missed] + [live.id]
+    assert [len(page) for page in queried_pages] == [3, 3, 1]
+
+
+def test_message_publisher_dedups_live_messages_of_last_page(handlers, users, message_crud, async_message_crud):
+    sender, receiver = users[6], users[9]
+    seen = message_crud.create('seen', sender.id, receiver.id)
+    missed = [message_crud.create(f'missed {i}', sender.id, receiver.id) for i in range(4)]
+    hub = MessageHub()
+    live = []
+
+    class RacingMessageCRUD:
+        """Commits and publishes live messages right before and right after the query of the second page."""
+
+        def __init__(self):
+            self.queries = 0
+
+        async def get_incoming(self, user_id: int, after_id: int, limit: int = None):
+            self.queries += 1
+            if self.queries == 2:
+                live.append(message_crud.create('live in page', sender.id, receiver.id))
+                publish(hub, live[-1])
+            messages = await async_message_crud.get_incoming(user_id, after_id, limit)
+            if self.queries == 2:
+                live.append(message_crud.create('live after page', sender.id, receiver.id))
+                publish(hub, live[-1])
+            return messages
+
+    async def run():
+        publisher = handlers.MessagePublisher(hub, RacingMessageCRUD(), receiver.id, 'racing replay',
+                                              since_message_id=seen.id, high_water_mark=3)
+        collector = MessagesCollector(1)
+        publisher.subscribe(collector)
+        await asyncio.wait_for(drain(collector, len(missed) + 2, demand=1), 5)
+        await asyncio.sleep(0.05)
+        collector.subscription.request(10)
+        publisher.cancel()
+        return collector.ids
+
+    ids = asyncio.run(run())
+    assert ids == [message.id for message in missed + live]
@@ -1,3 +1,9 @@
+from datetime import datetime
+
+from app.models import Message
+from app.utils import message_model_as_schema
+
+
 def test_message_creation(user_account_crud, message_crud, user1, user2):
     message = message_crud.create('test', user1.id, user2.id)
     assert message.from_user.username == user1.username
@@ -47,3 +53,135 @@ def test_dialogs_getting(user_account_crud, message_crud, users):
     message_crud.create('to user1 #7', user4.id, user1.id)
     dialogs = message_crud.get_user_dialogs_users_ids(user1.id)
     assert len(dialogs) == 3
+
+
+def test_messages_batch_creation(message_crud, user1, user2):
+    messages = message_crud.create_many([('batch 1', user1.id, user2.id),
+                                         ('batch 2', user2.id, user1.id)])
+    assert [message.message_text for message in messages] == ['batch 1', 'batch 2']
+    assert messages[0].id < messages[1].id
+    assert message_crud.get_by_id(messages[1].id).from_user.id == user2.id
+
+
+def test_messages_batch_creation_rejects_unknown_users_only(message_crud, users):
+    user1, user2 = users[6], users[7]
+    messages = message_crud.create_many([('known 1', user1.id, user2.id),
+                                         ('unknown', user1.id, 99999),
+                                         ('known 2', user2.id, user1.id)])
+    assert isinstance(messages[1], Exception)
+    assert [message.message_text for message in messages[::2]] == ['known 1', 'known 2']
+    assert [message.id for message in message_crud.get_user_dialog(user1.id, user2.id)] == \
+           [message.id for message in messages[::2]]
+    assert message_crud.get_user_dialogs_users_ids(user1.id) == [user2.id]
+
+
+def test_dialog_keyset_pagination(message_crud, users):
+    user1 = users[4]
+    user2 = users[5]
+    messages = [message_crud.create(str(i), *((user1.id, user2.id) if i % 2 else (user2.id, user1.id)))
+                for i in range(7)]
+    ids = [message.id for message in messages]
+
+    last_page = message_crud.get_user_dialog(user1.id, user2.id, limit=3)
+    assert [message.id for message in last_page] == ids[-3:]
+
+    previous_page = message_crud.get_user_dialog(user1.id, user2.id, before_id=last_page[0].id, limit=3)
+    assert [message.id for message in previous_page] == ids[-6:-3]
+
+    next_page = message_crud.get_user_dialog(user1.id, user2.id, after_id=ids[1], limit=2)
+    assert [message.id for message in next_page] == ids[2:4]
+
+    between = message_crud.get_user_dialog(user2.id, user1.id, before_id=ids[5], after_id=ids[1])
+    assert [message.id for message in between] == ids[2:5]
+
+
+def test_user_dialogs_summary(message_crud, users):
+    user1 = users[6]
+    user2 = users[7]
+    user3 = users[8]
+
+    message_crud.create('to user1 #1', user2.id, user1.id)
+    message_crud.create('to user1 #2', user2.id, user1.id)
+    last_message = message_crud.create('to user3 #3', user1.id, user3.id)
+
+    dialogs = message_crud.get_user_dialogs(user1.id)
+    assert [dialog.with_user.id for dialog in dialogs] == [user3.id, user2.id]
+    assert dialogs[0].user.id == user1.id
+    assert dialogs[0].last_message_id == last_message.id
+
+
+def test_unread_counts_persistence(message_crud, users):
+    user1 = users[6]
+    user2 = users[7]
+    user3 = users[8]
+
+    message_crud.update_unread_counts([(user1.id, user2.id, 2), (user3.id, user1.id, 1)])
+    dialogs = message_crud.get_user_dialogs(user1.id)
+    assert [dialog.unread_count for dialog in dialogs] == [0, 2]
+    dialogs = message_crud.get_user_dialogs(user3.id)
+    assert [(dialog.with_user.id, dialog.unread_count) for dialog in dialogs] == [(user1.id, 1)]
+    assert {(user1.id, user2.id, 2), (user3.id, user1.id, 1)} <= set(message_crud.get_unread_counts())
+
+    message_crud.update_unread_counts([(user3.id, user1.id, 0)])
+    assert (user3.id, user1.id, 1) not in message_crud.get_unread_counts()
+
+
+def test_messages_search(message_crud, users):
+    user1 = users[8]
+    user2 = users[9]
+    outsider = users[0]
+    marker = f'needle{users[8].id}x'
+    older = message_crud.create(f'{marker} in a haystack', user1.id, user2.id)
+    newer = message_crud.create(f'another {marker}', user2.id, user1.id)
+    relevant = message_crud.create(f'{marker} {marker} {marker}', user1.id, user2.id)
+    message_crud.create(f'{marker} for someone else', outsider.id, users[1].id)
+
+    found = message_crud.search(user1.id, marker)
+    assert [message.id for message in found] == [relevant.id, newer.id, older.id]
+
+    found = message_crud.search(user1.id, marker, before_id=newer.id)
+    assert [message.id for message in found] == [older.id]
+
+    found = message_crud.search(user1.id, marker, by_relevance=True, limit=1)
+    assert [message.id for message in found] == [relevant.id]
+
+    found = message_crud.search(user1.id, f'{marker} haystack')
+    assert [message.id for message in found] == [older.id]
+
+    assert not message_crud.search(user1.id, marker, with_user_id=outsider.id)
+    assert not message_crud.search(user1.id, '"')
+
+
+def test_get_incoming(message_crud, users):
+    user1 = users[1]
+    user2 = users[2]
+    user3 = users[3]
+    sent = [message_crud.create(f'incoming {i}', user, user1.id) for i, user in
+            enumerate([user2.id, user3.id, user2.id])]
+    message_crud.create('outgoing', user1.id, user2.id)
+
+    assert [m.id for m in message_crud.get_incoming(user1.id, sent[0].id - 1)] == [m.id for m in sent]
+    assert [m.id for m in message_crud.get_incoming(user1.id, sent[0].id, limit=1)] == [sent[1].id]
+
+
+def test_message_rows_share_users(user_account_crud, message_crud):
+    sender = user_account_crud.create(f'rows_sender_{datetime.now()}')
+    receiver = user_account_crud.create(f'rows_receiver_{datetime.now()}')
+    for i in range(3):
+        message_crud.create(f'rows #{i}', sender.id, receiver.id)
+        message_crud.create(f'rows reply #{i}', receiver.id, sender.id)
+
+    messages = message_crud.get_user_dialog(sender.id, receiver.id)
+    assert len(messages) == 6
+    assert len({id(message.from_user) for message in messages}) == 2
+    assert messages[0].from_user == sender and messages[0].to_user == receiver
+    assert messages[0].model_dump()['from_user'] == {'id': sender.id, 'username': sender.username}
+
+
+def test_message_model_as_schema_keeps_model_intact(session, message_crud, users):
+    created = message_crud.create('intact', users[8].id, users[9].id)
+    with session() as s:
+        model = s.get(Message, created.id)
+        schema = message_model_as_schema(model)
+        assert schema.from_user.username == users[8].username
+        assert not isinstance(model.__dict__['from_user'], dict)
@@ -0,0 +1,126 @@
+import pytest
+from reactivestreams.subscriber import DefaultSubscriber
+
+from app.codecs import EncodedSchema, JSON_CODEC, get_codec
+from app.schemas import Message, User
+from app.services import MessageHub
+from app.streams import BufferedPublisher, OverflowStrategy
+
+
+def make_message(message_id: int, from_user_id: int, to_user_id: int) -> Message:
+    return Message(id=message_id, message_text=f'test {message_id}',
+                   from_user_id=from_user_id, to_user_id=to_user_id,
+                   from_user=User(id=from_user_id, username=str(from_user_id)),
+                   to_user=User(id=to_user_id, username=str(to_user_id)))
+
+
+def encode(message: Message) -> EncodedSchema:
+    return EncodedSchema(message, JSON_CODEC, JSON_CODEC.encode(message))
+
+
+def test_publish_reaches_only_recipient(message_hub):
+    first_device, second_device, other_user = [], [], []
+    message_hub.subscribe(1, lambda message, data: first_device.append((message, data)))
+    message_hub.subscribe(1, lambda message, data: second_device.append((message, data)))
+    message_hub.subscribe(2, lambda message, data: other_user.append((message, data)))
+
+    message = make_message(1, 2, 1)
+    encoded = EncodedSchema(message)
+    message_hub.publish(message, encoded)
+
+    assert [message.id for message, _ in first_device] == [1]
+    assert first_device[0][1] is second_device[0][1] is encoded
+    assert not other_user
+
+
+def test_unsubscribe(message_hub):
+    received = []
+
+    def callback(message, data):
+        received.append(message)
+
+    message_hub.subscribe(1, callback)
+    assert message_hub.get_subscribers_count(1) == 1
+    message_hub.unsubscribe(1, callback)
+    assert message_hub.get_subscribers_count(1) == 0
+    message = make_message(1, 2, 1)
+    message_hub.publish(message, encode(message))
+    assert not received
+
+
+def test_publish_to_members(message_hub):
+    received = {user_id: [] for user_id in range(5)}
+    for user_id in range(5):
+        message_hub.subscribe(user_id, lambda message, encoded, user_id=user_id:
+                              received[user_id].append(encoded.encode(JSON_CODEC)))
+    room_message, small_room_message = encode(make_message(1, 1, 0)), encode(make_message(2, 1, 0))
+
+    message_hub.publish_to({1, 2, 3, 100, 101, 102, 103}, room_message.schema, room_message, exclude_user_id=1)
+    message_hub.publish_to({3}, small_room_message.schema, small_room_message)
+
+    assert received[1] == received[0] == received[4] == []
+    assert received[2] == [room_message.encode(JSON_CODEC)]
+    assert received[3] == [room_message.encode(JSON_CODEC), small_room_message.encode(JSON_CODEC)]
+
+
+def test_publish_encodes_once_per_codec(message_hub):
+    msgpack_codec = get_codec('application/x-msgpack')
+    if msgpack_codec is None:
+        pytest.skip('msgpack is not installed')
+    received = {JSON_CODEC: [], msgpack_codec: []}
+    for codec in (JSON_CODEC, msgpack_codec, JSON_CODEC, msgpack_codec):
+        message_hub.subscribe(1, lambda message, encoded, codec=codec: received[codec].append(encoded.encode(codec)))
+
+    message = make_message(1, 2, 1)
+    data = JSON_CODEC.encode(message)
+    message_hub.publish_to({1}, message, EncodedSchema(message, JSON_CODEC, data))
+
+    first_json, second_json = received[JSON_CODEC]
+    assert first_json is second_json is data
+    first_msgpack, second_msgpack = received[msgpack_codec]
+    assert first_msgpack is second_msgpack
+    assert msgpack_codec.decode(first_msgpack, Message) == message
+
+
+def test_recent_messages():
+    message_hub = MessageHub(history_size=3)
+    assert message_hub.get_recent_messages(1, 0) is None
+    for message_id in range(10, 15):
+        message = make_message(message_id, 2, 1)
+        message_hub.publish(message, encode(message))
+
+    assert [encoded.schema.id for _, encoded in message_hub.get_recent_messages(1, 12)] == [13, 14]
+    assert message_hub.get_recent_messages(1, 11) is not None
+    assert message_hub.get_recent_messages(1, 10) is None
+    assert message_hub.get_recent_messages(1, 14) == []
+    assert message_hub.get_recent_messages(2, 12) is None
+
+
+def test_disconnected_device_does_not_skip_others(message_hub):
+    class DeviceStream(BufferedPublisher):
+        def __init__(self, name: str):
+            super().__init__(name, high_water_mark=1, overflow_strategy=OverflowStrategy.DISCONNECT)
+            message_hub.subscribe(1, self.send)
+
+        def cancel(self):
+            message_hub.unsubscribe(1, self.send)
+            super().cancel()
+
+        def send(self, message, encoded):
+            self.emit(encoded.encode(JSON_CODEC))
+
+    DeviceStream('slow device').subscribe(DefaultSubscriber())
+    received = []
+    message_hub.subscribe(1, lambda message, encoded: received.append(message.id))
+    for message_id in (1, 2):
+        message = make_message(message_id, 2, 1)
+        message_hub.publish(message, EncodedSchema(message))
+    assert received == [1, 2]
+    assert message_hub.get_subscribers_count(1) == 1
+
+    DeviceStream('slow room device').subscribe(DefaultSubscriber())
+    message_hub.subscribe(1, lambda message, encoded: received.append(message.id))
+    for message_id in (3, 4):
+        message = make_message(message_id, 2, 0)
+        message_hub.publish_to({1}, message, EncodedSchema(message))
+    assert received == [1, 2, 3, 3, 4, 4]
@@ -0,0 +1,83 @@
+import asyncio
+
+from app.schemas import GetUnreadRequest
+from app.services import NewMessagesStorage, ChatService
+from tests.test_message_hub import make_message
+
+
+def test_unread_counts_and_ring_buffer(async_message_crud):
+    storage = NewMessagesStorage(async_message_crud, max_pending=3)
+    for message_id in range(1, 6):
+        storage.add(make_message(message_id, 2, 1))
+    storage.add(make_message(6, 3, 1))
+
+    assert storage.get_new_messages_count(1, 2) == 5
+    assert [message.id for message in storage.get_new_messages(1, 2)] == [3, 4, 5]
+    assert storage.get_new_messages_count(2, 1) == 0
+    assert sorted(storage.get_unread_peers_ids(1)) == [2, 3]
+
+    storage.add(make_message(7, 1, 2))
+    assert storage.get_new_messages_count(1, 2) == 0
+    assert not storage.get_new_messages(1, 2)
+    assert storage.get_unread_peers_ids(1) == [3]
+    assert storage.get_new_messages_count(2, 1) == 1
+
+
+def test_get_unread(async_user_account_crud, async_message_crud):
+    storage = NewMessagesStorage(async_message_crud)
+    chat_service = ChatService(async_user_account_crud, async_message_crud, new_messages_storage=storage)
+    storage.add(make_message(1, 2, 1))
+    storage.add(make_message(2, 3, 1))
+    storage.add(make_message(3, 3, 1))
+
+    response = chat_service.get_unread(1, GetUnreadRequest(with_messages=True))
+    assert response.total == 3
+    assert {dialog.with_user_id: len(dialog.messages) for dialog in response.dialogs} == {2: 1, 3: 2}
+
+    response = chat_service.get_unread(1, GetUnreadRequest(with_user_id=3, mark_read=True))
+    assert response.total == 2 and not response.dialogs[0].messages
+    assert chat_service.get_unread(1, GetUnreadRequest()).total == 1
+
+
+def test_get_unread_without_storage(chat_service):
+    response = chat_service.get_unread(1, GetUnreadRequest())
+    assert not response.success and response.total == 0
+
+
+def test_counts_survive_restart(message_crud, async_message_crud, users):
+    user1, user2 = users[0], users[1]
+    messages = [message_crud.create(f'unread {i}', user2.id, user1.id) for i in range(3)]
+
+    async def scenario():
+        storage = NewMessagesStorage(async_message_crud)
+        for message in messages:
+            storage.add(message)
+        await storage.flush()
+
+        restarted = NewMessagesStorage(async_message_crud)
+        await restarted.load()
+        assert restarted.get_new_messages_count(user1.id, user2.id) == 3
+        restarted.mark_read(user1.id, user2.id, up_to_message_id=messages[0].id)
+        assert restarted.get_new_messages_count(user1.id, user2.id) == 3
+        restarted.mark_read(user1.id, user2.id)
+        await restarted.flush()
+
+        assert (user1.id, user2.id) not in {(user_id, peer_id) for user_id, peer_id, _ in
+                                            await async_message_crud.get_unread_counts()}
+
+    asyncio.run(scenario())
+
+
+def test_mark_read_up_to(async_message_crud):
+    storage = NewMessagesStorage(async_message_crud, max_pending=3)
+    for message_id in range(1, 6):
+        storage.add(make_message(message_id, 2, 1))
+
+    storage.mark_read(1, 2, up_to_message_id=1)
+    assert storage.get_new_messages_count(1, 2) == 5
+    storage.mark_read(1, 2, up_to_message_id=3)
+    assert storage.get_new_messages_count(1, 2) == 2
+    assert [message.id for message in storage.get_new_messages(1, 2)] == [4, 5]
+    storage.mark_read(1, 2, up_to_message_id=5)
+    assert storage.get_new_messages_count(1, 2) == 0
+    assert storage.get_unread_peers_ids(1) == []
@@ -0,0 +1,71 @@
+from app.presence import PresenceTracker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_tracker():
+    clock = FakeClock()
+    events = []
+    tracker = PresenceTracker(10, clock=clock)
+    tracker.subscribe(lambda session, user_id, online: events.append((session, user_id, online)))
+    return tracker, clock, events
+
+
+def test_touch_extends_deadline():
+    tracker, clock, events = make_tracker()
+    tracker.touch('s1', 1)
+    clock.now = 8
+    tracker.touch('s1', 1)
+    clock.now = 12
+    assert tracker.expire() == []
+    assert 's1' in tracker
+    clock.now = 18
+    assert tracker.expire() == ['s1']
+    assert events == [('s1', 1, True), ('s1', 1, False)]
+
+
+def test_user_online_while_any_session_online():
+    tracker, clock, events = make_tracker()
+    tracker.touch('s1', 1)
+    clock.now = 5
+    tracker.touch('s2', 1)
+    clock.now = 11
+    assert tracker.expire() == ['s1']
+    assert tracker.is_user_online(1)
+    tracker.remove('s2')
+    assert not tracker.is_user_online(1)
+    assert len(tracker) == 0
+    assert events[-1] == ('s2', 1, False)
+
+
+def test_stale_heap_entries_are_compacted():
+    tracker, clock, events = make_tracker()
+    for tick in range(1000):
+        clock.now = tick * 0.001
+        tracker.touch('s1', 1)
+    assert len(tracker._heap) <= 2 * len(tracker) + 64
+    assert events == [('s1', 1, True)]
+
+
+def test_remote_sessions():
+    tracker, clock, events = make_tracker()
+    tracker.touch('local', 1)
+    tracker.set_remote('remote', 1, True)
+    tracker.set_remote('local', 1, True)
+    assert len(tracker) == 2
+    assert tracker.get_user_sessions_count(1) == 2
+    assert tracker.is_remote('remote') and not tracker.is_remote('local')
+
+    clock.now = 20
+    assert tracker.expire() == ['local']
+    assert 'remote' in tracker
+    tracker.set_remote('remote', 1, False)
+    assert not tracker.is_user_online(1)
+    assert not tracker.is_remote('remote')
+    assert events == [('local', 1, True), ('remote', 1, True), ('local', 1, False), ('remote', 1, False)]
@@ -0,0 +1,61 @@
+import asyncio
+
+from app.schemas import Receipt
+from app.services import ReceiptsStorage
+
+
+def test_watermarks_only_move_forward(async_message_crud):
+    storage = ReceiptsStorage(async_message_crud)
+
+    async def scenario():
+        receipt = await storage.update(1, 2, delivered_message_id=10)
+        assert (receipt.delivered_message_id, receipt.read_message_id) == (10, None)
+        assert await storage.update(1, 2, delivered_message_id=5) is None
+        receipt = await storage.update(1, 2, read_message_id=12)
+        assert (receipt.delivered_message_id, receipt.read_message_id) == (12, 12)
+        assert await storage.update(1, 2, delivered_message_id=12, read_message_id=3) is None
+
+    asyncio.run(scenario())
+    assert storage.get(1, 2) == (12, 12)
+    assert storage.get(2, 1) == (None, None)
+
+
+def test_receipts_are_persisted(message_crud, async_message_crud, users):
+    user1, user2 = users[4], users[5]
+    messages = [message_crud.create(f'receipt {i}', user1.id, user2.id) for i in range(3)]
+
+    async def scenario():
+        storage = ReceiptsStorage(async_message_crud)
+        await storage.update(user2.id, user1.id, delivered_message_id=messages[2].id)
+        await storage.update(user2.id, user1.id, read_message_id=messages[1].id)
+        await storage.flush()
+
+        restarted = ReceiptsStorage(async_message_crud)
+        assert await restarted.update(user2.id, user1.id, read_message_id=messages[0].id) is None
+        await restarted.flush()
+
+    asyncio.run(scenario())
+    dialog, = [dialog for dialog in message_crud.get_user_dialogs(user1.id) if dialog.with_user.id == user2.id]
+    assert dialog.peer_delivered_message_id == messages[2].id
+    assert dialog.peer_read_message_id == messages[1].id
+
+
+def test_evicted_watermarks_are_read_back(message_crud, async_message_crud, users):
+    user1, user2, user3 = users[6], users[7], users[8]
+    messages = [message_crud.create(f'evicted {i}', user1.id, user2.id) for i in range(3)]
+    message_crud.create('other dialog', user1.id, user3.id)
+
+    async def scenario():
+        storage = ReceiptsStorage(async_message_crud, max_dialogs=1)
+        await storage.update(user2.id, user1.id, read_message_id=messages[2].id)
+        await storage.flush()
+        await storage.update(user3.id, user1.id, delivered_message_id=1)
+        assert await storage.update(user2.id, user1.id, read_message_id=messages[0].id) is None
+        receipt = await storage.update(user2.id, user1.id, delivered_message_id=messages[2].id + 1)
+        assert (receipt.delivered_message_id, receipt.read_message_id) == (messages[2].id + 1, messages[2].id)
+
+        storage.remember(Receipt(user_id=user2.id, peer_id=user1.id, delivered_message_id=messages[2].id + 5,
+                                 read_message_id=messages[2].id + 5))
+        assert await storage.update(user2.id, user1.id, read_message_id=messages[2].id + 2) is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,64 @@
+import asyncio
+
+from app.schemas import CreateRoomRequest, AddRoomMembersRequest, SendRoomMessageRequest, GetRoomMessagesRequest, \
+    GetRoomsRequest
+from app.services import RoomMembershipIndex
+
+
+def test_room_crud(room_crud, users):
+    owner, member, stranger = users[0], users[1], users[2]
+    room = room_crud.create('crud room', owner.id, [member.id, owner.id])
+    assert sorted(room_crud.get_members_ids(room.id)) == sorted([owner.id, member.id])
+
+    room_crud.add_members(room.id, [member.id, stranger.id])
+    assert sorted(room_crud.get_members_ids(room.id)) == sorted([owner.id, member.id, stranger.id])
+    assert room.id in [user_room.id for user_room in room_crud.get_user_rooms(stranger.id)]
+
+    messages = room_crud.create_messages([(room.id, owner.id, f'room message {i}') for i in range(5)])
+    ids = [message.id for message in messages]
+    assert [m.id for m in room_crud.get_room_messages(room.id, limit=2)] == ids[3:]
+    assert [m.id for m in room_crud.get_room_messages(room.id, before_id=ids[3], limit=2)] == ids[1:3]
+    assert [m.id for m in room_crud.get_room_messages(room.id, after_id=ids[0], limit=2)] == ids[1:3]
+
+
+def test_room_service(room_service, users):
+    owner, member, stranger = users[3], users[4], users[5]
+
+    async def scenario():
+        room = (await room_service.create_room(owner.id, CreateRoomRequest(name='service room',
+                                                                           members_ids=[member.id]))).room
+        denied = await room_service.send_room_message(stranger.id, SendRoomMessageRequest(room_id=room.id,
+                                                                                          message_text='hi'))
+        assert not denied.success
+        await room_service.add_members(member.id, AddRoomMembersRequest(room_id=room.id, users_ids=[stranger.id]))
+        sent = [(await room_service.send_room_message(user.id, SendRoomMessageRequest(
+            room_id=room.id, message_text=f'hi from {user.username}'))).message for user in (owner, member, stranger)]
+        page = await room_service.get_room_messages(stranger.id, GetRoomMessagesRequest(room_id=room.id, limit=2))
+        assert page.has_more
+        assert [message.id for message in page.messages] == [message.id for message in sent[1:]]
+        rooms = await room_service.get_rooms(stranger.id, GetRoomsRequest())
+        assert room.id in [user_room.id for user_room in rooms.rooms]
+        assert await room_service.get_members(room.id) == {owner.id, member.id, stranger.id}
+
+    asyncio.run(scenario())
+
+
+def test_membership_index_is_loaded_once(room_crud, async_room_crud, users):
+    room = room_crud.create('index room', users[6].id, [users[7].id])
+
+    class CountingRoomCRUD:
+        loads = 0
+
+        async def get_members_ids(self, room_id):
+            CountingRoomCRUD.loads += 1
+            return await async_room_crud.get_members_ids(room_id)
+
+    async def scenario():
+        index = RoomMembershipIndex(CountingRoomCRUD())
+        assert await index.is_member(room.id, users[7].id)
+        assert not await index.is_member(room.id, users[8].id)
+        index.add_members(room.id, [users[8].id])
+        assert await index.is_member(room.id, users[8].id)
+
+    asyncio.run(scenario())
+    assert CountingRoomCRUD.loads == 1
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+from app.cruds import SessionCRUD, AsyncSessionCRUD
+from app.schemas import User
+from app.sessions import ShardedSessionStore, PersistentSessionStore
+from tests.test_presence import FakeClock
+
+
+def test_sessions_lookup_and_listing():
+    store = ShardedSessionStore(ttl_s=10, shards=4)
+    alice, bob = User(id=1, username='alice'), User(id=2, username='bob')
+    first, second, third = store.create(alice), store.create(alice), store.create(bob)
+
+    assert len({first, second, third}) == 3
+    assert len(first) >= 32
+    assert store.get(first) == alice and third in store
+    assert sorted(store.get_user_sessions(alice.id)) == sorted([first, second])
+    assert store.remove(first) == alice
+    assert first not in store
+    assert store.get_user_sessions(alice.id) == [second]
+    assert store.remove(first) is None
+
+
+def test_sessions_expire_unless_touched():
+    clock = FakeClock()
+    store = ShardedSessionStore(ttl_s=10, shards=4, clock=clock)
+    user = User(id=1, username='alice')
+    touched, idle = store.create(user), store.create(user)
+
+    clock.now = 8
+    store.touch(touched)
+    clock.now = 12
+    assert idle not in store
+    assert store.expire() == [idle]
+    assert touched in store
+    clock.now = 18
+    assert store.expire() == [touched]
+    assert len(store) == 0
+    assert store.get_user_sessions(user.id) == []
+
+
+def test_sessions_survive_restart(session, db_executor, users):
+    session_crud = AsyncSessionCRUD(SessionCRUD(session), db_executor)
+    user = users[0]
+
+    async def scenario():
+        store = PersistentSessionStore(session_crud, ttl_s=60)
+        kept, removed = store.create(user), store.create(user)
+        await store.flush()
+        store.remove(removed)
+        await store.flush()
+
+        restarted = PersistentSessionStore(session_crud, ttl_s=60)
+        await restarted.load()
+        assert restarted.get(kept) == user
+        assert removed not in restarted
+        restarted.remove(kept)
+        await restarted.flush()
+
+    asyncio.run(scenario())
+
+
+def test_remote_sessions_are_not_deleted_by_other_workers(session, db_executor, users):
+    session_crud = AsyncSessionCRUD(SessionCRUD(session), db_executor)
+    user = users[1]
+    clock = FakeClock()
+    clock.now = time.time()
+
+    async def scenario():
+        owner = PersistentSessionStore(session_crud, ttl_s=60, clock=clock)
+        other = PersistentSessionStore(session_crud, ttl_s=60, clock=clock)
+        user_session = owner.create(user)
+        other.add(user_session, user, owned=False)
+        await owner.flush()
+
+        clock.now += 50
+        owner.touch(user_session)
+        await owner.flush()
+        clock.now += 20
+        assert other.expire() == [user_session]
+        await other.flush()
+        assert user_session in {session for session, _, _ in await session_crud.get_active(clock.now)}
+
+        other.add(user_session, user, owned=False)
+        other.touch(user_session)
+        await other.flush()
+        expires_at = {session: expires_at for session, _, expires_at in await session_crud.get_active(clock.now)}
+        assert expires_at[user_session] == other.get_expires_at(user_session)
+        other.remove(user_session)
+        await other.flush()
+
+    asyncio.run(scenario())
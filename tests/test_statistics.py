@@ -0,0 +1,109 @@
+import asyncio
+
+from app.presence import PresenceTracker
+from app.schemas import TotalOnlineMetric
+from app.statistics import StatisticsBroadcaster
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_broadcaster():
+    clock = FakeClock()
+    tracker = PresenceTracker(100, clock=clock)
+    return StatisticsBroadcaster(tracker, clock=clock), tracker, clock
+
+
+def test_total_is_serialized_once_per_tick():
+    broadcaster, tracker, clock = make_broadcaster()
+    first, second = [], []
+    broadcaster.subscribe(first.append, 5)
+    broadcaster.subscribe(second.append, 5)
+    tracker.touch('s1', 1)
+
+    broadcaster.tick()
+    assert first[0] is second[0]
+    assert TotalOnlineMetric.model_validate_json(first[0]).total == 1
+
+    clock.now = 3
+    broadcaster.tick()
+    assert len(first) == 1
+    clock.now = 5
+    broadcaster.tick()
+    assert len(first) == 2
+
+
+def test_watched_ids_get_deltas():
+    broadcaster, tracker, clock = make_broadcaster()
+    tracker.touch('s1', 1)
+    received = []
+    subscription = broadcaster.subscribe(received.append, 1, ids=[1, 2])
+
+    broadcaster.tick()
+    metric = TotalOnlineMetric.model_validate_json(received[-1])
+    assert (metric.online, metric.offline) == ([1], [2])
+
+    clock.now = 1
+    tracker.touch('s2', 2)
+    tracker.touch('s3', 1)
+    tracker.touch('s4', 3)
+    broadcaster.tick()
+    metric = TotalOnlineMetric.model_validate_json(received[-1])
+    assert (metric.total, metric.online, metric.offline) == (4, [2], [])
+
+    clock.now = 2
+    tracker.remove('s1')
+    broadcaster.tick()
+    metric = TotalOnlineMetric.model_validate_json(received[-1])
+    assert (metric.online, metric.offline) == ([], [])
+
+    clock.now = 3
+    tracker.remove('s3')
+    broadcaster.update(subscription, 1, ids=[1])
+    broadcaster.tick()
+    metric = TotalOnlineMetric.model_validate_json(received[-1])
+    assert (metric.online, metric.offline) == ([], [1])
+
+    broadcaster.unsubscribe(subscription)
+    assert len(broadcaster) == 0
+
+
+def test_subscriber_disconnected_during_tick():
+    broadcaster, tracker, clock = make_broadcaster()
+    received = []
+    subscriptions = []
+
+    def disconnect(data: bytes):
+        broadcaster.unsubscribe(subscriptions[0])
+
+    subscriptions.append(broadcaster.subscribe(disconnect, 1))
+    broadcaster.subscribe(received.append, 1)
+    broadcaster.tick()
+    assert len(received) == 1
+    assert len(broadcaster) == 1
+
+
+def test_run_survives_failed_tick():
+    clock = FakeClock()
+    broadcaster = StatisticsBroadcaster(PresenceTracker(100, clock=clock), resolution_s=0.001, clock=clock)
+    received = []
+
+    def emit(data: bytes):
+        received.append(data)
+        if len(received) == 1:
+            raise RuntimeError('emit failed')
+
+    broadcaster.subscribe(emit, 0)
+
+    async def run():
+        task = asyncio.create_task(broadcaster.run())
+        while len(received) < 2:
+            await asyncio.sleep(0.001)
+        task.cancel()
+
+    asyncio.run(asyncio.wait_for(run(), 5))
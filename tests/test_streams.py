@@ -0,0 +1,74 @@
+from reactivestreams.subscriber import DefaultSubscriber
+
+from app.streams import BufferedPublisher, OverflowStrategy, BufferOverflowError, get_buffers_metrics
+
+
+class CollectingSubscriber(DefaultSubscriber):
+    def __init__(self):
+        super().__init__()
+        self.received = []
+        self.errors = []
+
+    def on_next(self, value, is_complete=False):
+        self.received.append(value.data)
+
+    def on_error(self, exception: Exception):
+        self.errors.append(exception)
+
+
+def make_publisher(name: str, overflow_strategy: OverflowStrategy) -> (BufferedPublisher, CollectingSubscriber):
+    publisher = BufferedPublisher(name, high_water_mark=2, overflow_strategy=overflow_strategy)
+    subscriber = CollectingSubscriber()
+    publisher.subscribe(subscriber)
+    return publisher, subscriber
+
+
+def test_emits_only_requested():
+    publisher, subscriber = make_publisher('test_emits_only_requested', OverflowStrategy.DROP_OLDEST)
+    publisher.emit(b'1')
+    assert not subscriber.received
+    assert publisher.buffered_bytes == 1
+
+    publisher.request(2)
+    publisher.emit(b'2')
+    publisher.emit(b'3')
+    assert subscriber.received == [b'1', b'2']
+    assert publisher.buffered_bytes == 1
+    publisher.cancel()
+
+
+def test_drop_oldest():
+    publisher, subscriber = make_publisher('test_drop_oldest', OverflowStrategy.DROP_OLDEST)
+    for data in (b'1', b'2', b'3'):
+        publisher.emit(data)
+    publisher.request(10)
+    assert subscriber.received == [b'2', b'3']
+    publisher.cancel()
+
+
+def test_drop_newest():
+    publisher, subscriber = make_publisher('test_drop_newest', OverflowStrategy.DROP_NEWEST)
+    for data in (b'1', b'2', b'3'):
+        publisher.emit(data)
+    publisher.request(10)
+    assert subscriber.received == [b'1', b'2']
+    publisher.cancel()
+
+
+def test_disconnect():
+    publisher, subscriber = make_publisher('test_disconnect', OverflowStrategy.DISCONNECT)
+    for data in (b'1', b'2', b'3'):
+        publisher.emit(data)
+    assert isinstance(subscriber.errors[0], BufferOverflowError)
+    assert publisher.buffered_bytes == 0
+    publisher.request(10)
+    assert not subscriber.received
+
+
+def test_buffers_metrics():
+    publisher, subscriber = make_publisher('test_buffers_metrics', OverflowStrategy.DROP_OLDEST)
+    publisher.emit(b'123')
+    metrics = {metric.subscriber: metric for metric in get_buffers_metrics()}
+    assert metrics['test_buffers_metrics'].buffered_bytes == 3
+    publisher.cancel()
+    assert 'test_buffers_metrics' not in {metric.subscriber for metric in get_buffers_metrics()}
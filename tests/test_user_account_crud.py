@@ -48,3 +48,13 @@ def test_user_finding_by_username_part(user_account_crud):
                 break
         else:
             raise Exception(f'wrong found user: {found_user.username} not in {found_usernames}')
+
+
+def test_user_finding_ranks_prefix_matches_first(user_account_crud):
+    marker = f'rank{datetime.now().timestamp()}'
+    contains = user_account_crud.create(f'a_{marker}')
+    prefix = user_account_crud.create(f'{marker}_longer_name')
+    found_users = user_account_crud.find_by_username_part(marker.upper())
+    assert [user.id for user in found_users] == [prefix.id, contains.id]
+    found_users = user_account_crud.find_by_username_part(marker, 1)
+    assert [user.id for user in found_users] == [prefix.id]